@@ -0,0 +1,150 @@
+import os
+import sys
+import json
+import time
+import types
+import shutil
+import argparse
+import resource
+import tempfile
+import contextlib
+import yaml
+from embodiedbench.benchmark.mock_env import MockEnv, MockAlfEnv, MockHabEnv, MockNavEnv, MockRecording
+from embodiedbench.benchmark.mock_model import MockModel
+from embodiedbench.main import logger, get_evaluator
+
+# Runs the real EB_*Evaluator loops against MockEnv and MockModel, so harness regressions can be
+# measured on CPU-only machines without AI2-THOR or Habitat installed.
+# Usage: python -m embodiedbench.benchmark.harness --env eb-alf --num_episodes 20 --model_latency 0.05
+
+# simulator module substituted for each environment: module name, env class name, mock class, eval sets
+MOCKED_ENVS = {
+    "eb-alf": ("embodiedbench.envs.eb_alfred.EBAlfEnv", "EBAlfEnv", MockAlfEnv,
+               ['base', 'common_sense', 'complex_instruction', 'spatial', 'visual_appearance', 'long_horizon']),
+    "eb-hab": ("embodiedbench.envs.eb_habitat.EBHabEnv", "EBHabEnv", MockHabEnv,
+               ['base', 'common_sense', 'complex_instruction', 'spatial_relationship', 'visual_appearance', 'long_horizon']),
+    "eb-nav": ("embodiedbench.envs.eb_navigation.EBNavEnv", "EBNavigationEnv", MockNavEnv,
+               ["base", "common_sense", "complex_instruction", "visual_appearance", "long_horizon"]),
+}
+config_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'configs')
+
+
+def install_mocks(env_name):
+    """
+    Replace the simulator module of env_name and the remote model module in sys.modules. Must be
+    called before the evaluator module is imported.
+    """
+    if env_name not in MOCKED_ENVS:
+        raise ValueError(f"Benchmark supports {list(MOCKED_ENVS)}, got {env_name}")
+    module_name, class_name, mock_class, eval_sets = MOCKED_ENVS[env_name]
+
+    # the eb_habitat package imports habitat on init, keep it as a bare package
+    package_name = module_name.rsplit('.', 1)[0]
+    if package_name not in sys.modules:
+        package = types.ModuleType(package_name)
+        package.__path__ = [os.path.join(os.path.dirname(config_dir), *package_name.split('.')[1:])]
+        sys.modules[package_name] = package
+
+    env_module = types.ModuleType(module_name)
+    setattr(env_module, class_name, mock_class)
+    env_module.ValidEvalSets = eval_sets
+    env_module.load_dataset_split = lambda eval_set, down_sample_ratio=1.0: list(range(MockEnv.num_episodes))
+    sys.modules[module_name] = env_module
+
+    model_module = types.ModuleType('embodiedbench.planner.remote_model')
+    model_module.RemoteModel = MockModel
+    sys.modules['embodiedbench.planner.remote_model'] = model_module
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 ** 2) if sys.platform == 'darwin' else peak / 1024
+
+
+def run_benchmark(env_name, num_episodes=10, model_latency=0.0, plan_length=3, episode_length=10,
+                  recording=None, eval_set='base', pipeline_reset=False, lockstep_envs=1, work_dir=None, quiet=True):
+    install_mocks(env_name)
+    MockEnv.num_episodes = num_episodes
+    MockEnv.episode_length = episode_length
+    MockEnv.recording = MockRecording(recording, max_episodes=num_episodes) if recording else None
+    MockModel.latency = model_latency
+    MockModel.plan_length = plan_length
+
+    with open(os.path.join(config_dir, f"{env_name}.yaml"), 'r') as f:
+        config = yaml.safe_load(f)
+    config.update({
+        'model_name': 'mock-model',
+        # lockstep batching is only used with local models
+        'model_type': 'local' if lockstep_envs > 1 else 'remote',
+        'exp_name': 'benchmark',
+        'eval_sets': [eval_set],
+        'down_sample_ratio': 1.0,
+        'num_workers': 1,
+        'pipeline_reset': pipeline_reset,
+        'lockstep_envs': lockstep_envs,
+        'resume': False,
+    })
+
+    # the evaluators write under the relative running/ folder
+    owns_work_dir = work_dir is None
+    work_dir = work_dir or tempfile.mkdtemp(prefix='eb_benchmark_')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    baseline_rss = peak_rss_mb()
+    try:
+        evaluator = get_evaluator(env_name)(config)
+        evaluator.check_config_valid()
+        MockEnv.total_steps = 0
+        MockModel.total_calls = 0
+        output = open(os.devnull, 'w') if quiet else sys.stdout
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            evaluator.evaluate_main()
+        elapsed = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        if owns_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    num_steps = max(MockEnv.total_steps, 1)
+    model_seconds = MockModel.total_calls * model_latency
+    return {
+        'env': env_name,
+        'num_episodes': num_episodes,
+        'num_steps': MockEnv.total_steps,
+        'num_model_calls': MockModel.total_calls,
+        'elapsed_seconds': elapsed,
+        'episodes_per_second': num_episodes / elapsed,
+        'harness_overhead_ms_per_step': (elapsed - model_seconds) / num_steps * 1000,
+        'baseline_peak_rss_mb': baseline_rss,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the evaluation harness with a mock simulator and model.')
+    parser.add_argument('--env', type=str, default='eb-alf', choices=list(MOCKED_ENVS), help='Evaluator to benchmark.')
+    parser.add_argument('--num_episodes', type=int, default=10, help='Number of episodes to run.')
+    parser.add_argument('--model_latency', type=float, default=0.0, help='Seconds the mock model waits per request.')
+    parser.add_argument('--plan_length', type=int, default=3, help='Number of actions in each canned plan.')
+    parser.add_argument('--episode_length', type=int, default=10, help='Steps until a synthetic episode succeeds.')
+    parser.add_argument('--recording', type=str, help='Log folder of a previous run whose frames and step logs are replayed.')
+    parser.add_argument('--eval_set', type=str, default='base', help='Eval set name used for the log folders.')
+    parser.add_argument('--pipeline_reset', type=int, default=0, help='Set to True to benchmark pipelined episode resets (EB-ALFRED).')
+    parser.add_argument('--lockstep_envs', type=int, default=1, help='Number of lockstep environments sharing batched model calls (EB-ALFRED).')
+    parser.add_argument('--work_dir', type=str, help='Folder for the run outputs, a temporary folder by default.')
+    parser.add_argument('--output', type=str, help='Write the report as JSON to this file.')
+    parser.add_argument('--verbose', action='store_true', help='Show the evaluator output.')
+    args = parser.parse_args()
+
+    if not args.verbose:
+        logger.setLevel('WARNING')
+    recording = os.path.abspath(args.recording) if args.recording else None
+    report = run_benchmark(args.env, args.num_episodes, args.model_latency, args.plan_length, args.episode_length,
+                           recording=recording, eval_set=args.eval_set, pipeline_reset=bool(args.pipeline_reset),
+                           lockstep_envs=args.lockstep_envs, work_dir=args.work_dir, quiet=not args.verbose)
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
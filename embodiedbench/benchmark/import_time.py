@@ -0,0 +1,96 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+# Measures the import cost paid by `python -m embodiedbench.main` before an evaluator starts, in fresh
+# interpreters, and fails if it exceeds a budget or if a provider SDK is imported eagerly again.
+# Usage: python -m embodiedbench.benchmark.import_time --max_seconds 3
+
+# modules imported at startup, the evaluators are excluded since they load the simulators
+STARTUP_MODULES = [
+    'embodiedbench.main',
+    'embodiedbench.planner.vlm_planner',
+    'embodiedbench.planner.nav_planner',
+]
+# heavy SDKs that must only be imported once their provider is selected
+LAZY_MODULES = ['anthropic', 'google.generativeai', 'openai', 'azure.identity', 'lmdeploy', 'torch']
+
+IMPORT_SCRIPT = '''
+import sys, json, time, resource
+start = time.perf_counter()
+{imports}
+seconds = time.perf_counter() - start
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{
+    "seconds": seconds,
+    "peak_rss_mb": peak / (1024 ** 2) if sys.platform == "darwin" else peak / 1024,
+    "eager_modules": [m for m in {lazy_modules!r} if m in sys.modules],
+}}))
+'''
+repo_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_importtime(stderr, top=10):
+    """Top-level packages with the largest cumulative import time, from `python -X importtime`."""
+    cumulative = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative_us, name = line[len('import time:'):].split('|')
+        # top-level imports are the ones without indentation
+        if name.startswith(' ') and not name.startswith('  '):
+            package = name.strip()
+            cumulative[package] = cumulative.get(package, 0) + int(cumulative_us) / 1e6
+    return sorted(cumulative.items(), key=lambda x: -x[1])[:top]
+
+
+def measure_import(modules=STARTUP_MODULES, repeats=5, top=10):
+    script = IMPORT_SCRIPT.format(imports='\n'.join(f'import {m}' for m in modules), lazy_modules=LAZY_MODULES)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([repo_root, os.environ.get('PYTHONPATH', '')]))
+    runs = []
+    # embodiedbench.main links the habitat data folder into the working directory
+    with tempfile.TemporaryDirectory(prefix='eb_import_') as work_dir:
+        for _ in range(repeats):
+            result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], cwd=work_dir, env=env,
+                                    capture_output=True, text=True)
+            if result.returncode != 0:
+                raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+            runs.append(json.loads(result.stdout.strip().splitlines()[-1]))
+    return {
+        'modules': modules,
+        'repeats': repeats,
+        'median_seconds': statistics.median(r['seconds'] for r in runs),
+        'min_seconds': min(r['seconds'] for r in runs),
+        'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+        'eager_modules': runs[-1]['eager_modules'],
+        'slowest_imports': parse_importtime(result.stderr, top),
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the import time of the evaluation entry point.')
+    parser.add_argument('--modules', type=str, default=','.join(STARTUP_MODULES), help='Comma separated modules to import.')
+    parser.add_argument('--repeats', type=int, default=5, help='Number of fresh interpreters to time.')
+    parser.add_argument('--top', type=int, default=10, help='Number of slowest imports to report.')
+    parser.add_argument('--max_seconds', type=float, help='Fail if the median import time is above this budget.')
+    parser.add_argument('--output', type=str, help='Write the report as JSON to this file.')
+    args = parser.parse_args()
+
+    report = measure_import(args.modules.split(','), args.repeats, args.top)
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+    failures = []
+    if len(report['eager_modules']):
+        failures.append(f"provider SDKs imported at startup: {report['eager_modules']}")
+    if args.max_seconds is not None and report['median_seconds'] > args.max_seconds:
+        failures.append(f"median import time {report['median_seconds']:.2f}s is above {args.max_seconds:.2f}s")
+    if len(failures):
+        print('FAILED: ' + '; '.join(failures), file=sys.stderr)
+        sys.exit(1)
@@ -0,0 +1,178 @@
+import os
+import re
+import glob
+import json
+import time
+import numpy as np
+from PIL import Image
+from embodiedbench.planner.image_encoder import image_encoder
+
+# size of the action space of the mock environments, MockModel plans within it
+MOCK_NUM_ACTIONS = 40
+STEP_LOG_PATTERN = r'episode_(\d+)_step_(\d+)\.json'
+
+
+class MockRecording():
+    """
+    Frames and step metadata of a logged run (running/<env>/<exp>/<eval_set>), replayed by
+    MockEnv in place of a simulator. Only the episodes that have a step log are used.
+    """
+    def __init__(self, log_dir, max_episodes=None):
+        latest = {}
+        for filename in os.listdir(log_dir):
+            match = re.fullmatch(STEP_LOG_PATTERN, filename)
+            if match is not None:
+                latest[int(match.group(1))] = os.path.join(log_dir, filename)
+        episode_indexes = sorted(latest)[:max_episodes]
+
+        self.episodes = []
+        for idx in episode_indexes:
+            with open(latest[idx], 'r', encoding='utf-8') as f:
+                steps = [json.loads(line) for line in f if line.strip()]
+            # invalid (-1) and empty (-2) plans did not step the simulator
+            steps = [step for step in steps if step.get('action_id', -1) not in (-1, -2)]
+            frame_paths = glob.glob(os.path.join(log_dir, 'images', 'episode_{}'.format(idx), '*_step_*.*'))
+            frame_paths.sort(key=lambda p: int(re.search(r'step_(\d+)', p).group(1)))
+            frames = [np.array(Image.open(p).convert('RGB')) for p in frame_paths]
+            if len(steps) and len(frames):
+                self.episodes.append({'instruction': steps[0].get('instruction', ''), 'steps': steps, 'frames': frames})
+        if not len(self.episodes):
+            raise ValueError(f"No replayable episodes (step logs with images) found in {log_dir}")
+
+
+class MockEnv():
+    """
+    Stand-in for EBAlfEnv / EBHabEnv / EBNavigationEnv with the attributes and methods the
+    evaluators use. Observations and step feedback come from a MockRecording if one is set,
+    otherwise from synthetic frames and an episode that succeeds after episode_length steps.
+    Images and step logs are written like the real environments, so the harness cost is kept.
+    """
+    # configured by the benchmark before the evaluator is created
+    recording = None
+    num_episodes = 10
+    episode_length = 10
+    log_root = 'running/mock'
+    total_steps = 0
+
+    def __init__(self, eval_set='base', exp_name='', down_sample_ratio=1.0, selected_indexes=[], resolution=500, **kwargs):
+        self.eval_set = eval_set
+        self.resolution = resolution
+        self.selected_indexes = selected_indexes
+        self.number_of_episodes = len(selected_indexes) if len(selected_indexes) else self.num_episodes
+        self.language_skill_set = ['mock action {}'.format(i) for i in range(MOCK_NUM_ACTIONS)]
+        self.log_path = '{}/{}'.format(self.log_root, exp_name)
+        self._reset = False
+        self._current_episode_num = 0
+        self._current_step = 0
+        self._max_episode_steps = 30
+        self._cur_invalid_actions = 0
+        self._max_invalid_actions = 10
+        self._episode_start_time = 0
+        self.episode_log = []
+        self.episode_language_instruction = ''
+        self.episode = None
+        self.frame = None
+        rng = np.random.default_rng(0)
+        self.synthetic_frame = rng.integers(0, 255, (resolution, resolution, 3), dtype=np.uint8)
+
+    def episode_idx(self):
+        return self._current_episode_num if not len(self.selected_indexes) else self.selected_indexes[self._current_episode_num - 1] + 1
+
+    def prepare_episode(self, episode_num):
+        return {'episode_num': episode_num}
+
+    def skip_episode(self):
+        self._current_episode_num += 1
+
+    def reset(self, prepared=None, **kwargs):
+        assert self._current_episode_num < self.number_of_episodes
+        if self.recording is not None:
+            self.episode = self.recording.episodes[self._current_episode_num % len(self.recording.episodes)]
+            self.episode_language_instruction = self.episode['instruction']
+        else:
+            self.episode_language_instruction = 'mock instruction of episode {}'.format(self._current_episode_num)
+        self._current_episode_num += 1
+        self._current_step = 0
+        self._cur_invalid_actions = 0
+        self._reset = True
+        self.episode_log = []
+        self._episode_start_time = time.time()
+        return self.get_obs()
+
+    def get_obs(self):
+        if self.episode is not None:
+            frames = self.episode['frames']
+            self.frame = frames[min(self._current_step, len(frames) - 1)]
+        else:
+            self.frame = self.synthetic_frame
+        return {'head_rgb': self.frame}
+
+    def step(self, action, reasoning='', *args, **kwargs):
+        assert self._reset, 'Reset env before stepping'
+        MockEnv.total_steps += 1
+        self._current_step += 1
+        if self.episode is not None:
+            steps = self.episode['steps']
+            recorded = steps[min(self._current_step, len(steps)) - 1]
+            success = float(recorded.get('last_action_success', 1.0))
+            task_success = float(recorded.get('task_success', 0.0))
+            feedback = recorded.get('env_feedback', '')
+            episode_end = self._current_step >= len(steps)
+        else:
+            success = 1.0
+            episode_end = self._current_step >= self.episode_length
+            task_success = float(episode_end)
+            feedback = 'Last action executed successfully.'
+        if not success:
+            self._cur_invalid_actions += 1
+        done = episode_end or self._current_step >= self._max_episode_steps or self._cur_invalid_actions >= self._max_invalid_actions
+
+        info = {
+            'instruction': self.episode_language_instruction,
+            'env_step': self._current_step,
+            'env_feedback': feedback,
+            'episode_elapsed_seconds': time.time() - self._episode_start_time,
+            'last_action_success': success,
+            'task_success': task_success,
+            'task_progress': task_success,
+            'subgoal_reward': task_success,
+            'action_id': action,
+            'action_description': self.language_skill_set[action] if type(action) == int else action,
+            'reasoning': reasoning,
+        }
+        self.episode_log.append(info)
+        return self.get_obs(), task_success, done, info
+
+    def save_image(self, *args, **kwargs):
+        episode_idx = self.episode_idx()
+        folder = self.log_path + '/images/episode_{}'.format(episode_idx)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        image_path = os.path.join(folder, 'episode_{}_step_{}.png'.format(episode_idx, self._current_step))
+        image_path = image_encoder.save(self.frame, image_path)
+        return image_path
+
+    def save_episode_log(self):
+        if not os.path.exists(self.log_path):
+            os.makedirs(self.log_path)
+        filename = 'episode_{}_step_{}.json'.format(self.episode_idx(), self._current_step)
+        if len(self.episode_log):
+            with open(os.path.join(self.log_path, filename), 'w', encoding='utf-8') as f:
+                for item in self.episode_log:
+                    json.dump(item, f, ensure_ascii=False)
+                    f.write('\n')
+
+    def close(self):
+        pass
+
+
+class MockAlfEnv(MockEnv):
+    log_root = 'running/eb_alfred'
+
+
+class MockHabEnv(MockEnv):
+    log_root = 'running/eb_habitat'
+
+
+class MockNavEnv(MockEnv):
+    log_root = 'running/eb_nav'
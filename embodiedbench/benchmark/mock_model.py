@@ -0,0 +1,48 @@
+import json
+import time
+import random
+from embodiedbench.benchmark.mock_env import MOCK_NUM_ACTIONS
+
+
+class MockModel():
+    """
+    Stand-in for RemoteModel that answers every request with a canned JSON plan after a
+    configurable latency, so the benchmark measures the harness and not the model.
+    """
+    # configured by the benchmark before the evaluator is created
+    latency = 0.0
+    plan_length = 3
+    total_calls = 0
+
+    def __init__(self, model_name, model_type="remote", language_only=False, tp=1, task_type=None, temperature=0.0, response_cache=None, **kwargs):
+        self.model_name = model_name
+        self.model_type = model_type
+        self.language_only = language_only
+        self.task_type = task_type
+        self.last_response_cached = False
+        self.rng = random.Random(0)
+
+    def respond(self, message_history: list):
+        MockModel.total_calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return self.plan()
+
+    def respond_batch(self, message_histories: list):
+        # a batch costs one call latency, like a local pipeline with spare capacity
+        MockModel.total_calls += 1
+        if self.latency > 0:
+            time.sleep(self.latency)
+        return [self.plan() for _ in message_histories]
+
+    def plan(self):
+        action_ids = [self.rng.randrange(MOCK_NUM_ACTIONS) for _ in range(self.plan_length)]
+        plan = {
+            "visual_state_description": "mock visual state",
+            "reasoning_and_reflection": "mock reasoning",
+            "language_plan": "mock plan",
+            "executable_plan": [{"action_id": i, "action_name": "mock action {}".format(i)} for i in action_ids],
+        }
+        if self.language_only:
+            plan.pop("visual_state_description")
+        return json.dumps(plan)
@@ -0,0 +1,70 @@
+import os
+import re
+import sys
+import time
+import random
+import argparse
+from embodiedbench.envs.eb_alfred.gen.graph import graph_obj
+
+# Checks that Graph.get_shortest_path_length, used by the ALFRED navigation rewards, returns the number
+# of actions of the A* path of get_shortest_path for random start and goal poses of each scene graph,
+# and compares the lookup times. Exits with 1 if any length differs.
+# Usage: python -m embodiedbench.benchmark.nav_reward_lengths --scenes 1 201 301 401 --goals 8 --starts 30
+
+
+def layout_scenes():
+    layouts_dir = os.path.dirname(graph_obj.layout_path(0))
+    scenes = [re.fullmatch(r'FloorPlan(\d+)-layout\.npy', name) for name in os.listdir(layouts_dir)]
+    return sorted(int(match.group(1)) for match in scenes if match)
+
+
+def random_pose(rng, points):
+    x, y = points[rng.randrange(len(points))][:2]
+    return (int(x), int(y), rng.randrange(4), rng.choice([-30, 0, 30, 60]))
+
+
+def check_scene(scene_id, num_goals, num_starts, rng):
+    # the same queries in the same order on two graphs, the A* paths are cached per graph
+    astar_graph = graph_obj.Graph(use_gt=True, construct_graph=True, scene_id=scene_id)
+    field_graph = graph_obj.Graph(use_gt=True, construct_graph=True, scene_id=scene_id)
+    mismatches = []
+    astar_time = field_time = 0.0
+    for _ in range(num_goals):
+        goal = random_pose(rng, astar_graph.points)
+        for _ in range(num_starts):
+            start = random_pose(rng, astar_graph.points)
+            t = time.perf_counter()
+            astar_length = len(astar_graph.get_shortest_path(start, goal)[0])
+            astar_time += time.perf_counter() - t
+            t = time.perf_counter()
+            field_length = field_graph.get_shortest_path_length(start, goal)
+            field_time += time.perf_counter() - t
+            if astar_length != field_length:
+                mismatches.append((start, goal, astar_length, field_length))
+    return mismatches, astar_time, field_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scenes', type=int, nargs='+', default=None, help='scene ids, all the layouts by default')
+    parser.add_argument('--goals', type=int, default=4, help='goal poses per scene')
+    parser.add_argument('--starts', type=int, default=20, help='start poses per goal')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    num_mismatches = 0
+    total_astar = total_field = 0.0
+    for scene_id in args.scenes or layout_scenes():
+        mismatches, astar_time, field_time = check_scene(scene_id, args.goals, args.starts, rng)
+        total_astar += astar_time
+        total_field += field_time
+        num_mismatches += len(mismatches)
+        for start, goal, astar_length, field_length in mismatches:
+            print(f"FloorPlan{scene_id}: {start} -> {goal}: A* {astar_length} actions, distance field {field_length}")
+    print(f"{num_mismatches} mismatches, A* {total_astar:.2f}s, distance field {total_field:.2f}s")
+    sys.exit(1 if num_mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
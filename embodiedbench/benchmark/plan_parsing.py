@@ -0,0 +1,128 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+from embodiedbench.planner.plan_parser import load_plan_json, PLAN_KEY
+from embodiedbench.planner.planner_utils import fix_json
+
+# Measures how many logged model outputs yield an executable plan, and how long parsing takes, for the
+# previous fix_json + json.loads pipeline and for the tolerant plan parser used by the planners.
+# Outputs are read from the step logs (`reasoning`) and the response cache entries (`response`).
+# Usage: python -m embodiedbench.benchmark.plan_parsing --roots running --perturb 1
+
+OUTPUT_KEYS = ['reasoning', 'response']
+
+
+def iter_json_values(text):
+    """Decode the JSON values of a file holding one or several concatenated or line-separated values."""
+    decoder = json.JSONDecoder()
+    pos = 0
+    while True:
+        while pos < len(text) and text[pos].isspace():
+            pos += 1
+        if pos >= len(text):
+            return
+        try:
+            value, pos = decoder.raw_decode(text, pos)
+        except json.JSONDecodeError:
+            return
+        yield value
+
+
+def collect_outputs(roots, limit=None):
+    outputs = []
+    for root in roots:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if not filename.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(dirpath, filename), 'r', encoding='utf-8') as f:
+                        text = f.read()
+                except (OSError, UnicodeDecodeError):
+                    continue
+                for value in iter_json_values(text):
+                    if type(value) != dict:
+                        continue
+                    for key in OUTPUT_KEYS:
+                        if type(value.get(key)) == str and value[key].strip():
+                            outputs.append(value[key])
+                if limit and len(outputs) >= limit:
+                    return outputs[:limit]
+    return outputs
+
+
+def perturb(output):
+    """Malformed variants of a valid output, as models write them."""
+    return [
+        '```json\n' + output + '\n```',
+        output.replace('"', "'"),
+        output.replace('}]', '},]').replace('"}', '",}'),
+        output[: len(output) * 3 // 4],
+    ]
+
+
+def legacy_parse(output):
+    return json.loads(fix_json(output))
+
+
+def has_plan(json_object):
+    return type(json_object) == dict and type(json_object.get(PLAN_KEY)) == list and len(json_object[PLAN_KEY]) > 0
+
+
+def is_valid_plan(output):
+    try:
+        return has_plan(json.loads(output))
+    except json.JSONDecodeError:
+        return False
+
+
+def measure(parse, outputs, repeats=3):
+    parsed = 0
+    seconds = []
+    for output in outputs:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            try:
+                json_object = parse(output)
+            except Exception:
+                json_object = None
+        seconds.append((time.perf_counter() - start) / repeats)
+        parsed += has_plan(json_object)
+    return {
+        'parse_rate': parsed / len(outputs) if len(outputs) else 0.0,
+        'mean_us': statistics.mean(seconds) * 1e6 if len(seconds) else 0.0,
+        'median_us': statistics.median(seconds) * 1e6 if len(seconds) else 0.0,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the parse rate and time of the planner output parsers.')
+    parser.add_argument('--roots', type=lambda s: s.split(','), default=['running'], help='Comma separated folders with step logs or response cache entries.')
+    parser.add_argument('--limit', type=int, help='Maximum number of logged outputs to use.')
+    parser.add_argument('--perturb', type=int, default=0, help='Set to True to add malformed variants of the outputs that parse.')
+    parser.add_argument('--repeats', type=int, default=3, help='Number of times each output is parsed for timing.')
+    parser.add_argument('--output', type=str, help='Write the report as JSON to this file.')
+    args = parser.parse_args()
+
+    outputs = collect_outputs(args.roots, args.limit)
+    if not len(outputs):
+        print(f'No logged model outputs found under {args.roots}', file=sys.stderr)
+        sys.exit(1)
+    datasets = {'logged': outputs}
+    if args.perturb:
+        datasets['perturbed'] = [variant for output in outputs if is_valid_plan(output) for variant in perturb(output)]
+
+    report = {}
+    for name, data in datasets.items():
+        report[name] = {
+            'outputs': len(data),
+            'fix_json': measure(legacy_parse, data, args.repeats),
+            'plan_parser': measure(load_plan_json, data, args.repeats),
+        }
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
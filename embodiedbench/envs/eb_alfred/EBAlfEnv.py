@@ -17,6 +17,7 @@ import gym
 import json
 import numpy as np
 from PIL import Image 
+from embodiedbench.planner.image_encoder import image_encoder
 
 # Import custom modules
 import embodiedbench.envs.eb_alfred.utils as utils
@@ -24,6 +25,8 @@ from embodiedbench.envs.eb_alfred.utils import alfred_objs, alfred_open_obj, alf
 from embodiedbench.envs.eb_alfred.thor_connector import ThorConnector
 from embodiedbench.envs.eb_alfred.data.preprocess import Dataset
 from embodiedbench.envs.eb_alfred.gen import constants
+from embodiedbench.envs.eb_alfred.gen.graph import graph_obj
+from embodiedbench.evaluator.latency import timed, latency_tracker
 from embodiedbench.main import logger
 
 # global information
@@ -85,6 +88,26 @@ def get_global_action_space():
     return action_space
 
 
+def load_dataset_split(eval_set, down_sample_ratio=1.0):
+    """
+    Load the episode list of an eval set without starting the simulator.
+
+    Args:
+        eval_set (str): One of ValidEvalSets
+        down_sample_ratio (float): Keep every round(1 / ratio)-th episode when in [0, 1)
+
+    Returns:
+        list: Task entries of the (down-sampled) eval set
+    """
+    with open(ALFRED_SPLIT_PATH) as f:
+        dataset_split = json.load(f)
+    dataset = dataset_split[eval_set]
+    if 0 <= down_sample_ratio < 1:
+        select_every = round(1 / down_sample_ratio)
+        dataset = dataset[0:len(dataset):select_every]
+    return dataset
+
+
 class EBAlfEnv(gym.Env):
     """
     Custom OpenAI Gym environment for simulating household robot tasks.
@@ -212,13 +235,7 @@ class EBAlfEnv(gym.Env):
         self.id_to_name_dict = id_to_name_dict
 
     def _load_dataset(self, eval_set):
-        with open(self.data_path) as f:
-            dataset_split = json.load(f)
-        dataset = dataset_split[eval_set]
-        if 0 <= self.down_sample_ratio < 1:
-            select_every = round(1 / self.down_sample_ratio)
-            dataset = dataset[0:len(dataset):select_every]
-        return dataset
+        return load_dataset_split(eval_set, self.down_sample_ratio)
 
 
     def current_episode(self):
@@ -232,14 +249,33 @@ class EBAlfEnv(gym.Env):
             self.current_episode()
         return res
     
-    def _reset_controller(self, task):
-        """Restore scene from a task name and replace instruction"""
+    def prepare_episode(self, episode_num):
+        """
+        Load the trajectory of an episode and build the navigation graph of its scene.
+        Nothing here touches the simulator, so it can run in a background thread
+        while the previous episode is still being evaluated.
+
+        Returns:
+            dict: Prepared episode data to pass to reset
+        """
+        task = self.dataset[episode_num]
         traj_data = utils.load_task_json(task)
         traj_data['turk_annotations']['anns'][task['repeat_idx']]['task_desc'] = task["instruction"] 
+        nav_graph = graph_obj.get_scene_graph(traj_data['scene']['scene_num'])
+        return {'episode_num': episode_num, 'traj_data': traj_data, 'nav_graph': nav_graph}
+
+    def _reset_controller(self, task, prepared=None):
+        """Restore scene from a task name and replace instruction"""
+        if prepared is not None:
+            traj_data = prepared['traj_data']
+        else:
+            traj_data = utils.load_task_json(task)
+            traj_data['turk_annotations']['anns'][task['repeat_idx']]['task_desc'] = task["instruction"] 
         self.episode_data = traj_data
         args_dict = {'data': ALFRED_DATASET_PATH, 'pframe': 300, 'fast_epoch': False,
                     'use_templated_goals': False, 'dout': 'exp/model', 'pp_folder': 'pp',
-                    'reward_config': self.reward_config_path, 'max_steps': 1000}
+                    'reward_config': self.reward_config_path, 'max_steps': 1000,
+                    'nav_graph': prepared['nav_graph'] if prepared is not None else None}
         model_args = utils.dotdict(args_dict)
         
         # Extract scene configuration
@@ -262,15 +298,20 @@ class EBAlfEnv(gym.Env):
         #############################
         self.generate_additional_action_space()
 
-    def reset(self):
+    def reset(self, prepared=None):
         """
         Reset the environment for a new episode.
+
+        Args:
+            prepared (dict): Optional output of prepare_episode for the current episode
         
         Returns:
             observation
         """
         assert self._current_episode_num < self.number_of_episodes
-        self._reset_controller(self.dataset[self._current_episode_num])
+        if prepared is not None and prepared['episode_num'] != self._current_episode_num:
+            prepared = None
+        self._reset_controller(self.dataset[self._current_episode_num], prepared=prepared)
         self._current_step = 0
         self._cur_invalid_actions = 0
         self._current_episode_num += 1
@@ -283,6 +324,7 @@ class EBAlfEnv(gym.Env):
         return obs
 
 
+    @timed('env_step')
     def step(self, action, reasoning=''):
         """
         Execute a single environment step.
@@ -306,12 +348,14 @@ class EBAlfEnv(gym.Env):
             if (self.name_to_id_dict is not None) and lang_action_split[-1] in self.name_to_id_dict: # multiple instances
                 lang_action = ' '.join(lang_action_split[:-1] + [self.name_to_id_dict[lang_action_split[-1]]])
 
-        event = self.env.llm_skill_interact(lang_action)
+        with latency_tracker.timer('skill_interact'):
+            event = self.env.llm_skill_interact(lang_action)
         if not event['success']:
             self._cur_invalid_actions += 1
         
         ## test calculate reward
-        reward, done = self.env.get_transition_reward()
+        with latency_tracker.timer('reward'):
+            reward, done = self.env.get_transition_reward()
         subgoal_met = self.env.get_goal_conditions_met()
         info['task_success'] = float(self.env.get_goal_satisfied())
         info['task_progress'] = subgoal_met[0] / subgoal_met[1]
@@ -368,6 +412,7 @@ class EBAlfEnv(gym.Env):
     def seed(self, seed=None):
         self.env.random_initilize(seed)
 
+    @timed('save_image')
     def save_image(self, *args, **kwargs):
         """Save current agent view as a PNG image."""
         episode_idx = self._current_episode_num if not len(self.selected_indexes) else self.selected_indexes[self._current_episode_num - 1] + 1
@@ -381,7 +426,7 @@ class EBAlfEnv(gym.Env):
 
         # time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         image_path = os.path.join(folder, 'episode_{}_step_{}.png'.format(episode_idx, self._current_step)) #, time_stamp))
-        img.save(image_path)
+        image_path = image_encoder.save(img, image_path)
         return image_path
 
     def save_episode_log(self):
@@ -52,7 +52,12 @@ class BaseTask(object):
         '''
         floor_plan = self.traj['scene']['floor_plan']
         scene_num = self.traj['scene']['scene_num']
-        self.gt_graph = graph_obj.Graph(use_gt=True, construct_graph=True, scene_id=scene_num)
+        # reuse the graph if it was prepared ahead of the scene reset
+        nav_graph = getattr(self.args, 'nav_graph', None)
+        if nav_graph is not None and nav_graph.scene_id == scene_num:
+            self.gt_graph = nav_graph
+        else:
+            self.gt_graph = graph_obj.get_scene_graph(scene_num)
 
     def get_num_subgoals(self, high_pddl):
         '''
@@ -1,9 +1,14 @@
 import os
 import random
 import time
+import pickle
+import threading
+from collections import OrderedDict
 
 import networkx as nx
 import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
 
 import embodiedbench.envs.eb_alfred.gen.constants as constants
 from embodiedbench.envs.eb_alfred.gen.utils import game_util
@@ -12,9 +17,29 @@ MAX_WEIGHT_IN_GRAPH = 1e5
 PRED_WEIGHT_THRESH = 10
 EPSILON = 1e-4
 
+# precompiled ground-truth graphs, one pickle per scene, rebuilt when the layout file changes
+GRAPH_CACHE_DIR = os.environ.get('NAV_GRAPH_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'embodiedbench', 'nav_graphs'))
+GRAPH_CACHE_VERSION = 2
+# ground-truth graphs kept in memory by each process, least recently used first out
+SCENE_GRAPH_CACHE_SIZE = 16
+# distance-to-goal fields kept per graph, one per navigation target
+DISTANCE_FIELD_CACHE_SIZE = 32
+# (row, column) offset of moving ahead in each direction, rows are y and columns are x
+MOVE_OFFSETS = [(1, 0), (0, 1), (-1, 0), (0, -1)]
+# goal directions for which the A* heuristic of get_shortest_path, |dx| + |dy| + |d - goal_d|, never
+# overestimates the remaining turns, so A* finds a shortest path; towards north and west it counts
+# 3 turns between them instead of 1 and may return a longer path, which rewards must reproduce
+ASTAR_OPTIMAL_DIRECTIONS = {1, 2}
+# guards the distance field caches of graphs shared between threads (graphs are pickled, so no lock per graph)
+_distance_fields_lock = threading.Lock()
+
 # Direction: 0: north, 1: east, 2: south, 3: west
 
 
+def layout_path(scene_id):
+    return os.path.join(os.path.dirname(__file__), os.pardir, 'layouts', 'FloorPlan%s-layout.npy' % scene_id)
+
+
 class Graph(object):
     def __init__(self, use_gt=False, construct_graph=True, scene_id=None, debug=False):
         t_start = time.time()
@@ -34,11 +59,7 @@ class Graph(object):
         '''
 
         self.scene_id = scene_id
-        self.points = np.load(os.path.join(
-            os.path.dirname(__file__),
-            os.pardir,
-            'layouts',
-            'FloorPlan%s-layout.npy' % self.scene_id))
+        self.points = np.load(layout_path(self.scene_id))
         self.points /= constants.AGENT_STEP_SIZE
         self.points = np.round(self.points).astype(np.int32)
         self.xMin = self.points[:, 0].min() - constants.SCENE_PADDING * 2
@@ -53,6 +74,9 @@ class Graph(object):
         self.impossible_spots = set()
         self.updated_weights = {}
         self.prev_navigable_locations = None
+        # array form of gt_graph and its distance fields, built on demand by get_distance_field
+        self.lattice = None
+        self.distance_fields = OrderedDict()
 
         if self.use_gt:
             self.memory[:] = MAX_WEIGHT_IN_GRAPH
@@ -98,6 +122,8 @@ class Graph(object):
         self.shortest_paths_unweighted = {}
         self.impossible_spots = set()
         self.prev_navigable_locations = None
+        self.lattice = None
+        self.distance_fields = OrderedDict()
 
         if self.use_gt:
             self.memory[:] = self.initial_memory
@@ -210,6 +236,8 @@ class Graph(object):
                     self.update_edge(node, weight)
             self.memory[yy - self.yMin, xx - self.xMin] = weight
             self.shortest_paths = {}
+            self.lattice = None
+            self.distance_fields = OrderedDict()
 
     def update_edge(self, pose, weight):
         rotation = int(pose[2])
@@ -276,6 +304,88 @@ class Graph(object):
 
         return actions, path
 
+    def lattice_index(self, pose):
+        return ((pose[1] - self.yMin) * (self.xMax - self.xMin + 1) + pose[0] - self.xMin) * 4 + pose[2]
+
+    def in_lattice(self, pose):
+        return self.xMin <= pose[0] <= self.xMax and self.yMin <= pose[1] <= self.yMax
+
+    def build_lattice(self):
+        '''
+        sparse matrix of gt_graph with the edges reversed, entry [b, a] holds the weight of a -> b:
+        rotations weigh 1 and moving ahead weighs the memory of the entered cell
+        '''
+        height, width = self.memory.shape
+        index = np.arange(height * width * 4).reshape(height, width, 4)
+        sources, targets, weights = [], [], []
+        for turn in (1, -1):
+            sources.append(index.ravel())
+            targets.append(index[:, :, (np.arange(4) + turn) % 4].ravel())
+            weights.append(np.ones(index.size))
+        for direction, (dy, dx) in enumerate(MOVE_OFFSETS):
+            src_rows = slice(max(0, -dy), height - max(0, dy))
+            src_cols = slice(max(0, -dx), width - max(0, dx))
+            dst_rows = slice(max(0, dy), height - max(0, -dy))
+            dst_cols = slice(max(0, dx), width - max(0, -dx))
+            sources.append(index[src_rows, src_cols, direction].ravel())
+            targets.append(index[dst_rows, dst_cols, direction].ravel())
+            weights.append(self.memory[dst_rows, dst_cols].astype(np.float64).ravel())
+        return csr_matrix((np.concatenate(weights), (np.concatenate(targets), np.concatenate(sources))),
+                          shape=(index.size, index.size))
+
+    def get_distance_field(self, goal_pose):
+        '''
+        distance to goal_pose and number of actions of a shortest path to it, for every pose of the lattice
+        '''
+        goal = self.lattice_index(goal_pose)
+        with _distance_fields_lock:
+            field = self.distance_fields.get(goal)
+            if field is not None:
+                self.distance_fields.move_to_end(goal)
+                return field
+        lattice = self.lattice
+        if lattice is None:
+            lattice = self.lattice = self.build_lattice()
+        distances, predecessors = dijkstra(lattice, directed=True, indices=goal, return_predecessors=True)
+        # depth in the shortest path tree by pointer jumping: hops[i] is the number of actions from i to jump[i]
+        hops = (predecessors >= 0).astype(np.int64)
+        jump = np.where(predecessors >= 0, predecessors, np.arange(len(predecessors)))
+        while True:
+            next_jump = jump[jump]
+            if np.array_equal(next_jump, jump):
+                break
+            hops = hops + hops[jump]
+            jump = next_jump
+        field = (distances, hops)
+        with _distance_fields_lock:
+            self.distance_fields[goal] = field
+            while len(self.distance_fields) > DISTANCE_FIELD_CACHE_SIZE:
+                self.distance_fields.popitem(last=False)
+        return field
+
+    def get_shortest_path_length(self, pose, goal_pose):
+        '''
+        number of actions of get_shortest_path(pose, goal_pose), looked up in the distance field of the goal.
+        On the unchanged ground-truth graph all the shortest paths have the same number of actions, rotations
+        weigh 1 and moves 1 + EPSILON. Goals facing north or west, for which A* is not exact, paths through
+        blocked cells, which get_shortest_path cuts, changed weights and poses outside the lattice are left
+        to get_shortest_path.
+        '''
+        assert(pose[2] in {0, 1, 2, 3})
+        assert(goal_pose[2] in {0, 1, 2, 3})
+        num_horizon_actions = abs(int(goal_pose[3]) - int(pose[3])) // constants.AGENT_HORIZON_ADJ
+        start = tuple(int(pp) for pp in pose[:3])
+        goal = tuple(int(pp) for pp in goal_pose[:3])
+
+        if (self.construct_graph and self.use_gt and not self.updated_weights and goal[2] in ASTAR_OPTIMAL_DIRECTIONS
+                and self.in_lattice(start) and self.in_lattice(goal)):
+            distances, hops = self.get_distance_field(goal)
+            index = self.lattice_index(start)
+            if distances[index] < MAX_WEIGHT_IN_GRAPH:
+                return int(hops[index]) + num_horizon_actions
+        actions, _ = self.get_shortest_path(pose, goal_pose)
+        return len(actions)
+
     def get_shortest_path_unweighted(self, pose, goal_pose):
         assert(pose[2] in {0, 1, 2, 3})
         assert(goal_pose[2] in {0, 1, 2, 3})
@@ -373,6 +483,64 @@ class Graph(object):
                 path.append(path[-1])
 
 
+_scene_graphs = OrderedDict()
+_scene_graphs_lock = threading.Lock()
+
+
+def load_compiled_graph(scene_id):
+    '''
+    ground-truth graph of a scene from the on-disk cache, built and written there on a miss
+    '''
+    stat = os.stat(layout_path(scene_id))
+    signature = (GRAPH_CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    path = os.path.join(GRAPH_CACHE_DIR, 'FloorPlan%s-graph.pkl' % scene_id)
+    try:
+        with open(path, 'rb') as f:
+            # the signature is stored first, a stale graph is not unpickled
+            if pickle.load(f) == signature:
+                return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ValueError):
+        pass
+
+    graph = Graph(use_gt=True, construct_graph=True, scene_id=scene_id)
+    try:
+        os.makedirs(GRAPH_CACHE_DIR, exist_ok=True)
+        tmp_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(signature, f, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+    except OSError:
+        # a read-only cache folder only costs the rebuild
+        pass
+    return graph
+
+
+def get_scene_graph(scene_id):
+    '''
+    ground-truth navigation graph of a scene, Graph(use_gt=True, construct_graph=True), shared by
+    the episodes of the process. A graph whose weights were changed is reset with clear() before
+    it is handed out again; an unchanged one keeps its shortest path cache, since clearing it
+    could race with another episode of the same scene reading it.
+    '''
+    with _scene_graphs_lock:
+        graph = _scene_graphs.get(scene_id)
+        if graph is not None:
+            _scene_graphs.move_to_end(scene_id)
+            if graph.updated_weights or graph.impossible_spots:
+                graph.clear()
+            return graph
+
+    # built outside the lock, other scenes stay available meanwhile
+    graph = load_compiled_graph(scene_id)
+    with _scene_graphs_lock:
+        graph = _scene_graphs.setdefault(scene_id, graph)
+        _scene_graphs.move_to_end(scene_id)
+        while len(_scene_graphs) > SCENE_GRAPH_CACHE_SIZE:
+            _scene_graphs.popitem(last=False)
+    return graph
+
+
 if __name__ == '__main__':
     # Test graphs
     env = game_util.create_env()
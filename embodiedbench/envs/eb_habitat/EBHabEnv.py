@@ -17,6 +17,7 @@ import time
 import json
 import imageio
 from PIL import Image 
+from embodiedbench.planner.image_encoder import image_encoder
 import numpy as np
 import habitat
 import hydra
@@ -33,6 +34,7 @@ import embodiedbench.envs.eb_habitat.predicate_task
 import embodiedbench.envs.eb_habitat.config
 import embodiedbench.envs.eb_habitat.measures
 from embodiedbench.envs.eb_habitat.utils import observations_to_image, merge_to_file, draw_text
+from embodiedbench.evaluator.latency import timed
 from embodiedbench.main import logger
 
 HABITAT_CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config/task/language_rearrangement.yaml')
@@ -140,8 +142,7 @@ class EBHabEnv(gym.Env):
         self._reset = False
         self._current_episode_num = 0 
         while start_epi_index >= 1 and self._current_episode_num < start_epi_index:
-            self.env.reset(return_info=False)
-            self._current_episode_num += 1
+            self.skip_episode()
 
         self._current_step = 0
         self._max_episode_steps = 30
@@ -170,6 +171,11 @@ class EBHabEnv(gym.Env):
         return self.env.current_episode(all_info)
 
 
+    def skip_episode(self):
+        """Advance the episode iterator to the next episode without evaluating the current one."""
+        self.env.reset(return_info=False)
+        self._current_episode_num += 1
+
     def reset(self, **kwargs):
         """
         Reset the environment for a new episode. The env will iterate over all the task data from the dataset
@@ -244,6 +250,7 @@ class EBHabEnv(gym.Env):
         # env_feedback += ' The current task progress is {}.'.format(info['task_progress'])
         return env_feedback
 
+    @timed('env_step')
     def step(self, action, reasoning='', **kwargs):
         """
         Execute a single environment step.
@@ -283,6 +290,7 @@ class EBHabEnv(gym.Env):
     def seed(self, seed=None):
         self.env.seed(seed)
 
+    @timed('save_image')
     def save_image(self, obs, key='head_rgb'):
         """Save current agent observation as a PNG image."""
         folder = self.log_path + '/images/episode_{}'.format(self._current_episode_num)
@@ -291,7 +299,7 @@ class EBHabEnv(gym.Env):
         img = Image.fromarray(observations_to_image(obs, key))
         # time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime())
         image_path = os.path.join(folder, 'episode_{}_step_{}.png'.format(self._current_episode_num, self._current_step)) #, time_stamp))
-        img.save(image_path)
+        image_path = image_encoder.save(img, image_path)
         return image_path
 
     def save_episode_log(self):
@@ -18,6 +18,7 @@ from embodiedbench.envs.eb_manipulation.eb_man_utils import get_continous_action
 import os
 import time
 from PIL import Image
+from embodiedbench.planner.image_encoder import image_encoder
 from embodiedbench.main import logger
 
 EVAL_SETS = {
@@ -230,7 +231,7 @@ class EBManEnv(gym.Env):
             time_stamp = time.strftime("%Y%m%d_%H%M%S", time.localtime()) 
             image_path = 'episode_{}_step_{}_{}.png'.format(self._current_episode_num, self._current_step, cam_view)
             image_path = os.path.join(log_path, 'episode_{}_step_{}_{}.png'.format(self._current_episode_num, self._current_step, cam_view))
-            single_image.save(image_path)
+            image_path = image_encoder.save(single_image, image_path)
             image_path_list.append(image_path)
         return image_path_list
     
@@ -3,6 +3,7 @@ import gym
 import numpy as np
 import time
 from PIL import Image
+from embodiedbench.planner.image_encoder import image_encoder
 import json
 import os
 import sys
@@ -356,8 +357,8 @@ class EBNavigationEnv(gym.Env):
             image_path2 = os.path.join(
                 self.log_path, "episode_{}_step_{}_{}_top.png".format(episode_idx, self._current_step, time_stamp)
             )
-            img1.save(image_path1)
-            img2.save(image_path2)
+            image_path1 = image_encoder.save(img1, image_path1)
+            image_path2 = image_encoder.save(img2, image_path2)
             return [image_path1, image_path2]
 
         elif self.multistep:
@@ -368,7 +369,7 @@ class EBNavigationEnv(gym.Env):
             image_path = os.path.join(
                 self.log_path, "episode_{}_step_{}_{}_front.png".format(episode_idx, self._current_step, time_stamp)
             )
-            img.save(image_path)
+            image_path = image_encoder.save(img, image_path)
             self.img_paths.append(image_path)
             if self._current_step < 3:
                 return self.img_paths
@@ -383,7 +384,7 @@ class EBNavigationEnv(gym.Env):
                 image_path = os.path.join(
                     self.log_path, "episode_{}_step_{}_{}_front.png".format(episode_idx, self._current_step, time_stamp)
                 )
-                img.save(image_path)
+                image_path = image_encoder.save(img, image_path)
                 return image_path
             else:
                 img = Image.fromarray(self.env.last_event.frame)
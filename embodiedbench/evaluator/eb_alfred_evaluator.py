@@ -1,12 +1,22 @@
 import os
+import copy
 import numpy as np
 from tqdm import tqdm
 import time
 import json
-from embodiedbench.envs.eb_alfred.EBAlfEnv import EBAlfEnv, ValidEvalSets
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from embodiedbench.envs.eb_alfred.EBAlfEnv import EBAlfEnv, ValidEvalSets, load_dataset_split
 from embodiedbench.planner.vlm_planner import VLMPlanner
-from embodiedbench.evaluator.summarize_result import average_json_values
-from embodiedbench.evaluator.evaluator_utils import load_saved_data, update_config_with_args
+from embodiedbench.planner.remote_model import RemoteModel
+from embodiedbench.planner.batched_model import BatchedModel
+from embodiedbench.planner.response_cache import build_response_cache, CacheMissError
+from embodiedbench.planner.rate_limiter import build_rate_limiter, backoff_delay
+from embodiedbench.planner.image_encoder import image_encoder, configure_image_encoder
+from embodiedbench.planner.context_budget import build_context_budget
+from embodiedbench.evaluator.summarize_result import ResultsLedger
+from embodiedbench.evaluator.latency import latency_tracker, summarize_latency
+from embodiedbench.evaluator.evaluator_utils import load_saved_data, update_config_with_args, load_completed_episodes, EpisodePrefetcher
 from embodiedbench.evaluator.config.system_prompts import alfred_system_prompt
 from embodiedbench.main import logger
 
@@ -17,10 +27,12 @@ system_prompt = alfred_system_prompt
 class EB_AlfredEvaluator():
     def __init__(self, config):
         self.model_name = config['model_name']
+        configure_image_encoder(config)
         self.eval_set = ValidEvalSets[0]
         self.config = config
         self.env = None
         self.planner = None
+        self.ledger = None
 
     def check_config_valid(self):
         if self.config['multistep'] + self.config['chat_history'] > 1:
@@ -30,6 +42,13 @@ class EB_AlfredEvaluator():
             if self.config['multistep']:
                 logger.warning("Language only mode should not have multistep enabled. Setting these arguments to False ...")
                 self.config['multistep'] = 0
+
+        if self.config.get('lockstep_envs', 1) > 1 and self.config.get('model_type', 'remote') != 'local':
+            logger.warning("Lockstep batching needs a local model (model_type=local). Setting lockstep_envs to 1 ...")
+            self.config['lockstep_envs'] = 1
+        if self.config.get('lockstep_envs', 1) > 1 and (self.config.get('num_candidates', None) or 1) > 1:
+            logger.warning("Candidate sampling bypasses the lockstep batches. Setting num_candidates to 1 ...")
+            self.config['num_candidates'] = 1
         
     def save_episode_metric(self, episode_info):
         episode_idx = self.env._current_episode_num if not len(self.env.selected_indexes) else self.env.selected_indexes[self.env._current_episode_num - 1] + 1
@@ -39,42 +58,141 @@ class EB_AlfredEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        self.ledger.add(filename, episode_info)
+        latency_tracker.save(os.path.join(self.env.log_path, 'latency', 'episode_{}_latency.json'.format(episode_idx)))
+
+    def get_exp_name(self, eval_set):
+        return f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
+
+    def get_log_path(self, eval_set):
+        # same layout as EBAlfEnv.log_path, available before the simulator is started
+        return 'running/eb_alfred/{}'.format(self.get_exp_name(eval_set))
+
+    def get_episode_indexes(self, eval_set):
+        """
+        Dataset indexes of the episodes to evaluate. When resuming, episodes that already have a
+        result file under running/eb_alfred/<exp>/results are left out.
+        """
+        episode_indexes = list(self.config.get('selected_indexes', []))
+        if not len(episode_indexes):
+            episode_indexes = list(range(len(load_dataset_split(eval_set, self.config['down_sample_ratio']))))
+        if not self.config.get('resume', False):
+            return episode_indexes
+        # result files are named after the 1-based episode index
+        completed = load_completed_episodes(os.path.join(self.get_log_path(eval_set), 'results'))
+        pending_indexes = [i for i in episode_indexes if i + 1 not in completed]
+        logger.info(f"Resuming {eval_set}: {len(episode_indexes) - len(pending_indexes)}/{len(episode_indexes)} episodes already completed")
+        return pending_indexes
+
+    def setup_eval_set(self, eval_set, selected_indexes, model=None):
+        if self.env is not None:
+            self.env.close()
+        self.eval_set = eval_set
+        self.env = EBAlfEnv(eval_set=self.eval_set, down_sample_ratio=self.config['down_sample_ratio'], 
+                                      exp_name=self.get_exp_name(eval_set), selected_indexes=selected_indexes, 
+                                      detection_box=self.config.get('detection_box', False),
+                                      resolution=self.config.get('resolution', 500), 
+                                      )
+        self.ledger = ResultsLedger(os.path.join(self.env.log_path, 'results'))
+        examples = json.load(open(example_path, 'r+')) if self.eval_set != 'long_horizon' else json.load(open(exploration_example_path, 'r+'))
+        model_type = self.config.get('model_type', 'remote')
+        self.planner = VLMPlanner(self.model_name, model_type, self.env.language_skill_set, system_prompt, examples, n_shot=self.config['n_shots'], 
+                                        obs_key='head_rgb', chat_history=self.config['chat_history'], language_only=self.config['language_only'],
+                                        use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1),
+                                        temperature=self.config.get('temperature', 0.0), response_cache=build_response_cache(self.config),
+                                        rate_limiter=build_rate_limiter(self.config), prompt_caching=self.config.get('prompt_caching', False), model=model,
+                                        context_budget=build_context_budget(self.config), stream=self.config.get('stream_responses', False),
+                                        num_candidates=self.config.get('num_candidates', None) or 1)
 
     def evaluate_main(self):
         valid_eval_sets = self.config.get('eval_sets', ValidEvalSets)
         valid_eval_sets = list(valid_eval_sets)
         if type(valid_eval_sets) == list and len(valid_eval_sets) == 0:
             valid_eval_sets = ValidEvalSets
+        num_workers = self.config.get('num_workers', 1)
+        lockstep_envs = self.config.get('lockstep_envs', 1)
 
         for eval_set in valid_eval_sets:
-            if self.env is not None:
-                self.env.close()
-            self.eval_set = eval_set
             logger.info(f'Current eval set: {eval_set}')
-            exp_name = f"{self.model_name.split('/')[-1]}_{self.config['exp_name']}/{eval_set}" if len(self.config['exp_name']) else f"{self.model_name.split('/')[-1]}/{eval_set}"
-            self.env = EBAlfEnv(eval_set=self.eval_set, down_sample_ratio=self.config['down_sample_ratio'], 
-                                          exp_name=exp_name, selected_indexes=self.config.get('selected_indexes', []), 
-                                          detection_box=self.config.get('detection_box', False),
-                                          resolution=self.config.get('resolution', 500), 
-                                          )
-            examples = json.load(open(example_path, 'r+')) if self.eval_set != 'long_horizon' else json.load(open(exploration_example_path, 'r+'))
-            model_type = self.config.get('model_type', 'remote')
-            self.planner = VLMPlanner(self.model_name, model_type, self.env.language_skill_set, system_prompt, examples, n_shot=self.config['n_shots'], 
-                                            obs_key='head_rgb', chat_history=self.config['chat_history'], language_only=self.config['language_only'],
-                                            use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1),
-                                            temperature=self.config.get('temperature', 0.0))
-
-            self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), output_file='summary.json')
-            with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
+            log_path = self.get_log_path(eval_set)
+            episode_indexes = self.get_episode_indexes(eval_set)
+            if not len(episode_indexes):
+                logger.info(f'All episodes of {eval_set} are completed, skipping evaluation')
+            elif lockstep_envs > 1:
+                self.evaluate_lockstep(eval_set, episode_indexes, lockstep_envs)
+            elif num_workers > 1:
+                self.evaluate_parallel(eval_set, episode_indexes, num_workers)
+            else:
+                self.setup_eval_set(eval_set, episode_indexes)
+                self.evaluate()
+            # rebuilt from the ledger, which also holds the episodes of the worker processes
+            ResultsLedger(os.path.join(log_path, 'results')).write_summary()
+            summarize_latency(log_path, os.path.join(log_path, 'results', 'summary.json'))
+            with open(os.path.join(log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
 
+    def evaluate_parallel(self, eval_set, episode_indexes, num_workers):
+        """
+        Shard the episodes of an eval set across worker processes. Each worker owns its own
+        EBAlfEnv and VLMPlanner and writes episode results to the shared results folder.
+        """
+        # round-robin sharding keeps long and short episodes spread over the workers
+        shards = [episode_indexes[i::num_workers] for i in range(num_workers)]
+        shards = [shard for shard in shards if len(shard)]
+        logger.info(f"Running {len(episode_indexes)} episodes with {len(shards)} workers")
+
+        failures = []
+        # spawn instead of fork, each worker starts its own simulator
+        mp_context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=len(shards), mp_context=mp_context) as executor:
+            futures = {executor.submit(evaluate_shard, self.config, eval_set, shard, logger.level): shard for shard in shards}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append((futures[future], e))
+                    logger.error(f"Evaluation worker failed: {e}")
+        raise_shard_failures(failures, len(shards), eval_set)
+
+    def evaluate_lockstep(self, eval_set, episode_indexes, num_envs):
+        """
+        Run num_envs simulators side by side in threads of this process. Their planners share one
+        local model and the requests of a planning round are sent to it as one batch.
+        """
+        shards = [episode_indexes[i::num_envs] for i in range(num_envs)]
+        shards = [shard for shard in shards if len(shard)]
+        logger.info(f"Running {len(episode_indexes)} episodes with {len(shards)} lockstep environments")
+
+        model = RemoteModel(self.model_name, 'local', self.config['language_only'], tp=self.config.get('tp', 1),
+                            temperature=self.config.get('temperature', 0.0), response_cache=build_response_cache(self.config),
+                            rate_limiter=build_rate_limiter(self.config), prompt_caching=self.config.get('prompt_caching', False))
+        batched_model = BatchedModel(model)
+        # lanes are opened up front, so the first planning round waits for every environment
+        lanes = [batched_model.lane() for _ in shards]
+
+        failures = []
+        with ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            futures = {executor.submit(evaluate_shard, self.config, eval_set, shard, model=lane): shard for shard, lane in zip(shards, lanes)}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append((futures[future], e))
+                    logger.error(f"Lockstep environment failed: {e}")
+        batched_model.log_stats()
+        raise_shard_failures(failures, len(shards), eval_set)
+
     def evaluate(self):
         progress_bar = tqdm(total=self.env.number_of_episodes, desc="Episodes")
+        # prepare the next episode in the background while the model is queried
+        prefetcher = EpisodePrefetcher(self.env) if self.config.get('pipeline_reset', False) else None
         while self.env._current_episode_num < self.env.number_of_episodes:
             logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
             episode_info = {'reward': [], 'num_invalid_actions': 0, 'empty_plan': 0}
-            obs = self.env.reset()
+            latency_tracker.reset()
+            image_encoder.reset_stats()
+            num_failures = 0
+            obs = prefetcher.reset() if prefetcher is not None else self.env.reset()
             img_path = self.env.save_image(obs)
             user_instruction = self.env.episode_language_instruction
             print(f"Instruction: {user_instruction}")
@@ -148,9 +266,15 @@ class EB_AlfredEvaluator():
                         episode_info['reward'].append(reward)
                         episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
                 
+                except CacheMissError:
+                    raise
                 except Exception as e: 
                     print(e)
-                    time.sleep(30)
+                    time.sleep(backoff_delay(num_failures))
+                    num_failures += 1
+                else:
+                    # the backoff grows with consecutive failures only
+                    num_failures = 0
 
             # evaluation metrics
             episode_info['instruction'] = user_instruction
@@ -163,10 +287,55 @@ class EB_AlfredEvaluator():
             episode_info["num_invalid_actions"] = episode_info['num_invalid_actions']
             episode_info["num_invalid_action_ratio"] = episode_info['num_invalid_actions'] / info["env_step"] if info['env_step'] > 0 else 0
             episode_info["episode_elapsed_seconds"] = info.get("episode_elapsed_seconds", time.time() - self.env._episode_start_time)
+            episode_info.update(self.planner.token_usage.episode_stats())
+            episode_info.update(image_encoder.episode_stats())
+            if self.planner.context_budget is not None:
+                episode_info['context_dropped_messages'] = self.planner.context_budget.dropped_messages
+                episode_info['context_dropped_images'] = self.planner.context_budget.dropped_images
+            episode_info.update(latency_tracker.episode_stats())
 
             self.env.save_episode_log()
             self.save_episode_metric(episode_info)
             progress_bar.update()
+        if prefetcher is not None:
+            prefetcher.close()
+
+
+def raise_shard_failures(failures, num_shards, eval_set):
+    """
+    Fail the eval set once all its shards have stopped if any of them failed, instead of writing
+    a summary of the partial results as if it were complete. The finished episodes are kept in
+    the results folder, a run with resume=True evaluates the missing ones.
+    """
+    if not failures:
+        return
+    for shard, e in failures:
+        logger.error(f"Shard of episodes {shard} failed: {e}")
+    raise RuntimeError(f"{len(failures)} of {num_shards} shards failed on eval set {eval_set}, "
+                       f"its results are incomplete") from failures[0][1]
+
+
+def evaluate_shard(config, eval_set, selected_indexes, log_level=None, model=None):
+    """Worker entry of EB_AlfredEvaluator.evaluate_parallel and evaluate_lockstep (with a model lane)."""
+    if log_level is not None:
+        logger.setLevel(log_level)
+    config = copy.deepcopy(config)
+    if model is None:
+        # every worker process has its own rate limiter, split the provider limits between them;
+        # lockstep lanes share the limiter of their model in this process
+        for key in ['rate_limit_rpm', 'rate_limit_tpm']:
+            if config.get(key, None):
+                config[key] = config[key] / config['num_workers']
+    config['num_workers'] = 1
+    evaluator = EB_AlfredEvaluator(config)
+    try:
+        evaluator.setup_eval_set(eval_set, selected_indexes, model=model)
+        evaluator.evaluate()
+    finally:
+        if model is not None:
+            model.close()
+        if evaluator.env is not None:
+            evaluator.env.close()
 
 
 if __name__ == '__main__':
@@ -186,6 +355,16 @@ if __name__ == '__main__':
         parser.add_argument('--resolution', type=int, help='Resolution for processing.')
         parser.add_argument('--env_feedback', type=int, help='Set to True to enable environment feedback.')
         parser.add_argument('--tp', type=int, help='number of tensor parallel splits of the model parameters')
+        parser.add_argument('--num_workers', type=int, help='Number of worker processes, each with its own simulator and planner.')
+        parser.add_argument('--lockstep_envs', type=int, help='Number of environments run side by side whose local model requests are batched.')
+        parser.add_argument('--pipeline_reset', type=int, help='Set to True to prepare the next episode while the current one runs.')
+        parser.add_argument('--resume', type=int, help='Set to True to skip episodes that already have results.')
+        parser.add_argument('--prompt_caching', type=int, help='Set to True to send the static prompt prefix for provider-side caching.')
+        parser.add_argument('--image_format', type=str, help='Encoding of the saved and sent frames: png, jpeg or webp.')
+        parser.add_argument('--context_max_tokens', type=int, help='Estimated token budget of the chat history sent to the model.')
+        parser.add_argument('--context_max_images', type=int, help='Number of most recent images kept in the chat history sent to the model.')
+        parser.add_argument('--stream_responses', type=int, help='Set to True to stream the model outputs and stop them once the plan is complete.')
+        parser.add_argument('--num_candidates', type=int, help='Number of completions sampled concurrently per step, the first valid plan is used.')
         return parser.parse_args()
 
 
@@ -204,6 +383,11 @@ if __name__ == '__main__':
         'resolution': 500, 
         'env_feedback': 1,
         'tp': 1,
+        'num_workers': 1,
+        'lockstep_envs': 1,
+        'pipeline_reset': 0,
+        'resume': 0,
+        'prompt_caching': 0,
     }
 
     args = parse_arguments()
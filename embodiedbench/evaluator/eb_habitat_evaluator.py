@@ -5,8 +5,13 @@ import time
 import json
 from embodiedbench.envs.eb_habitat.EBHabEnv import EBHabEnv, ValidEvalSets
 from embodiedbench.planner.vlm_planner import VLMPlanner
-from embodiedbench.evaluator.summarize_result import average_json_values
-from embodiedbench.evaluator.evaluator_utils import load_saved_data, update_config_with_args
+from embodiedbench.planner.response_cache import build_response_cache, CacheMissError
+from embodiedbench.planner.rate_limiter import build_rate_limiter, backoff_delay
+from embodiedbench.planner.image_encoder import image_encoder, configure_image_encoder
+from embodiedbench.planner.context_budget import build_context_budget
+from embodiedbench.evaluator.summarize_result import ResultsLedger
+from embodiedbench.evaluator.latency import latency_tracker, summarize_latency
+from embodiedbench.evaluator.evaluator_utils import load_saved_data, update_config_with_args, load_completed_episodes
 from embodiedbench.evaluator.config.system_prompts import habitat_system_prompt
 from embodiedbench.main import logger
 
@@ -25,10 +30,12 @@ system_prompt = habitat_system_prompt
 class EB_HabitatEvaluator():
     def __init__(self, config):
         self.model_name = config['model_name']
+        configure_image_encoder(config)
         self.eval_set = ValidEvalSets[0]
         self.config = config
         self.env = None
         self.planner = None
+        self.ledger = None
         self.system_prompt = system_prompt
 
     def check_config_valid(self):
@@ -48,6 +55,8 @@ class EB_HabitatEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        self.ledger.add(filename, episode_info)
+        latency_tracker.save(os.path.join(self.env.log_path, 'latency', 'episode_{}_latency.json'.format(self.env._current_episode_num)))
 
     def evaluate_main(self):
         valid_eval_sets = self.config.get('eval_sets', ValidEvalSets)
@@ -68,18 +77,34 @@ class EB_HabitatEvaluator():
             self.planner = VLMPlanner(self.model_name, model_type, self.env.language_skill_set, self.system_prompt, examples, n_shot=self.config['n_shots'], obs_key='head_rgb',
                                                  chat_history=self.config['chat_history'], language_only=self.config['language_only'], 
                                                  use_feedback=self.config.get('env_feedback', True), multistep=self.config.get('multistep', 0), tp=self.config.get('tp', 1),
-                                                 temperature=self.config.get('temperature', 0.0))
+                                                 temperature=self.config.get('temperature', 0.0), response_cache=build_response_cache(self.config),
+                                                 rate_limiter=build_rate_limiter(self.config), prompt_caching=self.config.get('prompt_caching', False),
+                                                 context_budget=build_context_budget(self.config), stream=self.config.get('stream_responses', False),
+                                                 num_candidates=self.config.get('num_candidates', None) or 1)
 
+            self.ledger = ResultsLedger(os.path.join(self.env.log_path, 'results'))
             self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), output_file='summary.json')
+            self.ledger.write_summary()
+            summarize_latency(self.env.log_path, os.path.join(self.env.log_path, 'results', 'summary.json'))
             with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
 
     def evaluate(self):
         progress_bar = tqdm(total=self.env.number_of_episodes, desc="Episodes")
+        # result files are named after the 1-based episode index
+        completed = load_completed_episodes(os.path.join(self.env.log_path, 'results')) if self.config.get('resume', False) else set()
+        if len(completed):
+            logger.info(f"Resuming {self.eval_set}: {len(completed)} episodes already completed")
         while self.env._current_episode_num < self.env.number_of_episodes:
+            if self.env._current_episode_num + 1 in completed:
+                self.env.skip_episode()
+                progress_bar.update()
+                continue
             logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
             episode_info = {'reward': [], 'num_invalid_actions': 0, 'empty_plan': 0}
+            latency_tracker.reset()
+            image_encoder.reset_stats()
+            num_failures = 0
             obs = self.env.reset()
             img_path = self.env.save_image(obs)
             user_instruction = self.env.episode_language_instruction
@@ -155,9 +180,15 @@ class EB_HabitatEvaluator():
                         episode_info['reward'].append(reward)
                         episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
                 
+                except CacheMissError:
+                    raise
                 except Exception as e: 
                     print(e)
-                    time.sleep(30)
+                    time.sleep(backoff_delay(num_failures))
+                    num_failures += 1
+                else:
+                    # the backoff grows with consecutive failures only
+                    num_failures = 0
 
             # evaluation metrics
             episode_info['instruction'] = user_instruction
@@ -171,6 +202,12 @@ class EB_HabitatEvaluator():
             episode_info["num_invalid_actions"] = episode_info['num_invalid_actions']
             episode_info["num_invalid_action_ratio"] = episode_info['num_invalid_actions'] / info["env_step"] if info['env_step'] > 0 else 0
             episode_info["episode_elapsed_seconds"] = info.get("episode_elapsed_seconds", time.time() - self.env._episode_start_time)
+            episode_info.update(self.planner.token_usage.episode_stats())
+            episode_info.update(image_encoder.episode_stats())
+            if self.planner.context_budget is not None:
+                episode_info['context_dropped_messages'] = self.planner.context_budget.dropped_messages
+                episode_info['context_dropped_images'] = self.planner.context_budget.dropped_images
+            episode_info.update(latency_tracker.episode_stats())
             
             self.env.save_episode_log()
             self.save_episode_metric(episode_info)
@@ -194,6 +231,13 @@ if __name__ == '__main__':
         parser.add_argument('--resolution', type=int, help='Resolution for processing.')
         parser.add_argument('--env_feedback', type=int, help='Set to True to enable environment feedback.')
         parser.add_argument('--tp', type=int, help='number of tensor parallel splits of the model parameters')
+        parser.add_argument('--resume', type=int, help='Set to True to skip episodes that already have results.')
+        parser.add_argument('--prompt_caching', type=int, help='Set to True to send the static prompt prefix for provider-side caching.')
+        parser.add_argument('--image_format', type=str, help='Encoding of the saved and sent frames: png, jpeg or webp.')
+        parser.add_argument('--context_max_tokens', type=int, help='Estimated token budget of the chat history sent to the model.')
+        parser.add_argument('--context_max_images', type=int, help='Number of most recent images kept in the chat history sent to the model.')
+        parser.add_argument('--stream_responses', type=int, help='Set to True to stream the model outputs and stop them once the plan is complete.')
+        parser.add_argument('--num_candidates', type=int, help='Number of completions sampled concurrently per step, the first valid plan is used.')
         return parser.parse_args()
 
     config = {
@@ -210,6 +254,8 @@ if __name__ == '__main__':
         'resolution': 500, 
         'env_feedback': 1,
         'tp': 1,
+        'resume': 0,
+        'prompt_caching': 0,
     }
     args = parse_arguments()
     update_config_with_args(config, args)
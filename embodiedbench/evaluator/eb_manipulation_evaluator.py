@@ -9,12 +9,17 @@ from embodiedbench.evaluator.config.system_prompts import eb_manipulation_system
 from embodiedbench.envs.eb_manipulation.EBManEnv import EBManEnv, EVAL_SETS, ValidEvalSets
 from embodiedbench.envs.eb_manipulation.eb_man_utils import form_object_coord_for_input, draw_bounding_boxes, draw_xyz_coordinate
 from embodiedbench.planner.manip_planner import ManipPlanner
+from embodiedbench.planner.response_cache import build_response_cache
+from embodiedbench.planner.rate_limiter import build_rate_limiter
+from embodiedbench.planner.image_encoder import image_encoder, configure_image_encoder
+from embodiedbench.planner.token_usage import TOTAL_KEYS
 from embodiedbench.evaluator.config.eb_manipulation_example import vlm_examples_baseline, llm_examples, vlm_examples_ablation
 from embodiedbench.main import logger
 
 class EB_ManipulationEvaluator():
     def __init__(self, config):
         self.model_name = config['model_name']
+        configure_image_encoder(config)
         self.eval_set = ValidEvalSets[0]
         self.config = config
         self.env = None
@@ -66,6 +71,8 @@ class EB_ManipulationEvaluator():
         success_number_of_task = 0
         planner_steps = 0
         output_format_error = 0
+        throttled_seconds = 0
+        token_totals = dict.fromkeys(TOTAL_KEYS, 0)
 
         for file_name in sorted(os.listdir(folder_path)):
             if file_name.endswith(".json") and file_name.startswith("episode"):
@@ -80,6 +87,9 @@ class EB_ManipulationEvaluator():
                     if task_success == 1:
                         success_number_of_task += 1
                     planner_steps += data["planner_steps"]
+                    throttled_seconds += data.get("throttled_seconds", 0)
+                    for key in TOTAL_KEYS:
+                        token_totals[key] += data.get(key, 0)
                     total_number_of_task += 1
 
         task_log = {}
@@ -89,6 +99,10 @@ class EB_ManipulationEvaluator():
         task_log["success_rate"] = success_number_of_task / total_number_of_task
         task_log["avg_planner_steps"] = planner_steps / total_number_of_task
         task_log["output_format_error"] = output_format_error
+        task_log["throttled_seconds"] = throttled_seconds
+        for key in TOTAL_KEYS:
+            task_log[f"run_{key}"] = token_totals[key]
+        task_log["tokens_per_success"] = token_totals["total_tokens"] / success_number_of_task if success_number_of_task else 0
 
         res_path = os.path.join(self.env.log_path, 'results')
         if not os.path.exists(res_path):
@@ -101,6 +115,7 @@ class EB_ManipulationEvaluator():
         while self.env._current_episode_num < self.env.number_of_episodes:
             logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
             episode_info = {'reward': [], 'action_success': []}
+            image_encoder.reset_stats()
             image_history = []
 
             _, obs = self.env.reset()
@@ -162,7 +177,7 @@ class EB_ManipulationEvaluator():
                     if self.config['detection_box'] and not self.config['language_only']:
                         img_path_list = draw_bounding_boxes(img_path_list, all_avg_point_list, camera_extrinsics_list, camera_intrinsics_list)
                         if self.config['multistep']:
-                            if image_history[-1].split('.png')[0] in img_path_list[0]:
+                            if os.path.splitext(image_history[-1])[0] in img_path_list[0]:
                                 image_history.pop()
                                 image_history.append(img_path_list[0])
             
@@ -174,6 +189,8 @@ class EB_ManipulationEvaluator():
             episode_info['planner_steps'] = self.planner.planner_steps
             episode_info['planner_output_error'] = self.planner.output_json_error
             episode_info["episode_elapsed_seconds"] = info["episode_elapsed_seconds"]
+            episode_info.update(self.planner.token_usage.episode_stats())
+            episode_info.update(image_encoder.episode_stats())
             self.save_episode_metric(episode_info)
             self.save_planner_outputs(reasoning_list)
             progress_bar.update()
@@ -220,7 +237,10 @@ class EB_ManipulationEvaluator():
                                         multistep=self.config["multistep"],
                                         visual_icl=self.config["visual_icl"],
                                         tp=self.config["tp"],
-                                        temperature=self.config.get('temperature', 0.0))
+                                        temperature=self.config.get('temperature', 0.0),
+                                        response_cache=build_response_cache(self.config),
+                                        rate_limiter=build_rate_limiter(self.config),
+                                        stream=self.config.get('stream_responses', False))
             self.evaluate()
             with open(os.path.join(self.log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
@@ -5,7 +5,11 @@ from tqdm import tqdm
 import json
 from embodiedbench.envs.eb_navigation.EBNavEnv import EBNavigationEnv, ValidEvalSets
 from embodiedbench.planner.nav_planner import EBNavigationPlanner
-from embodiedbench.evaluator.summarize_result import average_json_values
+from embodiedbench.planner.response_cache import build_response_cache, CacheMissError
+from embodiedbench.planner.rate_limiter import build_rate_limiter
+from embodiedbench.planner.plan_parser import load_plan_json
+from embodiedbench.planner.image_encoder import image_encoder, configure_image_encoder
+from embodiedbench.evaluator.summarize_result import ResultsLedger
 import sys
 import warnings
 
@@ -22,12 +26,14 @@ class EB_NavigationEvaluator():
     def __init__(self, config):
 
         self.model_name = config['model_name']
+        configure_image_encoder(config)
         self.eval_sets = config["eval_sets"]
         self.eval_set = None
         self.config = config
 
         self.env = None
         self.planner = None
+        self.ledger = None
 
     def save_episode_metric(self, episode_info):
         episode_idx = self.env._current_episode_num if not len(self.env.selected_indexes) else self.env.selected_indexes[self.env._current_episode_num - 1] + 1
@@ -37,6 +43,7 @@ class EB_NavigationEvaluator():
             os.makedirs(res_path)
         with open(os.path.join(res_path, filename), 'w', encoding='utf-8') as f:
             json.dump(episode_info, f, ensure_ascii=False)
+        self.ledger.add(filename, episode_info)
 
     def evaluate_main(self):
 
@@ -62,10 +69,12 @@ class EB_NavigationEvaluator():
                                            chat_history=self.config['chat_history'], language_only=self.config['language_only'], 
                                            multiview=self.config['multiview'], multistep = self.config['multistep'], 
                                            visual_icl = self.config['visual_icl'], truncate=self.config.get('truncate', False),
-                                           temperature=self.config.get('temperature', 0.0))
+                                           temperature=self.config.get('temperature', 0.0), response_cache=build_response_cache(self.config),
+                                           rate_limiter=build_rate_limiter(self.config), stream=self.config.get('stream_responses', False))
             
+            self.ledger = ResultsLedger(os.path.join(self.env.log_path, 'results'), summary_file='summary_all.json')
             self.evaluate()
-            average_json_values(os.path.join(self.env.log_path, 'results'), selected_key = None)
+            self.ledger.write_summary()
             with open(os.path.join(self.env.log_path, 'config.txt'), 'w') as f:
                 f.write(str(self.config))
 
@@ -74,6 +83,7 @@ class EB_NavigationEvaluator():
         while self.env._current_episode_num < self.env.number_of_episodes:
             logger.info(f"Evaluating episode {self.env._current_episode_num} ...")
             episode_info = {'reward': []}
+            image_encoder.reset_stats()
             obs = self.env.reset()
             img_path = self.env.save_image(obs)
             user_instruction = self.env.episode_language_instruction
@@ -84,7 +94,7 @@ class EB_NavigationEvaluator():
                 try:
                     action, reasoning = self.planner.act(img_path, user_instruction)
                     print(f"Planner Output Action: {action}")
-                    reasoning = json.loads(reasoning)
+                    reasoning = load_plan_json(reasoning)
                     if type(action) == list:
                         for i, action_single in enumerate( action[:min(self.env._max_episode_steps - self.env._current_step + 1, len(action))] ):
                             if i==0:
@@ -114,6 +124,8 @@ class EB_NavigationEvaluator():
                         img_path = self.env.save_image(obs)
                         episode_info['reward'].append(reward)
 
+                except CacheMissError:
+                    raise
                 except Exception as e:
                     sleep(1)
                     print(e)
@@ -132,6 +144,8 @@ class EB_NavigationEvaluator():
             # episode_info["num_invalid_actions"] = info["num_invalid_actions"]
             # episode_info["num_invalid_action_ratio"] = info["num_invalid_actions"] / info["env_step"]
             episode_info["episode_elapsed_seconds"] = info["episode_elapsed_seconds"]
+            episode_info.update(self.planner.token_usage.episode_stats())
+            episode_info.update(image_encoder.episode_stats())
             self.save_episode_metric(episode_info)
             progress_bar.update()
 
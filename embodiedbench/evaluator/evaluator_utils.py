@@ -1,6 +1,9 @@
 import json
 import os
+import re
 import glob
+from concurrent.futures import ThreadPoolExecutor
+from embodiedbench.main import logger
 
 def update_config_with_args(config, args):
     for key, value in vars(args).items():
@@ -19,3 +22,58 @@ def load_saved_data(path):
                 break
     return instructions
 
+
+def load_completed_episodes(res_path, pattern=r'episode_(\d+)_final_res\.json'):
+    """
+    Scan a results folder once and return the indexes of the episodes that already have a
+    complete result file. Files that fail to load, e.g. from a crash while writing, are ignored.
+    """
+    completed = set()
+    if not os.path.exists(res_path):
+        return completed
+    for filename in os.listdir(res_path):
+        match = re.fullmatch(pattern, filename)
+        if match is None:
+            continue
+        try:
+            with open(os.path.join(res_path, filename), 'r', encoding='utf-8') as f:
+                json.load(f)
+        except (OSError, ValueError):
+            continue
+        completed.add(int(match.group(1)))
+    return completed
+
+
+class EpisodePrefetcher():
+    """
+    Pipelines episode resets: while the current episode is being evaluated, the next one is
+    prepared with env.prepare_episode in a background thread, so the work that does not need
+    the simulator is off the critical path between model calls.
+    """
+    def __init__(self, env):
+        self.env = env
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = {}
+
+    def schedule(self, episode_num):
+        if episode_num >= self.env.number_of_episodes or episode_num in self.pending:
+            return
+        self.pending[episode_num] = self.executor.submit(self.env.prepare_episode, episode_num)
+
+    def reset(self):
+        episode_num = self.env._current_episode_num
+        self.schedule(episode_num)
+        try:
+            prepared = self.pending.pop(episode_num).result()
+        except Exception as e:
+            logger.warning(f"Failed to prepare episode {episode_num} in background: {e}")
+            prepared = None
+        obs = self.env.reset(prepared=prepared)
+        self.schedule(self.env._current_episode_num)
+        return obs
+
+    def close(self):
+        for future in self.pending.values():
+            future.cancel()
+        self.pending = {}
+        self.executor.shutdown(wait=True)
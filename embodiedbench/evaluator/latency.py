@@ -0,0 +1,98 @@
+import os
+import json
+import glob
+import time
+import functools
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+import numpy as np
+
+PERCENTILES = [50, 95, 99]
+
+
+class LatencyTracker():
+    """
+    Collects wall-clock samples (in seconds) of the stages of an episode, e.g. model inference,
+    prompt construction, simulator step and image saving. The evaluators reset it at the start
+    of every episode and store the samples next to the episode results. Samples are kept per
+    thread, so episodes run side by side in threads (lockstep evaluation) are tracked apart.
+    """
+    def __init__(self):
+        self._local = threading.local()
+
+    @property
+    def samples(self):
+        if not hasattr(self._local, 'samples'):
+            self._local.samples = defaultdict(list)
+        return self._local.samples
+
+    def reset(self):
+        self._local.samples = defaultdict(list)
+
+    def record(self, name, seconds):
+        self.samples[name].append(seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def episode_stats(self):
+        return latency_percentiles(self.samples)
+
+    def save(self, path):
+        folder = os.path.dirname(path)
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        with open(path, 'w') as f:
+            json.dump(self.samples, f)
+
+
+# shared by the planner, the model and the env of the current process
+latency_tracker = LatencyTracker()
+
+
+def timed(name):
+    """Decorator recording the duration of every call into latency_tracker under the given name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with latency_tracker.timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def latency_percentiles(samples):
+    stats = {}
+    for name, values in samples.items():
+        if not len(values):
+            continue
+        for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+            stats[f'latency_{name}_p{p}'] = float(value)
+    return stats
+
+
+def summarize_latency(log_path, summary_file):
+    """
+    Pool the latency samples of all episodes under log_path/latency and write the eval-set
+    percentiles into summary_file, replacing the per-episode averages of the same keys.
+    """
+    samples = defaultdict(list)
+    for latency_file in glob.glob(os.path.join(log_path, 'latency', '*.json')):
+        with open(latency_file, 'r') as f:
+            for name, values in json.load(f).items():
+                samples[name].extend(values)
+    if not len(samples):
+        return
+    summary = {}
+    if os.path.exists(summary_file):
+        with open(summary_file, 'r') as f:
+            summary = json.load(f)
+    summary.update(latency_percentiles(samples))
+    with open(summary_file, 'w') as f:
+        json.dump(summary, f, indent=4)
@@ -0,0 +1,181 @@
+import os
+import re
+import ast
+import json
+import argparse
+import numpy as np
+from tqdm import tqdm
+from embodiedbench.evaluator.summarize_result import ResultsLedger
+from embodiedbench.evaluator.latency import summarize_latency
+from embodiedbench.main import logger
+
+# Re-drives EB-ALFRED / EB-Habitat episodes from their step logs (episode_{idx}_step_{n}.json) without
+# a planner, and rewrites episode_{idx}_final_res.json and summary.json with the recomputed metrics.
+# Usage: python -m embodiedbench.evaluator.replay --env eb-alf --log_dir running/eb_alfred/gpt-4o_baseline/base
+
+STEP_LOG_PATTERN = r'episode_(\d+)_step_(\d+)\.json'
+# episode fields that come from the planner or the wall clock, they are kept from the original result
+# together with the latency percentiles
+PLANNER_KEYS = ['planner_steps', 'planner_output_error', 'episode_elapsed_seconds', 'throttled_seconds', 'prompt_tokens', 'cached_prompt_tokens',
+               'completion_tokens', 'image_tokens', 'total_tokens', 'tokens_per_planner_step', 'step_usage',
+               'image_cache_hits', 'image_cache_misses', 'image_cache_hit_rate', 'context_dropped_messages', 'context_dropped_images']
+
+
+def load_step_logs(log_dir):
+    """
+    Map each episode index to the actions recorded in its step log. If an episode was run several
+    times, the most recently written log is used.
+    """
+    latest = {}
+    for filename in os.listdir(log_dir):
+        match = re.fullmatch(STEP_LOG_PATTERN, filename)
+        if match is None:
+            continue
+        path = os.path.join(log_dir, filename)
+        episode_idx = int(match.group(1))
+        if episode_idx not in latest or os.path.getmtime(path) > os.path.getmtime(latest[episode_idx]):
+            latest[episode_idx] = path
+
+    step_logs = {}
+    for episode_idx, path in latest.items():
+        with open(path, 'r', encoding='utf-8') as f:
+            step_logs[episode_idx] = [json.loads(line) for line in f if line.strip()]
+    return step_logs
+
+
+def load_run_config(log_dir):
+    """Config of the original run, as written to config.txt by the evaluators."""
+    config_path = os.path.join(log_dir, 'config.txt')
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r') as f:
+        try:
+            return ast.literal_eval(f.read())
+        except (ValueError, SyntaxError):
+            logger.warning(f"Cannot parse {config_path}, using the command line arguments only")
+            return {}
+
+
+def replay_episode(env, steps, env_name):
+    """Step the recorded actions through a freshly reset env, following the evaluator's bookkeeping."""
+    episode_info = {'reward': [], 'num_invalid_actions': 0, 'empty_plan': 0}
+    info = {'task_success': 0, 'task_progress': 0, 'env_step': 0}
+    if env_name == 'eb-hab':
+        info['subgoal_reward'] = 0
+    num_mismatches = 0
+    for step in steps:
+        action = step['action_id']
+        if action == -2:  # empty plan stop here
+            episode_info['empty_plan'] = 1
+            info = {key: 0 for key in info}
+            info['env_step'] = env._current_step
+            break
+        if action == -1:  # invalid planner output, no env step
+            env._cur_invalid_actions += 1
+            episode_info['reward'].append(-1)
+            episode_info['num_invalid_actions'] += 1
+            info = {key: 0 for key in info}
+            info['env_step'] = env._current_step
+            if env._cur_invalid_actions >= env._max_invalid_actions:
+                break
+            continue
+        obs, reward, done, info = env.step(action, reasoning=step.get('reasoning', ''))
+        episode_info['reward'].append(reward)
+        episode_info['num_invalid_actions'] += (info['last_action_success'] == 0)
+        if 'last_action_success' in step and step['last_action_success'] != info['last_action_success']:
+            num_mismatches += 1
+        if done:
+            break
+    if num_mismatches:
+        logger.warning(f"{num_mismatches} replayed actions differ in success from the original run")
+
+    episode_info['instruction'] = env.episode_language_instruction
+    episode_info['reward'] = np.mean(episode_info['reward'])
+    episode_info['task_success'] = info['task_success']
+    episode_info['task_progress'] = info['task_progress']
+    if env_name == 'eb-hab':
+        episode_info['subgoal_reward'] = info['subgoal_reward']
+    episode_info['num_steps'] = info['env_step']
+    episode_info['num_invalid_actions'] = episode_info['num_invalid_actions']
+    episode_info['num_invalid_action_ratio'] = episode_info['num_invalid_actions'] / info['env_step'] if info['env_step'] > 0 else 0
+    return episode_info
+
+
+def save_replayed_metric(ledger, episode_idx, episode_info):
+    filename = 'episode_{}_final_res.json'.format(episode_idx)
+    path = os.path.join(ledger.res_path, filename)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            original = json.load(f)
+        for key, value in original.items():
+            if key in PLANNER_KEYS or key.startswith('latency_'):
+                episode_info[key] = value
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(episode_info, f, ensure_ascii=False)
+    ledger.add(filename, episode_info)
+
+
+def replay_alfred(step_logs, eval_set, down_sample_ratio, ledger):
+    from embodiedbench.envs.eb_alfred.EBAlfEnv import EBAlfEnv
+    # result and log files are named after the 1-based dataset index
+    episode_indexes = sorted(step_logs)
+    env = EBAlfEnv(eval_set=eval_set, down_sample_ratio=down_sample_ratio,
+                   selected_indexes=[idx - 1 for idx in episode_indexes])
+    for episode_idx in tqdm(episode_indexes, desc="Episodes"):
+        env.reset()
+        episode_info = replay_episode(env, step_logs[episode_idx], 'eb-alf')
+        save_replayed_metric(ledger, episode_idx, episode_info)
+    env.close()
+
+
+def replay_habitat(step_logs, eval_set, down_sample_ratio, ledger):
+    from embodiedbench.envs.eb_habitat.EBHabEnv import EBHabEnv
+    # the habitat env iterates over the episodes in order, skip the ones without a log
+    env = EBHabEnv(eval_set=eval_set, down_sample_ratio=down_sample_ratio)
+    last_idx = max(step_logs)
+    progress_bar = tqdm(total=len(step_logs), desc="Episodes")
+    while env._current_episode_num < min(env.number_of_episodes, last_idx):
+        episode_idx = env._current_episode_num + 1
+        if episode_idx not in step_logs:
+            env.skip_episode()
+            continue
+        env.reset()
+        episode_info = replay_episode(env, step_logs[episode_idx], 'eb-hab')
+        save_replayed_metric(ledger, episode_idx, episode_info)
+        progress_bar.update()
+    env.close()
+
+
+def replay(env_name, log_dir, eval_set=None, down_sample_ratio=None):
+    step_logs = load_step_logs(log_dir)
+    if not len(step_logs):
+        logger.warning(f"No step logs found in {log_dir}")
+        return
+    run_config = load_run_config(log_dir)
+    # the log folder is running/<env>/<exp>/<eval_set>
+    eval_set = eval_set or os.path.basename(os.path.normpath(log_dir))
+    if down_sample_ratio is None:
+        down_sample_ratio = run_config.get('down_sample_ratio', 1.0)
+    logger.info(f"Replaying {len(step_logs)} episodes of {eval_set} from {log_dir}")
+
+    if env_name not in ['eb-alf', 'eb-hab']:
+        raise ValueError(f"Replay is only supported for eb-alf and eb-hab, got {env_name}")
+    # replayed results are appended to the ledger and replace the original entries
+    ledger = ResultsLedger(os.path.join(log_dir, 'results'))
+    if env_name == 'eb-alf':
+        replay_alfred(step_logs, eval_set, down_sample_ratio, ledger)
+    else:
+        replay_habitat(step_logs, eval_set, down_sample_ratio, ledger)
+    ledger.write_summary()
+    summarize_latency(log_dir, ledger.summary_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Recompute episode metrics by replaying the logged actions.')
+    parser.add_argument('--env', type=str, required=True, choices=['eb-alf', 'eb-hab'], help='The environment of the run.')
+    parser.add_argument('--log_dir', type=str, required=True, help='Log folder of one eval set, e.g. running/eb_alfred/<exp>/base.')
+    parser.add_argument('--eval_set', type=str, help='Eval set of the run, defaults to the name of the log folder.')
+    parser.add_argument('--down_sample_ratio', type=float, help='Down sample ratio of the run, defaults to the one in config.txt.')
+    args = parser.parse_args()
+
+    replay(args.env, args.log_dir, args.eval_set, args.down_sample_ratio)
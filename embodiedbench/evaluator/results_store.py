@@ -0,0 +1,243 @@
+import os
+import re
+import ast
+import time
+import sys
+import json
+import sqlite3
+import argparse
+from embodiedbench.evaluator.summarize_result import numeric_values
+
+# SQLite store of the per-episode metrics of all the runs under running/, one row per
+# (run, episode, metric), so that cross-experiment queries do not walk the result folders.
+# Usage:
+#   python -m embodiedbench.evaluator.results_store ingest --root running
+#   python -m embodiedbench.evaluator.results_store query --group_by model,eval_set --metrics task_success --where env=eb-alf
+#   python -m embodiedbench.evaluator.results_store diff --a model=gpt-4o,experiment=baseline --b model=gpt-4o,experiment=cot
+
+DEFAULT_DB = 'running/results.db'
+# log folder name under running/ of each environment
+ENV_FOLDERS = {
+    'eb_alfred': 'eb-alf',
+    'eb_habitat': 'eb-hab',
+    'eb_nav': 'eb-nav',
+    'eb_manipulation': 'eb-man',
+}
+# episode_{i}_final_res.json for EB-ALFRED, EB-Habitat and EB-Navigation, episode_{i}_res.json for EB-Manipulation
+EPISODE_FILE_PATTERN = r'episode_(\d+)_(?:final_)?res\.json'
+RUN_KEYS = ['env', 'model', 'experiment', 'eval_set']
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    env TEXT, model TEXT, experiment TEXT, eval_set TEXT,
+    log_path TEXT UNIQUE, config TEXT, signature TEXT, ingested_at REAL
+);
+CREATE TABLE IF NOT EXISTS metrics (
+    run_id INTEGER, episode INTEGER, metric TEXT, value REAL,
+    PRIMARY KEY (run_id, episode, metric)
+);
+CREATE INDEX IF NOT EXISTS metrics_metric ON metrics (metric, run_id);
+'''
+
+
+def load_run_config(log_path):
+    """Config of a run, as written to config.txt by the evaluators."""
+    config_path = os.path.join(log_path, 'config.txt')
+    if not os.path.exists(config_path):
+        return {}
+    with open(config_path, 'r') as f:
+        try:
+            return ast.literal_eval(f.read())
+        except (ValueError, SyntaxError):
+            return {}
+
+
+def find_result_dirs(root):
+    """Yield (env, log_path) of every results folder with episode files under root."""
+    for env_folder, env in ENV_FOLDERS.items():
+        env_root = os.path.join(root, env_folder)
+        if not os.path.isdir(env_root):
+            continue
+        for dirpath, dirnames, filenames in os.walk(env_root):
+            # images, videos and latency samples hold no results
+            dirnames[:] = [d for d in dirnames if d not in ('images', 'video', 'latency')]
+            if os.path.basename(dirpath) == 'results':
+                dirnames[:] = []
+                yield env, os.path.dirname(dirpath)
+
+
+def describe_run(root, env, log_path, config):
+    """Model, experiment and eval set of a run, the model and experiment from its config."""
+    eval_set = os.path.basename(log_path)
+    model = config['model_name'].split('/')[-1]
+    experiment = config.get('exp_name') or ''
+    return model, experiment, eval_set
+
+
+class ResultsStore():
+    def __init__(self, db_path=DEFAULT_DB):
+        folder = os.path.dirname(db_path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def ingest(self, root='running', force=False):
+        """
+        Load the episode results of all the runs under root. Runs whose result files are unchanged
+        since the last ingest, and runs without a config.txt, are skipped. Returns the number of
+        (re)ingested runs.
+        """
+        num_ingested = 0
+        for env, log_path in find_result_dirs(root):
+            res_path = os.path.join(log_path, 'results')
+            episode_files = []
+            for entry in os.scandir(res_path):
+                match = re.fullmatch(EPISODE_FILE_PATTERN, entry.name)
+                if match is not None:
+                    episode_files.append((int(match.group(1)), entry.path, entry.stat().st_mtime))
+            if not len(episode_files):
+                continue
+            signature = '{}:{}'.format(len(episode_files), max(mtime for _, _, mtime in episode_files))
+            row = self.conn.execute('SELECT run_id, signature FROM runs WHERE log_path = ?', (log_path,)).fetchone()
+            if row is not None and row[1] == signature and not force:
+                continue
+
+            config = load_run_config(log_path)
+            if 'model_name' not in config:
+                # config.txt is written once an eval set is done; the folder name joins model and
+                # experiment ambiguously, so a key guessed from it would not match the final one
+                print(f"Skipping {log_path}: no config.txt, the run is unfinished or predates it", file=sys.stderr)
+                continue
+            model, experiment, eval_set = describe_run(root, env, log_path, config)
+            rows = []
+            for episode, path, _ in episode_files:
+                try:
+                    with open(path, 'r') as f:
+                        values = numeric_values(json.load(f))
+                except (OSError, ValueError):
+                    continue
+                rows.extend((episode, metric, value) for metric, value in values.items())
+
+            with self.conn:
+                if row is not None:
+                    run_id = row[0]
+                    self.conn.execute('DELETE FROM metrics WHERE run_id = ?', (run_id,))
+                    self.conn.execute('UPDATE runs SET env=?, model=?, experiment=?, eval_set=?, config=?, signature=?, ingested_at=? WHERE run_id=?',
+                                      (env, model, experiment, eval_set, json.dumps(config, default=str), signature, time.time(), run_id))
+                else:
+                    run_id = self.conn.execute('INSERT INTO runs (env, model, experiment, eval_set, log_path, config, signature, ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                                               (env, model, experiment, eval_set, log_path, json.dumps(config, default=str), signature, time.time())).lastrowid
+                self.conn.executemany('INSERT OR REPLACE INTO metrics (run_id, episode, metric, value) VALUES (?, ?, ?, ?)',
+                                      [(run_id,) + r for r in rows])
+            num_ingested += 1
+        return num_ingested
+
+    def query(self, metrics, group_by=('model', 'eval_set'), filters={}):
+        """Mean and episode count of each metric per group of runs."""
+        for key in list(group_by) + list(filters):
+            if key not in RUN_KEYS + ['episode']:
+                raise ValueError(f"Unknown key {key}, choose from {RUN_KEYS + ['episode']}")
+        group_cols = ', '.join(('m.episode' if key == 'episode' else f'r.{key}') for key in group_by)
+        where, params = self._where(filters)
+        metric_cols = ', '.join('AVG(CASE WHEN m.metric = ? THEN m.value END), SUM(m.metric = ?)' for _ in metrics)
+        sql = f'''SELECT {group_cols}, {metric_cols} FROM metrics m JOIN runs r ON m.run_id = r.run_id
+                  WHERE m.metric IN ({', '.join('?' for _ in metrics)}) {where}
+                  GROUP BY {group_cols} ORDER BY {group_cols}'''
+        metric_params = [p for metric in metrics for p in (metric, metric)]
+        header = list(group_by) + [col for metric in metrics for col in (metric, f'{metric}_n')]
+        return header, self.conn.execute(sql, metric_params + list(metrics) + params).fetchall()
+
+    def _where(self, filters):
+        clauses, params = [], []
+        for key, value in filters.items():
+            if key not in RUN_KEYS:
+                raise ValueError(f"Unknown filter {key}, choose from {RUN_KEYS}")
+            clauses.append(f'r.{key} = ?')
+            params.append(value)
+        return ''.join(' AND ' + c for c in clauses), params
+
+    def diff(self, metric, filters_a, filters_b):
+        """
+        Compare two experiments per eval set on the episodes they have in common:
+        mean of each side, the difference and the number of paired episodes.
+        """
+        where_a, params_a = self._where(filters_a)
+        where_b, params_b = self._where(filters_b)
+        sql = f'''
+            WITH a AS (SELECT r.env, r.eval_set, m.episode, AVG(m.value) AS value FROM metrics m JOIN runs r ON m.run_id = r.run_id
+                       WHERE m.metric = ? {where_a} GROUP BY r.env, r.eval_set, m.episode),
+                 b AS (SELECT r.env, r.eval_set, m.episode, AVG(m.value) AS value FROM metrics m JOIN runs r ON m.run_id = r.run_id
+                       WHERE m.metric = ? {where_b} GROUP BY r.env, r.eval_set, m.episode)
+            SELECT a.env, a.eval_set, AVG(a.value), AVG(b.value), AVG(b.value) - AVG(a.value), COUNT(*)
+            FROM a JOIN b ON a.env = b.env AND a.eval_set = b.eval_set AND a.episode = b.episode
+            GROUP BY a.env, a.eval_set ORDER BY a.env, a.eval_set'''
+        rows = self.conn.execute(sql, [metric] + params_a + [metric] + params_b).fetchall()
+        return ['env', 'eval_set', f'{metric}_a', f'{metric}_b', 'delta', 'n_episodes'], rows
+
+    def runs(self, filters={}):
+        where, params = self._where(filters)
+        sql = f'''SELECT r.env, r.model, r.experiment, r.eval_set, COUNT(DISTINCT m.episode), r.log_path
+                  FROM runs r LEFT JOIN metrics m ON m.run_id = r.run_id WHERE 1 = 1 {where}
+                  GROUP BY r.run_id ORDER BY r.env, r.model, r.experiment, r.eval_set'''
+        return ['env', 'model', 'experiment', 'eval_set', 'n_episodes', 'log_path'], self.conn.execute(sql, params).fetchall()
+
+
+def parse_filters(text):
+    """'model=gpt-4o,eval_set=base' -> {'model': 'gpt-4o', 'eval_set': 'base'}"""
+    filters = {}
+    for item in (text or '').split(','):
+        if item.strip():
+            key, value = item.split('=', 1)
+            filters[key.strip()] = value.strip()
+    return filters
+
+
+def print_table(header, rows):
+    def fmt(value):
+        if isinstance(value, float):
+            return f'{value:.4f}'
+        return '' if value is None else str(value)
+    table = [header] + [[fmt(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in table) for i in range(len(header))]
+    for row in table:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest and query the episode results of all experiments.')
+    parser.add_argument('--db', type=str, default=DEFAULT_DB, help='Path of the SQLite results store.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    ingest_parser = subparsers.add_parser('ingest', help='Load new or changed runs into the store.')
+    ingest_parser.add_argument('--root', type=str, default='running', help='Folder holding the eb_* log folders.')
+    ingest_parser.add_argument('--force', action='store_true', help='Re-ingest unchanged runs.')
+
+    query_parser = subparsers.add_parser('query', help='Average metrics per group.')
+    query_parser.add_argument('--metrics', type=str, default='task_success', help='Comma separated metrics.')
+    query_parser.add_argument('--group_by', type=str, default='model,eval_set', help=f'Comma separated keys from {RUN_KEYS}.')
+    query_parser.add_argument('--where', type=str, help='Filters, e.g. env=eb-alf,experiment=baseline.')
+
+    diff_parser = subparsers.add_parser('diff', help='Compare two experiments on their common episodes.')
+    diff_parser.add_argument('--a', type=str, required=True, help='Filters selecting the first experiment.')
+    diff_parser.add_argument('--b', type=str, required=True, help='Filters selecting the second experiment.')
+    diff_parser.add_argument('--metric', type=str, default='task_success', help='Metric to compare.')
+
+    runs_parser = subparsers.add_parser('runs', help='List the ingested runs.')
+    runs_parser.add_argument('--where', type=str, help='Filters, e.g. env=eb-hab.')
+    args = parser.parse_args()
+
+    store = ResultsStore(args.db)
+    if args.command == 'ingest':
+        print(f"Ingested {store.ingest(args.root, force=args.force)} runs into {args.db}")
+    elif args.command == 'query':
+        print_table(*store.query(args.metrics.split(','), args.group_by.split(','), parse_filters(args.where)))
+    elif args.command == 'diff':
+        print_table(*store.diff(args.metric, parse_filters(args.a), parse_filters(args.b)))
+    elif args.command == 'runs':
+        print_table(*store.runs(parse_filters(args.where)))
+    store.close()
@@ -2,6 +2,8 @@ import os
 import json
 import glob
 import argparse
+import threading
+from embodiedbench.planner.token_usage import TOTAL_KEYS
 
 def average_json_values(json_dir, target_file='*.json', output_file='summary_all.json', selected_key=None):
     values_sum = {}
@@ -14,14 +16,10 @@ def average_json_values(json_dir, target_file='*.json', output_file='summary_all
         with open(json_file, 'r') as f:
             data = json.load(f)
             print(data[selected_key] if selected_key!= None else data)
-            for key, value in data.items():
+            # strings and per-step lists such as step_usage are not averaged
+            for key, value in numeric_values(data).items():
                 if selected_key != None and key != selected_key:
                     continue
-                if type(value) == str:
-                    continue
-                    
-                if isinstance(value, list) and len(value) == 1:
-                    value = value[0]
                 if key not in values_sum:
                     values_sum[key] = 0.0
                     counts[key] = 0
@@ -35,6 +33,100 @@ def average_json_values(json_dir, target_file='*.json', output_file='summary_all
         json.dump(averages, f, indent=4)
 
 
+def numeric_values(data):
+    """The entries of an episode result that are averaged into the summary."""
+    values = {}
+    for key, value in data.items():
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        if isinstance(value, bool) or isinstance(value, (int, float)):
+            values[key] = float(value)
+    return values
+
+
+class ResultsLedger():
+    """
+    Append-only ledger (results/ledger.jsonl) of the episode results of one eval set, with running
+    sums of their values. Every saved episode appends one line and refreshes the summary file, so
+    the summary is available during the run without reopening the episode files. Lines appended by
+    other worker processes are picked up incrementally, and when an episode appears several
+    times, e.g. after a replay, the last entry wins.
+    """
+    def __init__(self, res_path, summary_file='summary.json'):
+        self.res_path = res_path
+        self.ledger_path = os.path.join(res_path, 'ledger.jsonl')
+        self.summary_path = os.path.join(res_path, summary_file)
+        self.values_sum = {}
+        self.counts = {}
+        self.episodes = {}
+        self.offset = 0
+        if not os.path.exists(res_path):
+            os.makedirs(res_path)
+        if not os.path.exists(self.ledger_path):
+            self._bootstrap()
+        self.sync()
+
+    def _bootstrap(self):
+        # results written before the ledger existed are ingested once
+        lines = []
+        for json_file in sorted(glob.glob(os.path.join(self.res_path, 'episode_*.json'))):
+            try:
+                with open(json_file, 'r') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            lines.append(json.dumps({'episode': os.path.basename(json_file), 'values': numeric_values(data)}) + '\n')
+        with open(self.ledger_path, 'a') as f:
+            f.writelines(lines)
+
+    def _apply(self, episode, values):
+        for key, value in self.episodes.pop(episode, {}).items():
+            self.values_sum[key] -= value
+            self.counts[key] -= 1
+        for key, value in values.items():
+            self.values_sum[key] = self.values_sum.get(key, 0.0) + value
+            self.counts[key] = self.counts.get(key, 0) + 1
+        self.episodes[episode] = values
+
+    def sync(self):
+        """Read the ledger lines appended since the last sync."""
+        with open(self.ledger_path, 'r') as f:
+            f.seek(self.offset)
+            for line in f:
+                # a line without newline is still being written by another process
+                if not line.endswith('\n'):
+                    break
+                self.offset += len(line.encode('utf-8'))
+                entry = json.loads(line)
+                self._apply(entry['episode'], entry['values'])
+
+    def add(self, episode, episode_info):
+        """Record the result of an episode, named after its result file, and refresh the summary."""
+        values = numeric_values(episode_info)
+        with open(self.ledger_path, 'a') as f:
+            f.write(json.dumps({'episode': episode, 'values': values}) + '\n')
+        self.sync()
+        self.write_summary()
+
+    def summary(self):
+        summary = {key: self.values_sum[key] / self.counts[key] for key in self.values_sum if self.counts[key] > 0}
+        # token usage is also reported as run totals, and per successful episode
+        for key in TOTAL_KEYS:
+            if self.counts.get(key, 0) > 0:
+                summary[f'run_{key}'] = self.values_sum[key]
+        if self.counts.get('total_tokens', 0) > 0 and self.values_sum.get('task_success', 0) > 0:
+            summary['tokens_per_success'] = self.values_sum['total_tokens'] / self.values_sum['task_success']
+        return summary
+
+    def write_summary(self):
+        summary = self.summary()
+        # worker processes and lockstep threads write the summary concurrently
+        tmp_path = '%s.%d.%d.tmp' % (self.summary_path, os.getpid(), threading.get_ident())
+        with open(tmp_path, 'w') as f:
+            json.dump(summary, f, indent=4)
+        os.replace(tmp_path, self.summary_path)
+        return summary
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Process JSON files to compute average values.')
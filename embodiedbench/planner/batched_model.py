@@ -0,0 +1,110 @@
+import time
+import threading
+from embodiedbench.evaluator.latency import timed
+from embodiedbench.planner.token_usage import current_counter, counting, FanOutCounter
+from embodiedbench.main import logger
+
+# seconds a request waits for the other lanes before its batch is sent incomplete
+LOCKSTEP_MAX_WAIT = 2.0
+
+
+class _Request():
+    def __init__(self, message_history):
+        self.message_history = message_history
+        # usage counter of the requesting planner step, the batch may run in another lane's thread
+        self.counter = current_counter()
+        self.out = None
+        self.error = None
+        self.done = False
+
+
+class BatchedModel():
+    """
+    Lockstep batching of the requests of several planners to one RemoteModel. Every planner gets
+    a lane; a request waits until each open lane has a request pending (or max_wait passed) and
+    the pending requests are answered by a single RemoteModel.respond_batch call, which sends
+    them to the lmdeploy pipeline of a local model as one batch. The thread completing the batch
+    runs it, the responses are handed back to the requesting lanes.
+    """
+    def __init__(self, model, max_wait=LOCKSTEP_MAX_WAIT):
+        self.model = model
+        self.max_wait = max_wait
+        self.cond = threading.Condition()
+        self.pending = []
+        self.num_lanes = 0
+        self.num_batches = 0
+        self.num_requests = 0
+
+    def lane(self):
+        with self.cond:
+            self.num_lanes += 1
+        return ModelLane(self)
+
+    def close_lane(self):
+        with self.cond:
+            self.num_lanes -= 1
+            # the pending batch may now be complete
+            self.cond.notify_all()
+
+    def respond(self, message_history):
+        request = _Request(message_history)
+        with self.cond:
+            self.pending.append(request)
+            deadline = time.monotonic() + self.max_wait
+            while not request.done:
+                waiting = any(r is request for r in self.pending)
+                if waiting and (len(self.pending) >= self.num_lanes or time.monotonic() >= deadline):
+                    batch, self.pending = self.pending, []
+                    self.cond.release()
+                    try:
+                        self._run(batch)
+                    finally:
+                        self.cond.acquire()
+                    self.cond.notify_all()
+                else:
+                    # a request taken by another lane is always followed by a notify
+                    self.cond.wait(max(0.0, deadline - time.monotonic()) if waiting else None)
+        if request.error is not None:
+            raise request.error
+        return request.out
+
+    def _run(self, batch):
+        try:
+            counters = [r.counter for r in batch]
+            # every lane of the batch waits on the rate limit, the tokens go to the lane of each response
+            with counting(FanOutCounter(counters)):
+                outs = self.model.respond_batch([r.message_history for r in batch], counters=counters)
+            for request, out in zip(batch, outs):
+                request.out = out
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        for request in batch:
+            request.done = True
+        self.num_batches += 1
+        self.num_requests += len(batch)
+
+    def log_stats(self):
+        if self.num_batches:
+            logger.info(f"Batched {self.num_requests} model requests into {self.num_batches} calls "
+                        f"(mean batch size {self.num_requests / self.num_batches:.2f})")
+
+
+class ModelLane():
+    """The model of one lockstep planner, with the RemoteModel interface."""
+    def __init__(self, batched_model):
+        self.batched_model = batched_model
+        self.closed = False
+
+    def __getattr__(self, name):
+        # model_name, model_type, ... of the shared model
+        return getattr(self.batched_model.model, name)
+
+    @timed('inference')
+    def respond(self, message_history: list):
+        return self.batched_model.respond(message_history)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.batched_model.close_lane()
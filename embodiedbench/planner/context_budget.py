@@ -0,0 +1,118 @@
+import re
+import json
+from embodiedbench.planner.planner_utils import estimate_tokens
+from embodiedbench.main import logger
+
+IMAGE_PLACEHOLDER = "[image of an earlier step omitted]"
+# characters kept of each plan in the summary of the dropped turns
+SUMMARY_PLAN_CHARS = 300
+
+
+class ContextBudget():
+    """
+    Keeps the chat history sent to the model within a token and image budget, so the prompt
+    stops growing with the episode. The planner keeps the full history and sends the trimmed
+    copy returned by `apply`, in three passes:
+
+    - image dropping: only the `max_images` most recent images are sent, older ones are
+      replaced by a short text placeholder;
+    - sliding window: the oldest turns are dropped until the estimated prompt fits `max_tokens`.
+      The first message (system prompt, examples and the first observation) and the current
+      one are always kept, so the cached prompt prefix stays stable;
+    - summary collapse: the dropped turns are replaced by one assistant message listing the
+      plans the model gave in them. The action history is repeated in every prompt anyway.
+
+    Token counts are estimated locally with `estimate_tokens`. `dropped_messages` and
+    `dropped_images` count what the last `apply` left out: the history only grows, so at the end
+    of an episode they are the number of distinct messages and images that were dropped.
+    """
+    def __init__(self, max_tokens=None, max_images=None):
+        self.max_tokens = max_tokens
+        self.max_images = max_images
+        self.dropped_messages = 0
+        self.dropped_images = 0
+
+    def apply(self, messages):
+        # every call trims the full history again, the counts are those of this call
+        self.reset()
+        messages = self.drop_images(messages)
+        if self.max_tokens and estimate_tokens(messages) > self.max_tokens:
+            messages = self.collapse_turns(messages)
+        return messages
+
+    def drop_images(self, messages):
+        if self.max_images is None:
+            return messages
+        kept = 0
+        trimmed = []
+        for message in reversed(messages):
+            content = message["content"]
+            if type(content) != str and any(item["type"] != "text" for item in content):
+                new_content = []
+                for item in reversed(content):
+                    if item["type"] == "text":
+                        new_content.append(item)
+                    elif kept < self.max_images:
+                        new_content.append(item)
+                        kept += 1
+                    else:
+                        new_content.append({"type": "text", "text": IMAGE_PLACEHOLDER})
+                        self.dropped_images += 1
+                message = dict(message, content=new_content[::-1])
+            trimmed.append(message)
+        return trimmed[::-1]
+
+    def collapse_turns(self, messages):
+        # the dropped span starts after the first message and ends on an assistant message, which
+        # the summary replaces, so user and assistant turns keep alternating
+        cuts = [i for i in range(1, len(messages) - 1) if messages[i]["role"] == "assistant"]
+        if not cuts:
+            return messages
+        base_tokens = estimate_tokens(messages[:1])
+        tail_tokens = [estimate_tokens([message]) for message in messages]
+        collapsed = messages
+        for cut in cuts:
+            summary = self.summarize(messages[1:cut + 1])
+            collapsed = messages[:1] + [summary] + messages[cut + 1:]
+            if base_tokens + estimate_tokens([summary]) + sum(tail_tokens[cut + 1:]) <= self.max_tokens:
+                break
+        num_dropped = len(messages) - len(collapsed) + 1
+        self.dropped_messages = num_dropped
+        logger.debug(f"Context budget: collapsed {num_dropped} messages into a summary")
+        return collapsed
+
+    def summarize(self, messages):
+        plans = []
+        for message in messages:
+            if message["role"] != "assistant":
+                continue
+            plans.append("- " + self.extract_plan(message)[:SUMMARY_PLAN_CHARS])
+        text = f"[Summary of {len(messages)} earlier messages omitted to fit the context budget] My previous plans were:\n" + "\n".join(plans)
+        return {"role": "assistant", "content": [{"type": "text", "text": text}]}
+
+    @staticmethod
+    def extract_plan(message):
+        content = message["content"]
+        text = content if type(content) == str else " ".join(item["text"] for item in content if item["type"] == "text")
+        match = re.search(r"\{.*\}", text, re.DOTALL)
+        if match:
+            try:
+                output = json.loads(match.group())
+                if output.get("language_plan"):
+                    return str(output["language_plan"]).replace("\n", " ")
+            except (json.JSONDecodeError, AttributeError):
+                pass
+        return text.replace("\n", " ")
+
+    def reset(self):
+        self.dropped_messages = 0
+        self.dropped_images = 0
+
+
+def build_context_budget(config):
+    """Create the chat history budget described by the eval config, or None if it is disabled."""
+    max_tokens = config.get('context_max_tokens', None)
+    max_images = config.get('context_max_images', None)
+    if not max_tokens and max_images is None:
+        return None
+    return ContextBudget(max_tokens=max_tokens, max_images=max_images)
@@ -1,5 +1,4 @@
 import requests
-import torch
 import os
 import io
 import requests
@@ -0,0 +1,158 @@
+import io
+import os
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from mimetypes import guess_type
+import numpy as np
+from PIL import Image
+
+# image format: PIL format name, MIME type and file extension
+IMAGE_FORMATS = {
+    'png': ('PNG', 'image/png', '.png'),
+    'jpeg': ('JPEG', 'image/jpeg', '.jpg'),
+    'webp': ('WEBP', 'image/webp', '.webp'),
+}
+# default number of encoded images kept in memory, must cover the multistep and chat history windows
+IMAGE_CACHE_SIZE = 64
+
+
+class ImageEncoder():
+    """
+    Encodes the observations once, in memory. The environments save frames through it and the
+    planners get the data URL of a saved frame without reading the file back, so each frame is
+    compressed and base64-encoded a single time. Frames that are not saved (numpy arrays given
+    to a planner) are encoded in memory instead of through a temporary file.
+
+    Encoded images are kept in an LRU cache keyed by file path (validated with the mtime and size
+    of the file) or by a hash of the frame, so the images re-sent by multistep prompts and chat
+    histories are not encoded again. Hits and misses are counted per thread and reset by the
+    evaluators at the start of every episode.
+    """
+    def __init__(self, image_format='png', quality=90, max_side=None, cache_size=IMAGE_CACHE_SIZE):
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self._local = threading.local()
+        self.configure(image_format, quality, max_side, cache_size)
+
+    def configure(self, image_format='png', quality=90, max_side=None, cache_size=IMAGE_CACHE_SIZE):
+        if image_format not in IMAGE_FORMATS:
+            raise ValueError(f"Unsupported image format {image_format}, choose from {list(IMAGE_FORMATS)}")
+        self.image_format = image_format
+        self.quality = quality
+        self.max_side = max_side
+        self.cache_size = cache_size
+        self.pil_format, self.mime_type, self.extension = IMAGE_FORMATS[image_format]
+        # frames encoded with the previous settings are stale
+        with self.lock:
+            self.cache.clear()
+
+    @property
+    def stats(self):
+        if not hasattr(self._local, 'stats'):
+            self._local.stats = {'hits': 0, 'misses': 0}
+        return self._local.stats
+
+    def reset_stats(self):
+        self._local.stats = {'hits': 0, 'misses': 0}
+
+    def episode_stats(self):
+        hits, misses = self.stats['hits'], self.stats['misses']
+        stats = {'image_cache_hits': hits, 'image_cache_misses': misses}
+        if hits + misses:
+            stats['image_cache_hit_rate'] = hits / (hits + misses)
+        return stats
+
+    def encode(self, image):
+        """Compressed bytes of a numpy frame or PIL image."""
+        if isinstance(image, np.ndarray):
+            image = Image.fromarray(image)
+        if self.max_side and max(image.size) > self.max_side:
+            scale = self.max_side / max(image.size)
+            image = image.resize((max(1, round(image.size[0] * scale)), max(1, round(image.size[1] * scale))), Image.BILINEAR)
+        if self.pil_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        buffer = io.BytesIO()
+        if self.pil_format == 'PNG':
+            image.save(buffer, format='PNG')
+        else:
+            image.save(buffer, format=self.pil_format, quality=self.quality)
+        return buffer.getvalue()
+
+    def to_data_url(self, data, mime_type=None):
+        return f"data:{mime_type or self.mime_type};base64,{base64.b64encode(data).decode('utf-8')}"
+
+    def lookup(self, key, signature=None):
+        """Cached entry of key, counted as a hit, or None if missing or its signature changed."""
+        with self.lock:
+            entry = self.cache.get(key)
+            if entry is not None and entry[0] == signature:
+                self.cache.move_to_end(key)
+            else:
+                entry = None
+        self.stats['hits' if entry is not None else 'misses'] += 1
+        return entry
+
+    def store(self, key, signature, data, data_url=None):
+        entry = [signature, data, data_url]
+        with self.lock:
+            self.cache[key] = entry
+            self.cache.move_to_end(key)
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return entry
+
+    def data_url(self, image):
+        """Data URL of a numpy frame, encoded once per distinct frame."""
+        if not isinstance(image, np.ndarray):
+            return self.to_data_url(self.encode(image))
+        digest = hashlib.blake2b(image.tobytes(), digest_size=16)
+        digest.update(f'{image.shape}{image.dtype}'.encode())
+        key = 'frame:' + digest.hexdigest()
+        entry = self.lookup(key)
+        if entry is None:
+            entry = self.store(key, None, None, self.to_data_url(self.encode(image)))
+        return entry[2]
+
+    def save(self, image, path):
+        """
+        Encode image and write it to path, with the extension of the configured format. Returns
+        the written path, whose data URL is then served from memory.
+        """
+        path = os.path.splitext(path)[0] + self.extension
+        data = self.encode(image)
+        with open(path, 'wb') as f:
+            f.write(data)
+        stat = os.stat(path)
+        # the data URL is built on the first request, language-only planners never ask
+        self.store(path, (stat.st_mtime_ns, stat.st_size), data)
+        return path
+
+    def file_data_url(self, path):
+        """Data URL of an image file, read and encoded again only when the file changed."""
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        entry = self.lookup(path, signature)
+        if entry is None:
+            with open(path, 'rb') as f:
+                entry = self.store(path, signature, f.read())
+        if entry[2] is None:
+            # Guess the MIME type of the image based on the file extension
+            mime_type, _ = guess_type(path)
+            entry[2] = self.to_data_url(entry[1], mime_type or 'application/octet-stream')
+            # only the data URL is needed from now on
+            entry[1] = None
+        return entry[2]
+
+
+# shared by the environments and the planners of the current process, configured by the evaluators
+image_encoder = ImageEncoder()
+
+
+def configure_image_encoder(config):
+    image_encoder.configure(image_format=config.get('image_format', None) or 'png',
+                            quality=config.get('image_quality', None) or 90,
+                            max_side=config.get('image_max_side', None),
+                            cache_size=config.get('image_cache_size', None) or IMAGE_CACHE_SIZE)
+
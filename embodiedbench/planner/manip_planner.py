@@ -1,6 +1,5 @@
 import os.path as osp
 import numpy as np
-import cv2
 import base64
 import json
 import ast
@@ -11,7 +10,9 @@ from mimetypes import guess_type
 from embodiedbench.envs.eb_manipulation.eb_man_utils import ROTATION_RESOLUTION, VOXEL_SIZE
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
-from embodiedbench.planner.planner_utils import local_image_to_data_url, template_manip, template_lang_manip
+from embodiedbench.planner.token_usage import TokenUsage
+from embodiedbench.planner.planner_utils import local_image_to_data_url, image_to_data_url, template_manip, template_lang_manip
+from embodiedbench.planner.plan_parser import load_plan_json
 from embodiedbench.main import logger
 
 VISUAL_ICL_EXAMPLES_PATH = "embodiedbench/evaluator/config/visual_icl_examples/eb_manipulation"
@@ -23,7 +24,7 @@ VISUAL_ICL_EXAMPLE_CATEGORY = {
 }
 
 class ManipPlanner():
-    def __init__(self, model_name, model_type, system_prompt, examples, n_shot=0, obs_key='front_rgb', chat_history=False, language_only=False, multiview=False, multistep=False, visual_icl=False, tp=1, temperature=0.0, kwargs={}):
+    def __init__(self, model_name, model_type, system_prompt, examples, n_shot=0, obs_key='front_rgb', chat_history=False, language_only=False, multiview=False, multistep=False, visual_icl=False, tp=1, temperature=0.0, response_cache=None, rate_limiter=None, stream=False, kwargs={}):
         self.model_name = model_name
         self.model_type = model_type
         self.obs_key = obs_key
@@ -34,10 +35,12 @@ class ManipPlanner():
         if model_type == 'custom':
             self.model = CustomModel(model_name, language_only)
         else:
-            self.model = RemoteModel(model_name, model_type, language_only, tp=tp, task_type='manip', temperature=temperature)
+            self.model = RemoteModel(model_name, model_type, language_only, tp=tp, task_type='manip', temperature=temperature,
+                                     response_cache=response_cache, rate_limiter=rate_limiter, stream=stream)
 
         self.planner_steps = 0
         self.output_json_error = 0
+        self.token_usage = TokenUsage()
         self.language_only = language_only
         self.kwargs = kwargs
         self.multi_view = multiview
@@ -121,12 +124,7 @@ class ManipPlanner():
                         }
                     )
                     for image in multi_step_images:
-                        if type(image) == str:
-                            image_path = image 
-                        else:
-                            image_path = './evaluation/tmp_{}.png'.format(len(messages)//2)
-                            cv2.imwrite(image_path, image)
-                        data_url = local_image_to_data_url(image_path=image_path)
+                        data_url = image_to_data_url(image)
                         current_message[0]["content"].append(
                             {
                                 "type": "image_url",
@@ -146,12 +144,7 @@ class ManipPlanner():
 
                     # add the current step image
                     current_step_image = images[-1]
-                    if type(current_step_image) == str:
-                        image_path = current_step_image 
-                    else:
-                        image_path = './evaluation/tmp_{}.png'.format(len(messages)//2)
-                        cv2.imwrite(image_path, current_step_image)
-                    data_url = local_image_to_data_url(image_path=image_path)
+                    data_url = image_to_data_url(current_step_image)
                     current_message[0]["content"].append(
                         {
                             "type": "image_url",
@@ -171,13 +164,7 @@ class ManipPlanner():
                     ]
 
                     for image in images:
-                        if type(image) == str:
-                            image_path = image 
-                        else:
-                            image_path = './evaluation/tmp_{}.png'.format(len(messages)//2)
-                            cv2.imwrite(image_path, image)
-
-                        data_url = local_image_to_data_url(image_path=image_path)
+                        data_url = image_to_data_url(image)
                         current_message[0]["content"].append(
                             {
                                 "type": "image_url",
@@ -198,13 +185,7 @@ class ManipPlanner():
                 ]
 
                 for image in images:
-                    if type(image) == str:
-                        image_path = image 
-                    else:
-                        image_path = './evaluation/tmp_{}.png'.format(len(messages)//2)
-                        cv2.imwrite(image_path, image)
-
-                    data_url = local_image_to_data_url(image_path=image_path)
+                    data_url = image_to_data_url(image)
                     current_message[0]["content"].append(
                         {
                             "type": "image_url",
@@ -260,13 +241,7 @@ class ManipPlanner():
         )
 
         for image in images:
-            if type(image) == str:
-                image_path = image 
-            else:
-                image_path = './evaluation/tmp_{}.png'.format(len(messages)//2)
-                cv2.imwrite(image_path, image)
-
-            data_url = local_image_to_data_url(image_path=image_path)
+            data_url = image_to_data_url(image)
             current_message[0]["content"].append(
                 {
                     "type": "image_url",
@@ -279,7 +254,7 @@ class ManipPlanner():
     
     def json_to_action(self, output_text):
         try:
-            json_object = json.loads(output_text)
+            json_object = load_plan_json(output_text)
             action = []
             try:
                 executable_plan = json_object['executable_plan'] if 'executable_plan' in json_object else json_object["properties"]["executable_plan"]
@@ -353,13 +328,11 @@ class ManipPlanner():
         self.episode_act_feedback = []
         self.planner_steps = 0
         self.output_json_error = 0
+        self.token_usage.reset()
 
     def act_custom(self, prompt, obs):
         assert type(obs) == str # input image path
         out = self.model.respond(prompt, obs)
-        out = out.replace("'",'"')
-        out = out.replace('\"s ', "\'s ")
-        out = out.replace('```json', '').replace('```', '')
         logger.debug(f"Model Output:\n{out}\n")
         action, _ = self.json_to_action(out)
         self.planner_steps += 1
@@ -405,21 +378,9 @@ class ManipPlanner():
                     text_content = content_item["text"]
                     logger.debug(f"Model Input:\n{text_content}\n")
 
-        if 'gemini-1.5-pro' in self.model_name or 'gemini-2.0-flash' in self.model_name:
-            try: 
-                out = self.model.respond(self.episode_messages)
-            except:
-                time.sleep(60)
-                out = self.model.respond(self.episode_messages)
-        else:
-            try: 
-                out = self.model.respond(self.episode_messages)
-            except:
-                if self.model_type != 'local':
-                    time.sleep(60)
-                else:
-                    time.sleep(20)
-                out = self.model.respond(self.episode_messages)
+        # rate limiting and retries are handled by the model
+        with self.token_usage.step():
+            out = self.model.respond(self.episode_messages)
 
         if self.chat_history:
             self.episode_messages.append(
@@ -2,16 +2,17 @@
 import re
 import os
 import numpy as np
-import cv2
 import json
 # import lmdeploy
 # from lmdeploy import pipeline, GenerationConfig, PytorchEngineConfig
-from openai import OpenAI
 from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
 from embodiedbench.planner.planner_utils import local_image_to_data_url, truncate_message_prompts
+from embodiedbench.planner.plan_parser import load_plan_json
 # from embodiedbench.planner.eb_navigation.RemoteModel_claude import RemoteModel
 from embodiedbench.planner.remote_model import RemoteModel
+from embodiedbench.planner.response_cache import CacheMissError
 from embodiedbench.planner.custom_model import CustomModel
+from embodiedbench.planner.token_usage import TokenUsage
 from embodiedbench.evaluator.config.visual_icl_examples.eb_navigation.ebnav_visual_icl import create_example_json_list
 from embodiedbench.planner.planner_utils import template, template_lang
 from embodiedbench.main import logger
@@ -22,7 +23,7 @@ template_lang = template_lang
 MESSAGE_WINDOW_LEN = 5
 
 class EBNavigationPlanner():
-    def __init__(self, model_name = '', model_type = 'remote', actions = [], system_prompt = '', examples = '', n_shot=1, obs_key='head_rgb', chat_history=False, language_only=False, multiview = False, multistep = False, visual_icl = False, tp=1, truncate=False, temperature=0.0, kwargs={}):
+    def __init__(self, model_name = '', model_type = 'remote', actions = [], system_prompt = '', examples = '', n_shot=1, obs_key='head_rgb', chat_history=False, language_only=False, multiview = False, multistep = False, visual_icl = False, tp=1, truncate=False, temperature=0.0, response_cache=None, rate_limiter=None, stream=False, kwargs={}):
         self.model_name = model_name
         self.model_type = model_type
         self.obs_key = obs_key
@@ -33,6 +34,7 @@ class EBNavigationPlanner():
         self.set_actions(actions)
         self.planner_steps = 0
         self.output_json_error = 0
+        self.token_usage = TokenUsage()
 
         self.kwargs = kwargs
         self.action_key = kwargs.pop('action_key', 'action_id')
@@ -73,7 +75,8 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
         if model_type == 'custom':
             self.model = CustomModel(model_name, language_only)
         else:
-            self.model = RemoteModel(model_name, model_type, language_only, tp=tp, temperature=temperature)
+            self.model = RemoteModel(model_name, model_type, language_only, tp=tp, temperature=temperature,
+                                     response_cache=response_cache, rate_limiter=rate_limiter, stream=stream)
 
     
     def set_actions(self, actions):
@@ -221,6 +224,7 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
         self.episode_act_feedback = []
         self.planner_steps = 0
         self.output_json_error = 0
+        self.token_usage.reset()
 
     def language_to_action(self, output_text):
         pattern = r'\*\*\d+\*\*'
@@ -235,7 +239,7 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
     def json_to_action(self, output_text, json_key='executable_plan'):
         valid = True
         try:
-            json_object = json.loads(output_text)
+            json_object = load_plan_json(output_text)
             action = [x[self.action_key] for x in json_object[json_key]]
             if not len(action):
                 print('empty plan, using random action instead')
@@ -258,9 +262,6 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
     def act_custom(self, prompt, obs):
         assert type(obs) == str # input image path
         out = self.model.respond(prompt, obs)
-        out = out.replace("'",'"')
-        out = out.replace('\"s ', "\'s ")
-        out = out.replace('```json', '').replace('```', '')
         logger.debug(f"Model Output:\n{out}\n")
         self.planner_steps += 1
         action, valid = self.json_to_action(out)
@@ -302,12 +303,16 @@ You are supposed to output in JSON.{template_lang if self.language_only else tem
                     logger.debug(f"Model Input:\n{text_content}\n")
 
         try:
-            out = self.model.respond(messages_to_send)
+            with self.token_usage.step():
+                out = self.model.respond(messages_to_send)
         except Exception as e:
+            if isinstance(e, CacheMissError):
+                raise
             print(e)
             if 'qwen' in self.model_name:
                 return -2,'''{"visual_state_description":"qwen model generate empty action due to inappropriate content check", "reasoning_and_reflection":"invalid json, random action",
                    "language_plan":"invalid json, random action"}'''
+            raise
 
         if self.chat_history:
             self.episode_messages.append(
@@ -0,0 +1,295 @@
+import re
+import json
+
+PLAN_KEY = "executable_plan"
+
+
+class PlanStreamParser():
+    """
+    Incremental JSON scanner for streamed planner outputs. Fed the text chunks as they arrive,
+    it tracks strings, nesting and the keys of the top-level object, and reports when the first
+    action of `executable_plan` is complete and when the top-level object that holds the plan
+    is closed, after which the rest of the generation can be cancelled. Text before the object
+    (e.g. a ```json fence) is skipped; a closed object without the plan key is ignored.
+    """
+    def __init__(self, plan_key=PLAN_KEY):
+        self.plan_key = plan_key
+        self.text = ""
+        self.first_action_done = False
+        self.done = False
+        self.end = None
+        self._reset_object()
+
+    def _reset_object(self):
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.last_string = None  # last string closed at depth 1, a key if a colon follows
+        self.current_key = None
+        self.has_plan = False
+        self.plan_depth = None  # depth inside the executable_plan array
+
+    def feed(self, chunk):
+        """Scan a new chunk, returns True once the object holding the plan is complete."""
+        if self.done:
+            return True
+        offset = len(self.text)
+        self.text += chunk
+        for i in range(offset, len(self.text)):
+            char = self.text[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                    if self.depth == 1:
+                        self.last_string = self.text[self.string_start:i]
+                continue
+            if self.depth == 0:
+                if char == "{":
+                    self.depth = 1
+                continue
+            if char == '"':
+                self.in_string = True
+                self.string_start = i + 1
+            elif char == ":" and self.depth == 1:
+                self.current_key = self.last_string
+                if self.current_key == self.plan_key:
+                    self.has_plan = True
+            elif char in "{[":
+                self.depth += 1
+                if char == "[" and self.depth == 2 and self.current_key == self.plan_key:
+                    self.plan_depth = self.depth
+            elif char in "}]":
+                self.depth -= 1
+                if self.depth == 0:
+                    if self.has_plan:
+                        self.first_action_done = True
+                        self.done = True
+                        self.end = i + 1
+                        return True
+                    self._reset_object()
+                elif char == "}" and self.depth == self.plan_depth:
+                    self.first_action_done = True
+                elif char == "]" and self.depth == 1 and self.plan_depth is not None:
+                    # the plan array is closed, an empty plan is complete as well
+                    self.plan_depth = None
+                    self.first_action_done = True
+            elif char == "," and self.depth == 1:
+                self.last_string = None
+        return False
+
+    @property
+    def output(self):
+        """The streamed text up to the end of the plan object."""
+        return self.text[: self.end] if self.done else self.text
+
+
+ESCAPES = {'"': '"', "'": "'", '\\': '\\', '/': '/', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t'}
+LITERALS = {'true': True, 'false': False, 'null': None, 'True': True, 'False': False, 'None': None}
+NUMBER = re.compile(r'-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?')
+BARE_WORD = re.compile(r'[^\s,:\]\}]+')
+# string content up to the next quote or backslash
+STRING_CHUNK = {'"': re.compile(r'[^"\\]*'), "'": re.compile(r"[^'\\]*")}
+WHITESPACE = re.compile(r'\s*')
+
+
+class TolerantJsonParser():
+    """
+    Single-pass parser for the JSON objects written by the planners' models, accepting what
+    json.loads rejects: text or code fences around the object, single-quoted strings,
+    contractions and unescaped quotes inside strings, trailing commas, Python literals and
+    output cut off mid-object. A quote only closes a string when the next token fits the JSON
+    structure (a delimiter, the next key or value, or a comma followed by one); otherwise it is
+    kept as text. Unclosed strings, arrays and objects end at the end of the text, but values
+    cut off by it are dropped: array elements, and numbers and other bare literals, whose
+    closing token is missing may be incomplete (e.g. an action id of 1 cut from 12). If this
+    recovery leaves the plan array empty although the model wrote actions in it, `plan_lost` is
+    set, so that the output is handled as invalid rather than as an empty plan.
+    """
+    def __init__(self, text, plan_key=PLAN_KEY):
+        self.text = text
+        self.plan_key = plan_key
+        self.pos = 0
+        # set when a value ends at the end of the text without its closing token
+        self.truncated = False
+        self.plan_lost = False
+        self.plan_start = None
+
+    def parse(self):
+        """The first JSON object in the text, or None if there is none."""
+        start = self.text.find('{')
+        if start < 0:
+            return None
+        self.pos = start
+        self.truncated = False
+        self.plan_lost = False
+        return self.parse_object()
+
+    def skip_whitespace(self):
+        self.pos = WHITESPACE.match(self.text, self.pos).end()
+
+    def at_end(self):
+        return self.pos >= len(self.text)
+
+    def cut_off(self):
+        """at_end, and marks the value being parsed as truncated."""
+        if self.at_end():
+            self.truncated = True
+            return True
+        return False
+
+    def parse_value(self):
+        self.skip_whitespace()
+        char = self.text[self.pos]
+        if char == '{':
+            return self.parse_object()
+        if char == '[':
+            return self.parse_array()
+        if char in '"\'':
+            return self.parse_string()
+        return self.parse_literal()
+
+    def parse_object(self):
+        self.pos += 1
+        result = {}
+        while True:
+            self.skip_whitespace()
+            if self.cut_off():
+                return result
+            char = self.text[self.pos]
+            if char == '}':
+                self.pos += 1
+                return result
+            if char in ',]':
+                # trailing or repeated comma, or a bracket closing nothing
+                self.pos += 1
+                continue
+            key = self.parse_string() if char in '"\'' else self.parse_literal()
+            self.skip_whitespace()
+            if self.cut_off():
+                return result
+            if self.text[self.pos] != ':':
+                # a key without value
+                continue
+            self.pos += 1
+            self.skip_whitespace()
+            if self.cut_off():
+                return result
+            is_literal = self.text[self.pos] not in '{["\''
+            start = self.pos
+            value = self.parse_value()
+            if str(key) == self.plan_key and value == [] and (self.truncated or self.text[start:self.pos].strip('[] \t\r\n')):
+                # cut off before its first complete action, or its actions could not be recovered
+                self.plan_lost = True
+                self.plan_start = start
+            if self.truncated and is_literal:
+                # a cut off number or literal may be incomplete, cut off strings and containers are kept
+                return result
+            result[str(key)] = value
+
+    def parse_array(self):
+        self.pos += 1
+        result = []
+        while True:
+            self.skip_whitespace()
+            if self.cut_off():
+                return result
+            char = self.text[self.pos]
+            if char == ']':
+                self.pos += 1
+                return result
+            if char == '}':
+                # the array was not closed, let the object close
+                return result
+            if char == ',':
+                self.pos += 1
+                continue
+            value = self.parse_value()
+            if self.truncated:
+                # the last element was cut off, e.g. an action without its closing brace
+                return result
+            result.append(value)
+
+    def closes_string(self, index):
+        """Whether the quote at index ends the string, judged by the token after it."""
+        start = index + 1
+        index = WHITESPACE.match(self.text, start).end()
+        if index >= len(self.text) or self.text[index] in ':}]':
+            return True
+        if self.text[index] in '"\'':
+            # the next key or value, the comma is missing
+            return True
+        if self.text[index] != ',':
+            return False
+        index = WHITESPACE.match(self.text, index + 1).end()
+        if index >= len(self.text) or self.text[index] in '"\'{[]}-' or self.text[index].isdigit():
+            return True
+        return any(self.text.startswith(literal, index) for literal in LITERALS)
+
+    def parse_string(self):
+        quote = self.text[self.pos]
+        self.pos += 1
+        parts = []
+        chunk = STRING_CHUNK[quote]
+        while True:
+            end = chunk.match(self.text, self.pos).end()
+            parts.append(self.text[self.pos:end])
+            self.pos = end
+            if self.cut_off():
+                return ''.join(parts)
+            if self.text[end] == '\\':
+                escaped = self.text[end + 1:end + 2]
+                if escaped == 'u' and re.fullmatch(r'[0-9a-fA-F]{4}', self.text[end + 2:end + 6]):
+                    parts.append(chr(int(self.text[end + 2:end + 6], 16)))
+                    self.pos = end + 6
+                else:
+                    parts.append(ESCAPES.get(escaped, escaped))
+                    self.pos = end + 2
+                continue
+            self.pos = end + 1
+            if self.closes_string(end):
+                return ''.join(parts)
+            parts.append(quote)
+
+    def parse_literal(self):
+        match = NUMBER.match(self.text, self.pos)
+        word = BARE_WORD.match(self.text, self.pos)
+        if match and (not word or match.end() == word.end()):
+            self.pos = match.end()
+            self.cut_off()
+            number = match.group()
+            return float(number) if any(c in number for c in '.eE') else int(number)
+        if not word:
+            # a stray delimiter
+            self.pos += 1
+            return None
+        self.pos = word.end()
+        self.cut_off()
+        return LITERALS.get(word.group(), word.group())
+
+
+def parse_json(text):
+    """The first JSON object in a model output, parsed tolerantly, or None if there is none."""
+    return TolerantJsonParser(text).parse()
+
+
+def load_plan_json(text):
+    """
+    json.loads for planner outputs. Valid JSON is decoded directly, anything else with the
+    tolerant parser; raises json.JSONDecodeError if the output holds no object, or if its plan
+    was lost (see TolerantJsonParser), so that the planner replans instead of stopping.
+    """
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError as e:
+        parser = TolerantJsonParser(text)
+        json_object = parser.parse()
+        if json_object is None:
+            raise
+        if parser.plan_lost:
+            raise json.JSONDecodeError("No complete action in the plan", text, parser.plan_start) from e
+        return json_object
@@ -1,12 +1,10 @@
 import os
 import re
-import base64
 import copy
-from mimetypes import guess_type
-import google.generativeai as genai
-from openai import OpenAI, AzureOpenAI
 import typing_extensions as typing
 from pydantic import BaseModel, Field
+from embodiedbench.evaluator.latency import timed, latency_tracker
+from embodiedbench.planner.image_encoder import image_encoder
 
 template_lang = '''\
 The output json format should be {'reasoning_and_reflection':str, 'language_plan':str, 'executable_plan':List[{'action_id':int, 'action_name':str}...]}
@@ -129,12 +127,12 @@ def convert_format_2claude(messages):
     
             for item in message["content"]:
                 if item.get("type") == "image_url":
-                    base64_data = item["image_url"]["url"][22:]
+                    media_type, base64_data = split_data_url(item["image_url"]["url"])
                     new_item = {
                         "type": "image",
                         "source": {
                             "type": "base64",
-                            "media_type": "image/png",
+                            "media_type": media_type,
                             "data": base64_data
                         }
                     }
@@ -151,6 +149,22 @@ def convert_format_2claude(messages):
 
     return new_messages
 
+def add_cache_control(messages):
+    """
+    Mark the leading text block of the first user message, the static prompt prefix split off by
+    the planner, as an Anthropic prompt cache breakpoint.
+    """
+    new_messages = list(messages)
+    for i, message in enumerate(new_messages):
+        if message["role"] == "user":
+            content = message["content"]
+            if type(content) == list and len(content) > 1 and content[0].get("type") == "text":
+                new_message = message.copy()
+                new_message["content"] = [dict(content[0], cache_control={"type": "ephemeral"})] + content[1:]
+                new_messages[i] = new_message
+            break
+    return new_messages
+
 def convert_format_2gemini(messages):
     new_messages = []
     
@@ -160,7 +174,7 @@ def convert_format_2gemini(messages):
             new_content = []
             for item in message["content"]:
                 if item.get("type") == "image_url":
-                    base64_data = item["image_url"]["url"][22:]
+                    _, base64_data = split_data_url(item["image_url"]["url"])
                     new_item = {
                         "type": "image_url",
                         "image_url": {
@@ -211,18 +225,52 @@ class ActionPlan_lang_manip(BaseModel):
     executable_plan: str
 
 # Function to encode a local image into data URL 
+@timed('image_encode')
 def local_image_to_data_url(image_path):
-    # Guess the MIME type of the image based on the file extension
-    mime_type, _ = guess_type(image_path)
-    if mime_type is None:
-        mime_type = 'application/octet-stream'  # Default MIME type if none is found
+    # images are encoded once, frames saved by the environments are served from memory
+    return image_encoder.file_data_url(image_path)
+
+
+def image_to_data_url(image):
+    """Data URL of an image path, or of a numpy frame encoded in memory."""
+    if type(image) == str:
+        return local_image_to_data_url(image_path=image)
+    with latency_tracker.timer('image_encode'):
+        return image_encoder.data_url(image)
+
+
+def split_data_url(url):
+    """'data:image/png;base64,<data>' -> ('image/png', '<data>')"""
+    header, data = url.split(",", 1)
+    return header[len("data:"):].split(";")[0], data
+
+
+IMAGE_TOKEN_ESTIMATE = 765
+
+def estimate_tokens(message_history: list):
+    """Rough prompt size in tokens: 4 characters per text token and a fixed cost per image."""
+    num_tokens = 0
+    for message in message_history:
+        content = message["content"]
+        if type(content) == str:
+            num_tokens += len(content) // 4
+            continue
+        for item in content:
+            if item["type"] == "text":
+                num_tokens += len(item["text"]) // 4
+            else:
+                num_tokens += IMAGE_TOKEN_ESTIMATE
+    return num_tokens
 
-    # Read and encode the image file
-    with open(image_path, "rb") as image_file:
-        base64_encoded_data = base64.b64encode(image_file.read()).decode('utf-8')
 
-    # Construct the data URL
-    return f"data:{mime_type};base64,{base64_encoded_data}"
+def estimate_image_tokens(message_history: list):
+    """Estimated share of the images in the prompt size, with the same fixed cost per image."""
+    num_images = 0
+    for message in message_history:
+        content = message["content"]
+        if type(content) != str:
+            num_images += sum(item["type"] != "text" for item in content)
+    return num_images * IMAGE_TOKEN_ESTIMATE
 
 
 def truncate_message_prompts(message_history: list):
@@ -0,0 +1,173 @@
+import time
+import random
+import threading
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from embodiedbench.main import logger
+from embodiedbench.planner.token_usage import record_usage
+
+RETRY_BASE_DELAY = 2.0
+RETRY_MAX_DELAY = 60.0
+# request timeout, rate limited, and server errors from 500 on
+RETRYABLE_STATUS_CODES = {408, 429}
+
+
+class TokenBucket():
+    """Thread-safe token bucket refilled continuously at `rate_per_minute`, holding at most one minute of budget."""
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """Take `amount` tokens, sleeping until they are available. Returns the seconds waited."""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            # reserve the tokens now, callers queue up behind each other
+            self.tokens -= min(amount, self.capacity)
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+def backoff_delay(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+def get_retry_after(error):
+    """Seconds requested by the Retry-After header of a failed API call, or None."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get('retry-after-ms')
+    if retry_after_ms is not None:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get('retry-after')
+    if retry_after is None:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def is_retryable(error):
+    """
+    Whether a failed API call is worth retrying: rate limits, server errors, timeouts and
+    connection errors. Other errors (bad requests, authentication, ...) would fail again.
+    """
+    status = getattr(error, 'status_code', None)
+    if status is None:
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if type(status) == int:
+        return status in RETRYABLE_STATUS_CODES or status >= 500
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # APITimeoutError and APIConnectionError of the provider SDKs, httpx and requests errors
+    return any('Timeout' in cls.__name__ or 'Connection' in cls.__name__ for cls in type(error).__mro__)
+
+
+class RateLimiter():
+    """
+    Client-side rate limiting and retry policy of one model provider. Requests wait for the
+    requests-per-minute and tokens-per-minute buckets, and calls failing with a retryable error
+    are retried with exponential backoff and jitter, or after the delay given by a Retry-After
+    header; other errors are raised at once. At most max_concurrency requests are in flight at
+    once, across all the planners and threads of the process. All the time spent waiting is
+    accumulated in throttled_seconds, and attributed to the planner step of the calling thread
+    (see token_usage).
+    """
+    def __init__(self, rpm=None, tpm=None, max_retries=5, max_concurrency=None):
+        self.request_bucket = TokenBucket(rpm) if rpm else None
+        self.token_bucket = TokenBucket(tpm) if tpm else None
+        self.max_retries = max_retries
+        self.slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.throttled_seconds = 0.0
+        self.lock = threading.Lock()
+
+    def add_throttled(self, seconds):
+        with self.lock:
+            self.throttled_seconds += seconds
+        record_usage(throttled_seconds=seconds)
+
+    def wait(self, num_tokens=0):
+        waited = 0.0
+        if self.request_bucket is not None:
+            waited += self.request_bucket.acquire(1)
+        if self.token_bucket is not None and num_tokens > 0:
+            waited += self.token_bucket.acquire(num_tokens)
+        if waited > 0:
+            self.add_throttled(waited)
+
+    @contextmanager
+    def slot(self):
+        if self.slots is None:
+            yield
+            return
+        start = time.monotonic()
+        self.slots.acquire()
+        self.add_throttled(time.monotonic() - start)
+        try:
+            yield
+        finally:
+            self.slots.release()
+
+    def call(self, func, num_tokens=0):
+        attempt = 0
+        while True:
+            self.wait(num_tokens)
+            try:
+                with self.slot():
+                    return func()
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                delay = get_retry_after(e)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                logger.warning(f"Model request failed ({e}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                self.add_throttled(delay)
+                attempt += 1
+
+
+def get_provider(model_name, model_type='remote'):
+    """Name of the API a model is served by, following the dispatch in RemoteModel."""
+    if model_type != 'remote':
+        return model_type
+    for provider in ['claude', 'gemini', 'gpt', 'qwen']:
+        if provider in model_name:
+            return provider
+    return model_name
+
+
+# one limiter per provider, shared by all the models of the process
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def build_rate_limiter(config):
+    """The rate limiter of the provider of config['model_name'], configured from the eval config."""
+    provider = get_provider(config['model_name'], config.get('model_type', 'remote'))
+    # worker threads build their planners concurrently
+    with _rate_limiters_lock:
+        if provider not in _rate_limiters:
+            _rate_limiters[provider] = RateLimiter(rpm=config.get('rate_limit_rpm', None),
+                                                   tpm=config.get('rate_limit_tpm', None),
+                                                   max_retries=config.get('max_retries', 5),
+                                                   max_concurrency=config.get('max_concurrency', None))
+        return _rate_limiters[provider]
@@ -1,20 +1,12 @@
 import json
 import sys
+import time
 import os
 import base64
-import anthropic
-import google.generativeai as genai
-from openai import OpenAI, AzureOpenAI
-from azure.identity import (
-    DefaultAzureCredential,
-    ChainedTokenCredential,
-    AzureCliCredential,
-    ManagedIdentityCredential,
-    get_bearer_token_provider,
-)
-import typing_extensions as typing
-import lmdeploy
-from lmdeploy import pipeline, GenerationConfig, PytorchEngineConfig
+import asyncio
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
 from embodiedbench.planner.planner_config.generation_guide_manip import (
     llm_generation_guide_manip,
@@ -22,6 +14,7 @@ from embodiedbench.planner.planner_config.generation_guide_manip import (
 )
 from embodiedbench.planner.planner_utils import (
     convert_format_2claude,
+    add_cache_control,
     convert_format_2gemini,
     ActionPlan_1,
     ActionPlan,
@@ -29,13 +22,166 @@ from embodiedbench.planner.planner_utils import (
     ActionPlan_1_manip,
     ActionPlan_manip,
     ActionPlan_lang_manip,
-    fix_json,
+    estimate_tokens,
+    estimate_image_tokens,
 )
+from embodiedbench.planner.rate_limiter import RateLimiter, get_provider
+from embodiedbench.planner.token_usage import record_usage, bind_counter, counting
+from embodiedbench.planner.plan_parser import PlanStreamParser
+from embodiedbench.evaluator.latency import timed, latency_tracker
 
 max_completion_tokens = 2048
 remote_url = os.environ.get("remote_url")
 
 
+# The provider SDKs are imported by the loaders below, so a run only imports the SDK of the
+# model it evaluates.
+def _load_local(model_name, tp):
+    from lmdeploy import pipeline, PytorchEngineConfig
+
+    backend_config = PytorchEngineConfig(session_len=12000, dtype="float16", tp=tp)
+    return pipeline(model_name, backend_config=backend_config)
+
+
+def _load_azure_openai(model_name, tp):
+    # Azure OpenAI setup with proper authentication
+    from openai import AzureOpenAI
+    from azure.identity import ChainedTokenCredential, AzureCliCredential, ManagedIdentityCredential, get_bearer_token_provider
+
+    scope = "api://trapi/.default"
+    token_provider = get_bearer_token_provider(
+        ChainedTokenCredential(
+            AzureCliCredential(),
+            ManagedIdentityCredential(),
+        ),
+        scope,
+    )
+
+    api_version = "2024-12-01-preview"
+    instance = "gcr/shared"
+    endpoint = f"https://trapi.research.microsoft.com/{instance}"
+
+    return AzureOpenAI(
+        azure_endpoint=endpoint,
+        azure_ad_token_provider=token_provider,
+        api_version=api_version,
+    )
+
+
+def _load_claude(model_name, tp):
+    import anthropic
+
+    return anthropic.Anthropic(
+        api_key=os.environ.get("ANTHROPIC_API_KEY"),
+    )
+
+
+def _load_gemini(model_name, tp):
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=os.environ.get("GEMINI_API_KEY"),
+        base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+    )
+
+
+def _load_gpt(model_name, tp):
+    from openai import OpenAI
+
+    return OpenAI()
+
+
+def _load_qwen(model_name, tp):
+    from openai import OpenAI
+
+    return OpenAI(
+        api_key=os.getenv("DASHSCOPE_API_KEY"),
+        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+    )
+
+
+def _load_fireworks(model_name, tp):  # you can use fireworks to inference
+    from openai import OpenAI
+
+    return OpenAI(base_url="https://api.fireworks.ai/inference/v1", api_key=os.environ.get("firework_API_KEY"))
+
+
+def _load_remote_server(model_name, tp):
+    # Qwen2-VL, Qwen2.5-VL, Llama-3.2-Vision and InternVL served at remote_url
+    from openai import OpenAI
+
+    return OpenAI(base_url=remote_url)
+
+
+# client loader of each provider, keyed like get_provider
+CLIENT_LOADERS = {
+    "local": _load_local,
+    "azure_openai": _load_azure_openai,
+    "claude": _load_claude,
+    "gemini": _load_gemini,
+    "gpt": _load_gpt,
+    "qwen": _load_qwen,
+}
+
+
+def _create_client(model_name, provider, tp):
+    if provider in CLIENT_LOADERS:
+        return CLIENT_LOADERS[provider](model_name, tp)
+    if "90b-vision-instruct" in model_name:
+        return _load_fireworks(model_name, tp)
+    try:
+        return _load_remote_server(model_name, tp)
+    except Exception:
+        raise ValueError(f"Unsupported model name: {model_name}")
+
+
+# one client per provider (per model for local pipelines), shared by all the models of the
+# process, so their requests reuse the keep-alive connections of one HTTP pool
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def load_client(model_name, model_type="remote", tp=1):
+    provider = get_provider(model_name, model_type)
+    key = (provider, model_name, tp) if provider == "local" else provider
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = _create_client(model_name, provider, tp)
+        return _clients[key]
+
+
+class RequestCancelled(Exception):
+    """Raised by a candidate request that is no longer needed, see respond_candidates."""
+
+
+# cancel event of the candidate request run by this thread
+_candidate = threading.local()
+
+
+def cancel_event():
+    return getattr(_candidate, "cancel", None)
+
+
+def check_cancelled():
+    cancel = cancel_event()
+    if cancel is not None and cancel.is_set():
+        raise RequestCancelled()
+
+
+# worker threads running the blocking SDK calls of respond_async; the number of requests in
+# flight is bounded by the max_concurrency of each provider's rate limiter
+MAX_ASYNC_WORKERS = 32
+_async_executor = None
+
+
+def get_async_executor():
+    global _async_executor
+    with _clients_lock:
+        if _async_executor is None:
+            _async_executor = ThreadPoolExecutor(max_workers=MAX_ASYNC_WORKERS, thread_name_prefix="remote_model")
+        return _async_executor
+
+
 class RemoteModel:
     def __init__(
         self,
@@ -45,89 +191,259 @@ class RemoteModel:
         tp=1,
         task_type=None,  # used to distinguish between manipulation and other environments
         temperature=0.0,
+        response_cache=None,
+        rate_limiter=None,
+        prompt_caching=False,
+        stream=False,
     ):
         self.model_name = model_name
         self.model_type = model_type
         self.language_only = language_only
         self.task_type = task_type
         self.temperature = temperature
+        self.response_cache = response_cache
+        self.last_response_cached = False
+        # mark the static prompt prefix for provider-side caching (Anthropic cache_control)
+        self.prompt_caching = prompt_caching
+        # prompt and completion tokens reported by the provider, how many prompt tokens were read
+        # from its prompt cache, and the estimated image tokens of the prompts (see token_usage)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.image_tokens = 0
+        self.usage_lock = threading.Lock()
+        # stream the completions and cancel them once the JSON object with the plan is closed
+        self.stream = stream
+        # without a configured limiter, failed requests are still retried with backoff
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+
+        if self.response_cache is not None and self.response_cache.replay:
+            # replay answers every request from the cache, no client is needed
+            self.model = None
+            return
+
+        self.model = load_client(self.model_name, self.model_type, tp)
+
+    def generation_params(self):
+        return {
+            "model_type": self.model_type,
+            "task_type": self.task_type,
+            "language_only": self.language_only,
+            "temperature": self.temperature,
+            "max_completion_tokens": max_completion_tokens,
+        }
 
-        if self.model_type == "local":
-            backend_config = PytorchEngineConfig(session_len=12000, dtype="float16", tp=tp)
-            self.model = pipeline(self.model_name, backend_config=backend_config)
-        elif self.model_type == "azure_openai":
-            # Azure OpenAI setup with proper authentication
-            scope = "api://trapi/.default"
-
-            azure_credential = ChainedTokenCredential(
-                AzureCliCredential(),
-                DefaultAzureCredential(
-                    exclude_cli_credential=True,
-                    exclude_environment_credential=True,
-                    exclude_shared_token_cache_credential=True,
-                    exclude_developer_cli_credential=True,
-                    exclude_powershell_credential=True,
-                    exclude_interactive_browser_credential=True,
-                    exclude_visual_studio_code_credentials=True,
-                    managed_identity_client_id=os.environ.get("DEFAULT_IDENTITY_CLIENT_ID"),
-                ),
-            )
+    def _add_usage(self, counter=None, prompt_tokens=0, completion_tokens=0, cached_prompt_tokens=0, image_tokens=0):
+        # candidate requests finish in several threads
+        with self.usage_lock:
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            self.cached_prompt_tokens += cached_prompt_tokens
+            self.image_tokens += image_tokens
+        # the planner step of the request, by default the one of the calling thread
+        counts = dict(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                      cached_prompt_tokens=cached_prompt_tokens, image_tokens=image_tokens)
+        if counter is not None:
+            counter.add(**counts)
+        else:
+            record_usage(**counts)
+
+    def _record_usage(self, response):
+        """Add the usage reported with a response, returns False if it has none."""
+        usage = getattr(response, "usage", None)
+        if usage is None:
+            return False
+        if hasattr(usage, "cache_read_input_tokens"):
+            # Anthropic counts cache reads and writes apart from input_tokens
+            cached = usage.cache_read_input_tokens or 0
+            prompt = (usage.input_tokens or 0) + cached + (getattr(usage, "cache_creation_input_tokens", 0) or 0)
+            completion = getattr(usage, "output_tokens", 0) or 0
+        else:
+            details = getattr(usage, "prompt_tokens_details", None)
+            cached = getattr(details, "cached_tokens", 0) or 0
+            prompt = getattr(usage, "prompt_tokens", 0) or 0
+            completion = getattr(usage, "completion_tokens", 0) or 0
+        self._add_usage(prompt_tokens=prompt, completion_tokens=completion, cached_prompt_tokens=cached)
+        return True
+
+    def _estimate_usage(self, message_history, output):
+        # a stream cancelled after the plan ends before the provider sends the usage
+        self._add_usage(prompt_tokens=estimate_tokens(message_history), completion_tokens=len(output) // 4)
+
+    def _chat_completion(self, **kwargs):
+        """
+        Text of an OpenAI-compatible chat completion, streamed and cut after the plan when streaming
+        is on. Candidate requests are streamed as well, so that they can be closed once cancelled.
+        """
+        cancel = cancel_event()
+        if not self.stream and cancel is None:
+            response = self.model.chat.completions.create(**kwargs)
+            self._record_usage(response)
+            return response.choices[0].message.content
 
-            token_provider = get_bearer_token_provider(
-                ChainedTokenCredential(
-                    AzureCliCredential(),
-                    ManagedIdentityCredential(),
-                ),
-                scope,
-            )
+        start = time.perf_counter()
+        parser = PlanStreamParser()
+        usage_recorded = False
+        stream = self.model.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+        try:
+            for chunk in stream:
+                if cancel is not None and cancel.is_set():
+                    break
+                if getattr(chunk, "usage", None) is not None:
+                    usage_recorded = self._record_usage(chunk)
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                self._feed_stream(parser, chunk.choices[0].delta.content, start)
+                if self.stream and parser.done:
+                    break
+        finally:
+            stream.close()
+        if not usage_recorded:
+            self._estimate_usage(kwargs["messages"], parser.text)
+        check_cancelled()
+        return parser.output
+
+    def _feed_stream(self, parser, text, start):
+        first_action_done = parser.first_action_done
+        parser.feed(text)
+        if parser.first_action_done and not first_action_done:
+            # time until the first action of the plan could be executed
+            latency_tracker.record("first_action", time.perf_counter() - start)
+
+    @timed('inference')
+    def respond(self, message_history: list):
+        return self._cached_respond(message_history)
 
-            api_version = "2024-12-01-preview"
-            instance = "gcr/shared"
-            endpoint = f"https://trapi.research.microsoft.com/{instance}"
+    async def respond_async(self, message_history: list):
+        """
+        Coroutine version of respond, so that one event loop can keep the requests of many
+        planners in flight. The SDK call runs in the shared worker threads, on the pooled
+        client of the provider and within its max_concurrency.
+        """
+        loop = asyncio.get_running_loop()
+        with latency_tracker.timer('inference'):
+            return await loop.run_in_executor(get_async_executor(), bind_counter(self._cached_respond), message_history)
+
+    def _cached_respond(self, message_history: list):
+        if self.response_cache is None:
+            return self._limited_respond(message_history)
+        key = self.response_cache.make_key(self.model_name, self.generation_params(), message_history)
+        out = self.response_cache.get(key)
+        self.last_response_cached = out is not None
+        if out is None:
+            out = self._limited_respond(message_history)
+            self.response_cache.put(key, out)
+        return out
 
-            self.model = AzureOpenAI(
-                azure_endpoint=endpoint,
-                azure_ad_token_provider=credential,
-                api_version=api_version,
+    @timed('inference')
+    def respond_candidates(self, message_history: list, num_candidates: int, accept):
+        """
+        Sample num_candidates completions of the same conversation concurrently and return the
+        first one accepted by accept(out), without waiting for the others. If none is accepted,
+        the first completion is returned. A local model samples them as one batch. The other
+        candidates are cancelled: queued ones are not sent and streamed ones are closed, which
+        frees their concurrency slots; a call that cannot be streamed (Gemini) runs to its end.
+        """
+        key = None
+        if self.response_cache is not None:
+            key = self.response_cache.make_key(self.model_name, self.generation_params(), message_history)
+            out = self.response_cache.get(key)
+            self.last_response_cached = out is not None
+            if out is not None:
+                return out
+        if self.model_type == "local":
+            num_tokens = num_candidates * (estimate_tokens(message_history) + max_completion_tokens)
+            outs = self.rate_limiter.call(
+                lambda: self._call_local_batch([message_history] * num_candidates), num_tokens=num_tokens
             )
+            out = next((out for out in outs if accept(out)), outs[0])
         else:
-            if "claude" in self.model_name:
-                self.model = anthropic.Anthropic(
-                    api_key=os.environ.get("ANTHROPIC_API_KEY"),
-                )
-            elif "gemini" in self.model_name:
-                self.model = OpenAI(
-                    api_key=os.environ.get("GEMINI_API_KEY"),
-                    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
-                )
-            elif "gpt" in self.model_name:
-                self.model = OpenAI()
-            elif "qwen" in self.model_name:
-                self.model = OpenAI(
-                    api_key=os.getenv("DASHSCOPE_API_KEY"),
-                    base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
-                )
-            elif "Qwen2-VL" in self.model_name:
-                self.model = OpenAI(base_url=remote_url)
-            elif "Qwen2.5-VL" in self.model_name:
-                self.model = OpenAI(base_url=remote_url)
-            elif "Llama-3.2-11B-Vision-Instruct" in self.model_name:
-                self.model = OpenAI(base_url=remote_url)
-            elif "OpenGVLab/InternVL" in self.model_name:
-                self.model = OpenAI(base_url=remote_url)
-            elif "meta-llama/Llama-3.2-90B-Vision-Instruct" in self.model_name:
-                self.model = OpenAI(base_url=remote_url)
-            elif "90b-vision-instruct" in self.model_name:  # you can use fireworks to inference
-                self.model = OpenAI(
-                    base_url="https://api.fireworks.ai/inference/v1", api_key=os.environ.get("firework_API_KEY")
-                )
-            else:
+            executor = ThreadPoolExecutor(max_workers=num_candidates)
+            # the candidates are counted in the planner step of the caller
+            respond = bind_counter(self._limited_respond)
+            cancel = threading.Event()
+
+            def run_candidate():
+                _candidate.cancel = cancel
                 try:
-                    self.model = OpenAI(base_url=remote_url)
-                except:
-                    raise ValueError(f"Unsupported model name: {model_name}")
+                    return respond(message_history)
+                finally:
+                    _candidate.cancel = None
+            futures = [executor.submit(run_candidate) for _ in range(num_candidates)]
+            out = None
+            errors = []
+            try:
+                for future in as_completed(futures):
+                    try:
+                        candidate = future.result()
+                    except Exception as e:
+                        errors.append(e)
+                        continue
+                    if out is None:
+                        out = candidate
+                    if accept(candidate):
+                        out = candidate
+                        break
+            finally:
+                # the remaining requests stop in the background
+                cancel.set()
+                executor.shutdown(wait=False, cancel_futures=True)
+            if out is None:
+                raise errors[0]
+        if key is not None:
+            self.response_cache.put(key, out)
+        return out
 
-    def respond(self, message_history: list):
+    def respond_batch(self, message_histories: list, counters=None):
+        """
+        Answer several conversations. A local model gets the ones missing from the response cache
+        as one batch, other models answer them one by one. The usage of each response is added to
+        its entry of counters (see token_usage) when given.
+        """
+        if counters is None:
+            counters = [None] * len(message_histories)
+        outs = [None] * len(message_histories)
+        keys = [None] * len(message_histories)
+        if self.response_cache is not None:
+            for i, message_history in enumerate(message_histories):
+                keys[i] = self.response_cache.make_key(self.model_name, self.generation_params(), message_history)
+                outs[i] = self.response_cache.get(keys[i])
+        missing = [i for i, out in enumerate(outs) if out is None]
+        if not len(missing):
+            return outs
+        if self.model_type == "local":
+            num_tokens = sum(estimate_tokens(message_histories[i]) + max_completion_tokens for i in missing)
+            missing_outs = self.rate_limiter.call(
+                lambda: self._call_local_batch([message_histories[i] for i in missing],
+                                               counters=[counters[i] for i in missing]),
+                num_tokens=num_tokens,
+            )
+        else:
+            missing_outs = []
+            for i in missing:
+                with counting(counters[i]) if counters[i] is not None else nullcontext():
+                    missing_outs.append(self._limited_respond(message_histories[i]))
+        for i, out in zip(missing, missing_outs):
+            outs[i] = out
+            if self.response_cache is not None:
+                self.response_cache.put(keys[i], out)
+        return outs
+
+    def _limited_respond(self, message_history: list):
+        num_tokens = estimate_tokens(message_history) + max_completion_tokens
+
+        def request():
+            # a cancelled candidate gives its slot back without sending the request
+            check_cancelled()
+            return self._respond(message_history)
+        check_cancelled()
+        out = self.rate_limiter.call(request, num_tokens=num_tokens)
+        if self.model_type != "local":
+            # local models count the images of their batches
+            self._add_usage(image_tokens=estimate_image_tokens(message_history))
+        return out
+
+    def _respond(self, message_history: list):
         if self.model_type == "local":
             return self._call_local(message_history)
         elif self.model_type == "azure_openai":
@@ -162,9 +478,13 @@ class RemoteModel:
             # elif "OpenGVLab/InternVL2_5-78B" in self.model_name:
             #     return self._call_intern38b(message_history)
             else:
-                raise ValueError(f"Unsupported model name: {self.model_name}")
+                # any other model served behind an OpenAI-compatible remote_url, e.g. server.py
+                return self._call_remote_server(message_history)
 
     def _call_local(self, message_history: list):
+        return self._call_local_batch([message_history])[0]
+
+    def _call_local_batch(self, message_histories: list, counters=None):
         if self.task_type == "manip":
             response_format = {
                 "type": "json_schema",
@@ -181,22 +501,37 @@ class RemoteModel:
                     "schema": llm_generation_guide if self.language_only else vlm_generation_guide,
                 },
             }
-        response = self.model(
-            message_history,
+        from lmdeploy import GenerationConfig
+
+        # the pipeline batches a list of conversations and answers in the same order
+        responses = self.model(
+            message_histories,
             gen_config=GenerationConfig(
                 temperature=self.temperature,
                 response_format=response_format,
                 max_new_tokens=max_completion_tokens,
             ),
         )
-        out = response.text
-        out = fix_json(out)
-        return out
+        if counters is None:
+            counters = [None] * len(message_histories)
+        for message_history, response, counter in zip(message_histories, responses, counters):
+            self._add_usage(
+                counter=counter,
+                prompt_tokens=getattr(response, "input_token_len", 0) or 0,
+                completion_tokens=getattr(response, "generate_token_len", 0) or 0,
+                image_tokens=estimate_image_tokens(message_history),
+            )
+        return [response.text for response in responses]
 
     def _call_claude(self, message_history: list):
 
         if not self.language_only:
             message_history = convert_format_2claude(message_history)
+        if self.prompt_caching:
+            message_history = add_cache_control(message_history)
+
+        if self.stream or cancel_event() is not None:
+            return self._stream_claude(message_history)
 
         response = self.model.messages.create(
             model=self.model_name,
@@ -205,8 +540,43 @@ class RemoteModel:
             messages=message_history,
         )
 
+        self._record_usage(response)
         return response.content[0].text
 
+    def _stream_claude(self, message_history: list):
+        cancel = cancel_event()
+        start = time.perf_counter()
+        parser = PlanStreamParser()
+        stream = self.model.messages.create(
+            model=self.model_name,
+            max_tokens=max_completion_tokens,
+            temperature=self.temperature,
+            messages=message_history,
+            stream=True,
+        )
+        completion_recorded = False
+        try:
+            for event in stream:
+                if cancel is not None and cancel.is_set():
+                    break
+                if event.type == "message_start":
+                    # the prompt usage comes with the first event
+                    self._record_usage(event.message)
+                elif event.type == "content_block_delta" and event.delta.type == "text_delta":
+                    self._feed_stream(parser, event.delta.text, start)
+                    if self.stream and parser.done:
+                        break
+                elif event.type == "message_delta" and getattr(event, "usage", None) is not None:
+                    # the final output token count
+                    self._add_usage(completion_tokens=event.usage.output_tokens or 0)
+                    completion_recorded = True
+        finally:
+            stream.close()
+        if not completion_recorded:
+            self._add_usage(completion_tokens=len(parser.text) // 4)
+        check_cancelled()
+        return parser.output
+
     def _call_gemini(self, message_history: list):
 
         if not self.language_only:
@@ -228,8 +598,7 @@ class RemoteModel:
                 temperature=self.temperature,
                 max_tokens=max_completion_tokens,
             )
-        tokens = response.usage.prompt_tokens
-
+        self._record_usage(response)
         return str(response.choices[0].message.parsed.model_dump_json())
 
     def _call_gpt(self, message_history: list):
@@ -253,14 +622,13 @@ class RemoteModel:
                     type="json_schema", json_schema=dict(name="embodied_planning", schema=llm_generation_guide)
                 )
 
-        response = self.model.chat.completions.create(
+        out = self._chat_completion(
             model=self.model_name,
             messages=message_history,
             response_format=response_format,
             temperature=self.temperature,
             max_tokens=max_completion_tokens,
         )
-        out = response.choices[0].message.content
 
         return out
 
@@ -298,14 +666,13 @@ class RemoteModel:
                 )
 
         try:
-            response = self.model.chat.completions.create(
+            return self._chat_completion(
                 model=deployment_name,
                 messages=message_history,
                 response_format=response_format,
                 temperature=temperature,
                 max_tokens=max_completion_tokens,
             )
-            return response.choices[0].message.content
         except Exception as e:
             print(f"--= !!! Invalid Azure OpenAI Request: {e} !!! =--", file=sys.stderr)
             raise
@@ -334,35 +701,31 @@ class RemoteModel:
                     type="json_schema", json_schema=dict(name="embodied_planning", schema=llm_generation_guide)
                 )
 
-        response = self.model.chat.completions.create(
+        out = self._chat_completion(
             model=self.model_name,
             messages=message_history,
             response_format=response_format,
             temperature=self.temperature,
             max_tokens=max_completion_tokens,
         )
-
-        out = response.choices[0].message.content
         return out
 
     def _call_llama90(self, message_history: list):
         if self.task_type == "manip":
-            response = self.model.chat.completions.create(
+            out = self._chat_completion(
                 model="accounts/fireworks/models/llama-v3p2-90b-vision-instruct",
                 messages=message_history,
                 response_format={"type": "json_object", "schema": ActionPlan_1_manip.model_json_schema()},
                 temperature=self.temperature,
             )
-            out = response.choices[0].message.content
 
         else:
-            response = self.model.chat.completions.create(
+            out = self._chat_completion(
                 model="accounts/fireworks/models/llama-v3p2-90b-vision-instruct",
                 messages=message_history,
                 response_format={"type": "json_object", "schema": ActionPlan_1.model_json_schema()},
                 temperature=self.temperature,
             )
-            out = response.choices[0].message.content
         return out
 
     def _call_llama11b(self, message_history):
@@ -389,14 +752,13 @@ class RemoteModel:
                     type="json_schema", json_schema=dict(name="embodied_planning", schema=llm_generation_guide)
                 )
 
-        response = self.model.chat.completions.create(
+        out = self._chat_completion(
             model=self.model_name,
             messages=message_history,
             response_format=response_format,
             temperature=self.temperature,
             max_tokens=max_completion_tokens,
         )
-        out = response.choices[0].message.content
         return out
 
     def _call_qwen72b(self, message_history):
@@ -422,17 +784,13 @@ class RemoteModel:
                     type="json_schema", json_schema=dict(name="embodied_planning", schema=llm_generation_guide)
                 )
 
-        response = self.model.chat.completions.create(
+        out = self._chat_completion(
             model=self.model_name,
             messages=message_history,
             response_format=response_format,
             temperature=self.temperature,
             max_tokens=max_completion_tokens,
         )
-
-        # easy to meet json errors
-        out = response.choices[0].message.content
-        out = fix_json(out)
         return out
 
     def _call_intern38b(self, message_history):
@@ -460,17 +818,28 @@ class RemoteModel:
                     type="json_schema", json_schema=dict(name="embodied_planning", schema=llm_generation_guide)
                 )
 
-        response = self.model.chat.completions.create(
+        out = self._chat_completion(
             model=self.model_name,
             messages=message_history,
             # response_format=response_format,
             temperature=self.temperature,
             max_tokens=max_completion_tokens,
         )
+        return out
+
+    def _call_remote_server(self, message_history):
+        if self.task_type == "manip":
+            schema = llm_generation_guide_manip if self.language_only else vlm_generation_guide_manip
+        else:
+            schema = llm_generation_guide if self.language_only else vlm_generation_guide
 
-        # easy to meet json errors
-        out = response.choices[0].message.content
-        out = fix_json(out)
+        out = self._chat_completion(
+            model=self.model_name,
+            messages=message_history,
+            response_format=dict(type="json_schema", json_schema=dict(name="embodied_planning", schema=schema)),
+            temperature=self.temperature,
+            max_tokens=max_completion_tokens,
+        )
         return out
 
 
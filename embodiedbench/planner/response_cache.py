@@ -0,0 +1,115 @@
+import os
+import json
+import time
+import hashlib
+from embodiedbench.main import logger
+
+CACHE_MODES = ['readwrite', 'replay']
+
+
+class CacheMissError(RuntimeError):
+    """Raised in replay mode when a request has no cached response."""
+    pass
+
+
+class ResponseCache():
+    """
+    Content-addressed on-disk cache of model responses.
+
+    Entries are keyed by a hash of the model name, the generation parameters and the normalized
+    message history, which includes the base64 image data, so a hit means the exact same request
+    was sent before. In 'readwrite' mode new responses are stored and the least recently used
+    entries are evicted once the cache grows beyond max_size_gb. In 'replay' mode the cache is
+    read-only and a miss raises CacheMissError instead of calling the model.
+    """
+    def __init__(self, cache_dir, mode='readwrite', max_size_gb=10.0):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown response cache mode: {mode}, choose from {CACHE_MODES}")
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.max_size = int(max_size_gb * 1024 ** 3)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_size = sum(size for _, _, size in self._scan())
+
+    @property
+    def replay(self):
+        return self.mode == 'replay'
+
+    def make_key(self, model_name, gen_params, message_history):
+        normalized = json.dumps(
+            {'model_name': model_name, 'gen_params': gen_params, 'messages': message_history},
+            sort_keys=True, separators=(',', ':'), ensure_ascii=False,
+        )
+        return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + '.json')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            if self.replay:
+                raise CacheMissError(f"No cached response for request {key} in {self.cache_dir}")
+            return None
+        self.hits += 1
+        if not self.replay:
+            # bump the modification time, eviction removes the least recently used entries first
+            os.utime(path)
+        return entry['response']
+
+    def put(self, key, response):
+        if self.replay:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'response': response, 'created': time.time()}, f, ensure_ascii=False)
+        # atomic rename, several evaluator processes may share one cache folder
+        os.replace(tmp_path, path)
+        self.total_size += os.path.getsize(path)
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def _scan(self):
+        entries = []
+        for sub_dir in os.scandir(self.cache_dir):
+            if not sub_dir.is_dir():
+                continue
+            for entry in os.scandir(sub_dir.path):
+                if entry.name.endswith('.json'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, entry.path, stat.st_size))
+        return entries
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is below 90% of its size limit."""
+        entries = sorted(self._scan())
+        self.total_size = sum(size for _, _, size in entries)
+        target_size = int(self.max_size * 0.9)
+        num_evicted = 0
+        for _, path, size in entries:
+            if self.total_size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.total_size -= size
+            num_evicted += 1
+        logger.info(f"Evicted {num_evicted} entries from the response cache {self.cache_dir}")
+
+
+def build_response_cache(config):
+    """Create the response cache described by the eval config, or None if it is disabled."""
+    cache_dir = config.get('response_cache_dir', None)
+    if not cache_dir:
+        return None
+    return ResponseCache(cache_dir, mode=config.get('response_cache_mode', 'readwrite'),
+                         max_size_gb=config.get('response_cache_max_gb', 10.0))
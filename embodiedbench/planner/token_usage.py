@@ -0,0 +1,99 @@
+import threading
+from contextlib import contextmanager
+
+# token counters kept by RemoteModel; image_tokens is the estimated share of the images in prompt_tokens
+USAGE_KEYS = ['prompt_tokens', 'completion_tokens', 'cached_prompt_tokens', 'image_tokens']
+# what is counted per planner step: the tokens, and the time spent waiting on rate limits and retries
+STEP_KEYS = USAGE_KEYS + ['throttled_seconds']
+# episode entries that are also summed over the run in the summary
+TOTAL_KEYS = USAGE_KEYS + ['total_tokens']
+
+_local = threading.local()
+
+
+class UsageCounter():
+    """Usage of one planner step. Model calls add to it from whichever thread runs them."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = dict.fromkeys(STEP_KEYS, 0)
+
+    def add(self, **counts):
+        with self.lock:
+            for key, value in counts.items():
+                self.values[key] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+
+class FanOutCounter():
+    """Adds to several counters at once, e.g. the rate limit wait of a batch shared by lockstep lanes."""
+    def __init__(self, counters):
+        self.counters = [counter for counter in counters if counter is not None]
+
+    def add(self, **counts):
+        for counter in self.counters:
+            counter.add(**counts)
+
+
+def current_counter():
+    """The counter the model calls of this thread are attributed to, or None."""
+    return getattr(_local, 'counter', None)
+
+
+@contextmanager
+def counting(counter):
+    previous = current_counter()
+    _local.counter = counter
+    try:
+        yield counter
+    finally:
+        _local.counter = previous
+
+
+def record_usage(**counts):
+    """Attribute usage to the counter of the calling thread, if any."""
+    counter = current_counter()
+    if counter is not None:
+        counter.add(**counts)
+
+
+def bind_counter(func):
+    """Wrap func to count into the caller's counter when it runs in another thread, e.g. an executor."""
+    counter = current_counter()
+
+    def wrapper(*args, **kwargs):
+        with counting(counter):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+class TokenUsage():
+    """
+    Token usage of a planner, per planner step and per episode. Each model call is wrapped in
+    `step`, and the model attributes the usage reported with every response to the counter of
+    that step, so planners sharing a model or a rate limiter (lockstep lanes, worker threads) are
+    counted apart. Requests still running when the step ends (e.g. cancelled candidates) are
+    added to the step that sent them.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.steps = []
+
+    @contextmanager
+    def step(self):
+        counter = UsageCounter()
+        self.steps.append(counter)
+        with counting(counter):
+            yield counter
+
+    def episode_stats(self):
+        steps = [counter.snapshot() for counter in self.steps]
+        stats = {key: sum(step[key] for step in steps) for key in STEP_KEYS}
+        stats['total_tokens'] = stats['prompt_tokens'] + stats['completion_tokens']
+        stats['tokens_per_planner_step'] = stats['total_tokens'] / len(steps) if len(steps) else 0.0
+        stats['step_usage'] = steps
+        return stats
@@ -1,14 +1,15 @@
-import torch
 import re
 import os
 import time
 import numpy as np
-import cv2
 import json
 from embodiedbench.planner.planner_config.generation_guide import llm_generation_guide, vlm_generation_guide
-from embodiedbench.planner.planner_utils import local_image_to_data_url, template, template_lang, fix_json
+from embodiedbench.planner.planner_utils import local_image_to_data_url, image_to_data_url, template, template_lang
+from embodiedbench.planner.plan_parser import load_plan_json
 from embodiedbench.planner.remote_model import RemoteModel
 from embodiedbench.planner.custom_model import CustomModel
+from embodiedbench.planner.token_usage import TokenUsage
+from embodiedbench.evaluator.latency import timed
 from embodiedbench.main import logger
 
 
@@ -28,6 +29,13 @@ class VLMPlanner:
         multistep=0,
         tp=1,
         temperature=0.0,
+        response_cache=None,
+        rate_limiter=None,
+        model=None,
+        prompt_caching=False,
+        context_budget=None,
+        stream=False,
+        num_candidates=1,
         kwargs={},
     ):
         self.model_name = model_name
@@ -36,24 +44,55 @@ class VLMPlanner:
         self.examples = examples
         self.n_shot = n_shot
         self.chat_history = chat_history  # whether to includ all the chat history for prompting
+        # send the static prompt prefix as a separate leading text block, so providers can cache it
+        self.prompt_caching = prompt_caching
+        self.last_prompt_prefix = None
+        # trims the chat history sent to the model, the full history is kept in episode_messages
+        self.context_budget = context_budget
+        # completions sampled concurrently per step, the first one with a valid plan is used
+        self.num_candidates = num_candidates
         self.set_actions(actions)
         self.model_type = model_type
-        if model_type == "custom":
+        if model is not None:
+            # shared with other planners, e.g. a lane of a BatchedModel
+            self.model = model
+        elif model_type == "custom":
             self.model = CustomModel(model_name, language_only)
         else:
-            self.model = RemoteModel(model_name, model_type, language_only, tp=tp, temperature=temperature)
+            self.model = RemoteModel(model_name, model_type, language_only, tp=tp, temperature=temperature,
+                                     response_cache=response_cache, rate_limiter=rate_limiter, prompt_caching=prompt_caching,
+                                     stream=stream)
 
         self.use_feedback = use_feedback
         self.multistep = multistep
         self.planner_steps = 0
         self.output_json_error = 0
+        self.token_usage = TokenUsage()
         self.language_only = language_only
         self.kwargs = kwargs
         self.action_key = kwargs.pop("action_key", "action_id")
 
     def set_actions(self, actions):
         self.actions = actions
+        if list(actions) == getattr(self, "prompt_actions", None):
+            return
         self.available_action_str = self.get_availabel_action_prompt(actions)
+        # system prompts formatted with the action list and the examples, rebuilt when the action space changes
+        self.prompt_actions = list(actions)
+        self.prompt_prefixes = {}
+
+    def get_prompt_prefix(self, example_heading):
+        if example_heading not in self.prompt_prefixes:
+            if self.n_shot >= 1:
+                prefix = self.system_prompt.format(
+                    len(self.actions) - 1,
+                    self.available_action_str,
+                    "\n\n".join([example_heading.format(i, x) for i, x in enumerate(self.examples[: self.n_shot])]),
+                )
+            else:
+                prefix = self.system_prompt.format(len(self.actions) - 1, self.available_action_str, "")
+            self.prompt_prefixes[example_heading] = prefix
+        return self.prompt_prefixes[example_heading]
 
     def get_availabel_action_prompt(self, available_actions):
         available_action_str = ""
@@ -63,19 +102,12 @@ class VLMPlanner:
                 available_action_str += ", "
         return available_action_str
 
+    @timed('process_prompt')
     def process_prompt(self, user_instruction, prev_act_feedback=[]):
         user_instruction = user_instruction.rstrip(".")
+        self.last_prompt_prefix = None
         if len(prev_act_feedback) == 0:
-            if self.n_shot >= 1:
-                prompt = self.system_prompt.format(
-                    len(self.actions) - 1,
-                    self.available_action_str,
-                    "\n\n".join(
-                        [f"## Task Execution Example {i}: \n {x}" for i, x in enumerate(self.examples[: self.n_shot])]
-                    ),
-                )
-            else:
-                prompt = self.system_prompt.format(len(self.actions) - 1, self.available_action_str, "")
+            prompt = self.last_prompt_prefix = self.get_prompt_prefix("## Task Execution Example {}: \n {}")
 
             prompt += f"\n\n## Now the human instruction is: {user_instruction}."
             if self.language_only:
@@ -101,16 +133,7 @@ class VLMPlanner:
             else:
                 prompt += f"""\n\n Considering the above interaction history and the current image state, to achieve the human instruction: '{user_instruction}', you are supposed to output in json. You need to describe current visual state from the image, summarize interaction history {'and environment feedback ' if self.use_feedback else ''}and reason why the last action or plan failed and did not finish the task, output your new plan to achieve the goal from current state. At the end, output the excutable plan with action ids(0 ~ {len(self.actions)-1}) from the available actions."""
         else:
-            if self.n_shot >= 1:
-                prompt = self.system_prompt.format(
-                    len(self.actions) - 1,
-                    self.available_action_str,
-                    "\n\n".join(
-                        [f"## Task Execution Example  {i}: \n {x}" for i, x in enumerate(self.examples[: self.n_shot])]
-                    ),
-                )
-            else:
-                prompt = self.system_prompt.format(len(self.actions) - 1, self.available_action_str, "")
+            prompt = self.last_prompt_prefix = self.get_prompt_prefix("## Task Execution Example  {}: \n {}")
             prompt += f"\n\n## Now the human instruction is: {user_instruction}."
             prompt += "\n\n The action history:"
             for i, action_feedback in enumerate(prev_act_feedback):
@@ -129,26 +152,30 @@ class VLMPlanner:
                 prompt += f"""\n\n Considering the above interaction history and the current image state, to achieve the human instruction: '{user_instruction}', you are supposed to output in json. You need to describe current visual state from the image, summarize interaction history {'and environment feedback ' if self.use_feedback else ''}and reason why the last action or plan failed and did not finish the task, output your new plan to achieve the goal from current state. At the end, output the excutable plan with action ids(0 ~ {len(self.actions)-1}) from the available actions."""
         return prompt
 
+    def get_prompt_content(self, prompt):
+        """Text items of the prompt, with the static prefix split off when prompt caching is on."""
+        prefix = self.last_prompt_prefix
+        if self.prompt_caching and prefix and prompt.startswith(prefix) and len(prompt) > len(prefix):
+            return [{"type": "text", "text": prefix}, {"type": "text", "text": prompt[len(prefix) :]}]
+        return [{"type": "text", "text": prompt}]
+
+    @timed('get_message')
     def get_message(self, image, prompt, messages=[]):
+        text_content = self.get_prompt_content(prompt)
         if self.language_only:
             return messages + [
                 {
                     "role": "user",
-                    "content": [{"type": "text", "text": prompt}],
+                    "content": text_content,
                 }
             ]
         else:
-            if type(image) == str:
-                image_path = image
-            else:
-                image_path = "./evaluation/tmp_{}.png".format(len(messages) // 2)
-                cv2.imwrite(image_path, image)
-
-            if self.multistep:  # handle multiple images
-                ind = int(image_path.split("step_")[-1].strip(".png"))
-                content = [{"type": "text", "text": prompt}]
+            if self.multistep and type(image) == str:  # handle multiple images
+                ind = int(re.search(r"step_(\d+)", os.path.basename(image)).group(1))
+                extension = os.path.splitext(image)[1]
+                content = list(text_content)
                 for i in range(max(ind - self.multistep + 1, 0), ind + 1):
-                    temp_path = "".join(image_path.split("step_")[:-1]) + f"step_{str(i)}.png"
+                    temp_path = "".join(image.split("step_")[:-1]) + f"step_{str(i)}{extension}"
                     temp_data_url = local_image_to_data_url(image_path=temp_path)
                     content.append(
                         {
@@ -159,7 +186,8 @@ class VLMPlanner:
                         }
                     )
             else:
-                data_url = local_image_to_data_url(image_path=image_path)
+                # numpy frames are encoded in memory
+                data_url = image_to_data_url(image)
                 content = [
                     {
                         "type": "image_url",
@@ -167,8 +195,10 @@ class VLMPlanner:
                             "url": data_url,
                         },
                     },
-                    {"type": "text", "text": prompt},
-                ]
+                ] + text_content
+                if len(text_content) > 1:
+                    # the cached prefix has to come before the image
+                    content = [text_content[0]] + content[:-2] + [text_content[1]]
 
             return messages + [
                 {
@@ -183,6 +213,9 @@ class VLMPlanner:
         self.episode_act_feedback = []
         self.planner_steps = 0
         self.output_json_error = 0
+        self.token_usage.reset()
+        if self.context_budget is not None:
+            self.context_budget.reset()
 
     def language_to_action(self, output_text):
         pattern = r"\*\*\d+\*\*"
@@ -196,7 +229,7 @@ class VLMPlanner:
 
     def json_to_action(self, output_text, json_key="executable_plan"):
         try:
-            json_object = json.loads(output_text)
+            json_object = load_plan_json(output_text)
             action = [x[self.action_key] for x in json_object[json_key]]
             if not len(action):
                 print("empty plan, stop here")
@@ -222,11 +255,17 @@ class VLMPlanner:
             action = -1
         return action
 
+    def is_valid_plan(self, output_text, json_key="executable_plan"):
+        """Whether the output parses into a non-empty plan of valid action ids."""
+        try:
+            plan = load_plan_json(output_text)[json_key]
+            return len(plan) > 0 and all(0 <= x[self.action_key] < len(self.actions) for x in plan)
+        except Exception:
+            return False
+
     def act_custom(self, prompt, obs):
         assert type(obs) == str  # input image path
         out = self.model.respond(prompt, obs)
-        # fix common generated json errors
-        out = fix_json(out)
         logger.debug(f"Model Output:\n{out}\n")
         action = self.json_to_action(out)
         self.planner_steps += 1
@@ -261,31 +300,22 @@ class VLMPlanner:
             else:
                 self.episode_messages = self.get_message(obs, prompt)
 
-        for entry in self.episode_messages:
+        messages_to_send = self.episode_messages
+        if self.chat_history and self.context_budget is not None:
+            messages_to_send = self.context_budget.apply(self.episode_messages)
+
+        for entry in messages_to_send:
             for content_item in entry["content"]:
                 if content_item["type"] == "text":
                     text_content = content_item["text"]
                     logger.debug(f"Model Input:\n{text_content}\n")
 
-        if "gemini-1.5-pro" in self.model_name or "gemini-2.0-flash" in self.model_name:
-            try:
-                out = self.model.respond(self.episode_messages)
-                time.sleep(15)
-            except Exception as e:
-                print("An unexpected error occurred:", e)
-                time.sleep(60)
-                out = self.model.respond(self.episode_messages)
-        else:
-            try:
-                out = self.model.respond(self.episode_messages)
-            except Exception as e:
-                print("An unexpected error occurred:", e)
-
-                if self.model_type != "local":
-                    time.sleep(60)
-                else:
-                    time.sleep(20)
-                out = self.model.respond(self.episode_messages)
+        # rate limiting and retries are handled by the model
+        with self.token_usage.step():
+            if self.num_candidates > 1 and hasattr(self.model, "respond_candidates"):
+                out = self.model.respond_candidates(messages_to_send, self.num_candidates, self.is_valid_plan)
+            else:
+                out = self.model.respond(messages_to_send)
         logger.debug(f"Model Output:\n{out}\n")
 
         if self.chat_history:
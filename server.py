@@ -1,14 +1,39 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+import io
 import os
+import json
+import time
+import uuid
+import base64
+import queue
+import threading
+from collections import Counter
+from concurrent.futures import Future
 from transformers import AutoProcessor, AutoModelForCausalLM, GenerationConfig, pipeline, Gemma3ForConditionalGeneration
 import torch
 from PIL import Image
 
 max_token = 1024
+# dynamic batching: requests arriving within max_wait seconds of the first queued one are generated together
+max_batch_size = 8
+max_wait = 0.05
 # model_path = "microsoft/Phi-4-multimodal-instruct"
 # model_path = 'AIDC-AI/Ovis2-16B'
 # model_path = 'AIDC-AI/Ovis2-34B'
 model_path = 'google/gemma-3-12b-it'
+# e.g. a tiny checkpoint of the same family for tests
+model_path = os.environ.get('SERVER_MODEL_PATH', model_path)
+
+def model_family(model_path):
+    """Family of a checkpoint (hub name or local path), which decides how it is loaded and prompted."""
+    if 'ovis' in model_path.lower():
+        return 'ovis'
+    if 'phi-4' in model_path.lower():
+        return 'phi4'
+    if 'gemma' in model_path.lower():
+        return 'gemma'
+    raise ValueError(f'Unsupported model {model_path}, server.py supports Phi-4, Ovis2 and Gemma 3 checkpoints')
+
 
 # Load the custom model
 class CustomModel:
@@ -16,8 +41,9 @@ class CustomModel:
         self.model_path = model_path
         self.language_only = language_only
         self.model_type = 'custom'
+        self.family = model_family(model_path)
 
-        if 'Ovis' in model_path:
+        if self.family == 'ovis':
             self.model = AutoModelForCausalLM.from_pretrained(model_path,
                                              torch_dtype=torch.bfloat16,
                                              multimodal_max_length=20000,
@@ -26,7 +52,7 @@ class CustomModel:
                                              device_map='auto')
             self.text_tokenizer = self.model.get_text_tokenizer()
             self.visual_tokenizer = self.model.get_visual_tokenizer()
-        elif 'Phi-4' in model_path:
+        elif self.family == 'phi4':
             self.processor = AutoProcessor.from_pretrained(model_path, trust_remote_code=True)
             self.model = AutoModelForCausalLM.from_pretrained(
                 model_path, 
@@ -36,27 +62,44 @@ class CustomModel:
                 attn_implementation="flash_attention_2"
             )
             self.generation_config = GenerationConfig.from_pretrained(model_path)
-        elif 'gemma' in model_path:
+        elif self.family == 'gemma':
             self.model = Gemma3ForConditionalGeneration.from_pretrained(
                 model_path, device_map="auto", torch_dtype=torch.bfloat16,
                 attn_implementation="eager"
             )
             self.processor = AutoProcessor.from_pretrained(model_path)
+            # batched generation appends the new tokens after left-padded prompts
+            self.processor.tokenizer.padding_side = 'left'
+
 
+    def respond(self, prompt, image=None):
+        return self.respond_chat(single_turn(prompt, image))
 
-    def respond(self, prompt, image_path=None):
-        if 'microsoft/Phi-4' in self.model_path:
-            user_prompt = '<|user|>'
-            assistant_prompt = '<|assistant|>'
-            prompt_suffix = '<|end|>'
-            formatted_prompt = f'{user_prompt}<|image_1|>{prompt}{prompt_suffix}{assistant_prompt}'
-            
-            image = Image.open(image_path)
-            inputs = self.processor(text=formatted_prompt, images=image, return_tensors='pt').to(self.model.device)
+    def respond_chat(self, conversation, max_new_tokens=max_token):
+        """
+        Response to a conversation: a list of messages with a role and a content list of
+        {"type": "text", "text": ...} and {"type": "image", "image": <PIL image>} items.
+        """
+        images = [item["image"] for message in conversation for item in message["content"] if item["type"] == "image"]
+        if self.family == 'phi4':
+            formatted_prompt = ''
+            num_images = 0
+            for message in conversation:
+                formatted_prompt += f'<|{message["role"]}|>'
+                for item in message["content"]:
+                    if item["type"] == "image":
+                        num_images += 1
+                        formatted_prompt += f'<|image_{num_images}|>'
+                    else:
+                        formatted_prompt += item["text"]
+                formatted_prompt += '<|end|>'
+            formatted_prompt += '<|assistant|>'
+
+            inputs = self.processor(text=formatted_prompt, images=images or None, return_tensors='pt').to(self.model.device)
             with torch.no_grad():
                 generate_ids = self.model.generate(
                     **inputs,
-                    max_new_tokens=max_token,  # Adjust as needed
+                    max_new_tokens=max_new_tokens,  # Adjust as needed
                     temperature=0.0,      # Adjust as needed
                     generation_config=self.generation_config,
                 )
@@ -65,11 +108,17 @@ class CustomModel:
             response = self.processor.batch_decode(
                 generate_ids, skip_special_tokens=True, clean_up_tokenization_spaces=False
             )[0]
-        elif 'Ovis' in self.model_path:
-            images = [Image.open(image_path)]
+        elif self.family == 'ovis':
             max_partition = 9
-            query = f'<image>\n{prompt}'
-            prompt, input_ids, pixel_values = self.model.preprocess_inputs(query, images, max_partition=max_partition)
+            roles = {'system': 'system', 'user': 'human', 'assistant': 'gpt'}
+            conversations = [
+                {
+                    "from": roles[message["role"]],
+                    "value": ''.join('<image>\n' if item["type"] == "image" else item["text"] for item in message["content"]),
+                }
+                for message in conversation
+            ]
+            prompt, input_ids, pixel_values = self.model.preprocess_inputs(conversations, images, max_partition=max_partition)
             attention_mask = torch.ne(input_ids, self.text_tokenizer.pad_token_id)
             input_ids = input_ids.unsqueeze(0).to(device=self.model.device)
             attention_mask = attention_mask.unsqueeze(0).to(device=self.model.device)
@@ -79,7 +128,7 @@ class CustomModel:
             # generate output
             with torch.inference_mode():
                 gen_kwargs = dict(
-                    max_new_tokens=max_token,
+                    max_new_tokens=max_new_tokens,
                     do_sample=False,
                     temperature=0.0,
                     repetition_penalty=None,
@@ -89,40 +138,184 @@ class CustomModel:
                 )
                 output_ids = self.model.generate(input_ids,  pixel_values=pixel_values, attention_mask=attention_mask, **gen_kwargs)[0]
                 response = self.text_tokenizer.decode(output_ids, skip_special_tokens=True)
+        elif self.family == 'gemma':
+            response = self.respond_batch([conversation], max_new_tokens)[0]
         else:
-            messages = [
+            raise ValueError(f'Unsupported model {self.model_path}')
+        return response
+
+    def respond_batch(self, conversations, max_new_tokens=max_token):
+        """
+        Responses to a batch of conversations, generated in one call for Gemma and one by one for the
+        other models. max_new_tokens is one limit for all the conversations or a list with the limit of each.
+        """
+        limits = max_new_tokens if type(max_new_tokens) == list else [max_new_tokens] * len(conversations)
+        if self.family != 'gemma':
+            return [self.respond_chat(conversation, limit) for conversation, limit in zip(conversations, limits)]
+        conversations = [
+            conversation if conversation[0]["role"] == "system" else [
                 {
                     "role": "system",
                     "content": [{"type": "text", "text": "You are a helpful assistant."}]
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "image", "url": image_path},
-                        {"type": "text", "text": prompt}
-                    ]
                 }
-            ]
-            inputs = self.processor.apply_chat_template(
-                        messages, add_generation_prompt=True, tokenize=True,
-                            return_dict=True, return_tensors="pt"
-                        ).to(self.model.device)
+            ] + conversation
+            for conversation in conversations
+        ]
+        inputs = self.processor.apply_chat_template(
+                    conversations, add_generation_prompt=True, tokenize=True, padding=True,
+                        return_dict=True, return_tensors="pt"
+                    ).to(self.model.device)
 
-            input_len = inputs["input_ids"].shape[-1]
-            print(input_len)
-            with torch.inference_mode():
-                generation = self.model.generate(**inputs, max_new_tokens=max_token, do_sample=False, temperature=0.0, use_cache=True)
-                generation = generation[0][input_len:]
+        input_len = inputs["input_ids"].shape[-1]
+        with torch.inference_mode():
+            generation = self.model.generate(**inputs, max_new_tokens=max(limits), do_sample=False, temperature=0.0, use_cache=True)
+            generation = generation[:, input_len:]
+
+        # greedy decoding, the first tokens of each row are what a generation with its own limit gives
+        return [self.processor.decode(tokens[:limit], skip_special_tokens=True) for tokens, limit in zip(generation, limits)]
+
+
+def single_turn(prompt, image=None):
+    content = [{"type": "text", "text": prompt}]
+    if image is not None:
+        content.insert(0, {"type": "image", "image": image})
+    return [{"role": "user", "content": content}]
+
+
+def decode_data_url(url):
+    """PIL image of a base64 data URL, decoded in memory."""
+    if not url.startswith('data:'):
+        raise ValueError('Only base64 data URLs are supported for images')
+    return Image.open(io.BytesIO(base64.b64decode(url.split(',', 1)[1]))).convert('RGB')
+
+
+def parse_chat_messages(messages):
+    """Conversation of respond_chat from OpenAI chat messages with text and image_url content parts."""
+    conversation = []
+    for message in messages:
+        content = message.get("content") or []
+        if type(content) == str:
+            content = [{"type": "text", "text": content}]
+        items = []
+        for part in content:
+            if part["type"] == "text":
+                items.append({"type": "text", "text": part["text"]})
+            elif part["type"] == "image_url":
+                url = part["image_url"]["url"] if type(part["image_url"]) == dict else part["image_url"]
+                items.append({"type": "image", "image": decode_data_url(url)})
+            else:
+                raise ValueError(f'Unsupported content type {part["type"]}')
+        conversation.append({"role": message["role"], "content": items})
+    return conversation
+
+
+def add_schema_instruction(conversation, response_format):
+    """
+    Ask for the JSON output described by an OpenAI response_format in the last user message.
+    Plain transformers generation cannot constrain the tokens, the schema is given in the prompt.
+    """
+    if not response_format or response_format.get("type") not in ["json_schema", "json_object"]:
+        return conversation
+    instruction = "\n\nRespond with a single JSON object"
+    schema = (response_format.get("json_schema") or {}).get("schema") or response_format.get("schema")
+    if schema:
+        instruction += f" that follows this JSON schema:\n{json.dumps(schema)}"
+    for message in reversed(conversation):
+        if message["role"] == "user":
+            message["content"].append({"type": "text", "text": instruction})
+            break
+    return conversation
+
+
+def extract_json(text):
+    """The outermost JSON object of a response, or the response itself if it has none."""
+    start, end = text.find('{'), text.rfind('}')
+    return text[start:end + 1] if 0 <= start < end else text
+
+
+class DynamicBatcher:
+    """
+    Queues the incoming requests and serves them from a single worker thread, which owns the
+    model. The worker takes the oldest request, waits at most max_wait seconds for more to
+    arrive and generates up to max_batch_size of them together, so concurrent evaluators share
+    the GPU instead of queueing one generate call each.
+    """
+    def __init__(self, model, max_batch_size=8, max_wait=0.05):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.num_requests = 0
+        self.batch_sizes = Counter()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, conversation, max_new_tokens=max_token):
+        """Queue a conversation, the returned future holds the response and the size of its batch."""
+        future = Future()
+        self.queue.put((conversation, max_new_tokens, future))
+        return future
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            conversations, max_new_tokens, futures = zip(*batch)
+            try:
+                responses = self.model.respond_batch(list(conversations), list(max_new_tokens))
+            except Exception as e:
+                if len(batch) == 1:
+                    futures[0].set_exception(e)
+                    continue
+                # a bad conversation fails the whole batch, the others are answered one at a time
+                for conversation, limit, future in batch:
+                    try:
+                        response = self.model.respond_batch([conversation], [limit])[0]
+                    except Exception as e:
+                        future.set_exception(e)
+                        continue
+                    self.add_batch(1)
+                    future.set_result((response, 1))
+                continue
+            self.add_batch(len(batch))
+            for future, response in zip(futures, responses):
+                future.set_result((response, len(batch)))
+
+    def add_batch(self, size):
+        with self.lock:
+            self.num_requests += size
+            self.batch_sizes[size] += 1
+
+    def stats(self):
+        with self.lock:
+            num_batches = sum(self.batch_sizes.values())
+            return {
+                'queue_depth': self.queue.qsize(),
+                'requests': self.num_requests,
+                'batches': num_batches,
+                'mean_batch_size': self.num_requests / num_batches if num_batches else 0.0,
+                'batch_sizes': {str(size): count for size, count in sorted(self.batch_sizes.items())},
+                'max_batch_size': self.max_batch_size,
+                'max_wait': self.max_wait,
+            }
 
-            response = self.processor.decode(generation, skip_special_tokens=True)
-        return response
 
 # Initialize Flask app and model
 app = Flask(__name__)
-UPLOAD_FOLDER = "uploads"
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 model = CustomModel(model_path=model_path, language_only=False)
+batcher = DynamicBatcher(model, max_batch_size=max_batch_size, max_wait=max_wait)
 
 @app.route('/process', methods=['POST'])
 def process_request():
@@ -135,14 +328,54 @@ def process_request():
     if image.filename == '':
         return jsonify({'error': 'No selected file'}), 400
 
-    # Save the image temporarily
-    image_path = os.path.join(UPLOAD_FOLDER, image.filename)
-    image.save(image_path)
+    # Decode the image in memory
+    image = Image.open(io.BytesIO(image.read())).convert('RGB')
+
+    # Generate response from the model, batched with the concurrent requests
+    queue_depth = batcher.queue.qsize()
+    try:
+        model_response, batch_size = batcher.submit(single_turn(sentence, image)).result()
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({'response': model_response, 'batch_size': batch_size, 'queue_depth': queue_depth})
+
+@app.route('/v1/chat/completions', methods=['POST'])
+def chat_completions():
+    """OpenAI-compatible chat endpoint, so RemoteModel can use the server through remote_url."""
+    body = request.get_json()
+    if not body or not body.get('messages'):
+        return jsonify({'error': {'message': 'Missing messages'}}), 400
+    try:
+        conversation = add_schema_instruction(parse_chat_messages(body['messages']), body.get('response_format'))
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': {'message': f'Invalid messages: {e}'}}), 400
+    max_new_tokens = min(body.get('max_tokens') or max_token, max_token)
+
+    try:
+        model_response, _ = batcher.submit(conversation, max_new_tokens).result()
+    except Exception as e:
+        return jsonify({'error': {'message': str(e)}}), 500
+    if body.get('response_format'):
+        model_response = extract_json(model_response)
 
-    # Generate response from the model
-    model_response = model.respond(sentence, image_path=image_path)
+    completion = {
+        'id': f'chatcmpl-{uuid.uuid4().hex}',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', model_path),
+    }
+    if body.get('stream'):
+        # the response is generated as a whole, it is sent as a single chunk to streaming clients
+        chunk = dict(completion, object='chat.completion.chunk',
+                     choices=[{'index': 0, 'delta': {'role': 'assistant', 'content': model_response}, 'finish_reason': 'stop'}])
+        return Response(f'data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n', mimetype='text/event-stream')
+    completion['choices'] = [{'index': 0, 'message': {'role': 'assistant', 'content': model_response}, 'finish_reason': 'stop'}]
+    return jsonify(completion)
 
-    return jsonify({'response': model_response})
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(batcher.stats())
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=23333)
+    app.run(host='0.0.0.0', port=23333, threaded=True)
@@ -0,0 +1,29 @@
+import json
+
+import pytest
+
+from embodiedbench.planner.plan_parser import load_plan_json, parse_json
+
+
+def test_truncated_before_first_action_is_an_error():
+    with pytest.raises(json.JSONDecodeError):
+        load_plan_json('{"executable_plan": [{"action_id": -')
+
+
+def test_unbalanced_quotes_losing_the_plan_is_an_error():
+    with pytest.raises(json.JSONDecodeError):
+        load_plan_json('{"executable_plan": [{"action_id": 3, "action_name": "a""}]}')
+
+
+def test_empty_plan_is_kept():
+    assert load_plan_json('{"executable_plan": []}') == {"executable_plan": []}
+    assert load_plan_json('```json\n{"executable_plan": [ ], }\n```') == {"executable_plan": []}
+
+
+def test_truncated_plan_keeps_complete_actions():
+    text = '{"executable_plan": [{"action_id": 2, "action_name": "go"}, {"action_id": 1'
+    assert load_plan_json(text) == {"executable_plan": [{"action_id": 2, "action_name": "go"}]}
+
+
+def test_quote_before_next_key_ends_string():
+    assert parse_json('{"a": "x" "b": 2}') == {"a": "x", "b": 2}
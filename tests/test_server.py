@@ -0,0 +1,111 @@
+"""
+End-to-end test of the OpenAI-compatible endpoint of server.py on CPU, with a tiny random
+checkpoint of a supported model family (Gemma 3) instead of the served model:
+
+    pip install flask torch transformers accelerate openai httpx pytest
+    python -m pytest tests/test_server.py
+
+The checkpoint can be changed with SERVER_MODEL_PATH.
+"""
+import io
+import os
+import sys
+import base64
+import functools
+
+import pytest
+
+pytest.importorskip("flask")
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+openai = pytest.importorskip("openai")
+httpx = pytest.importorskip("httpx")
+from PIL import Image
+
+TINY_MODEL_PATH = "trl-internal-testing/tiny-Gemma3ForConditionalGeneration"
+SCHEMA = {
+    "type": "object",
+    "properties": {"executable_plan": {"type": "array", "items": {"type": "object"}}},
+    "required": ["executable_plan"],
+}
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope="module")
+def server():
+    os.environ.setdefault("SERVER_MODEL_PATH", TINY_MODEL_PATH)
+    import server
+    return server
+
+
+@pytest.fixture
+def conversations(server, monkeypatch):
+    """Keeps the generations short and records the conversations given to the model."""
+    monkeypatch.setattr(server, "max_token", 16)
+    seen = []
+    respond_batch = server.model.respond_batch
+
+    def recording_respond_batch(batch, max_new_tokens):
+        seen.extend(batch)
+        return respond_batch(batch, max_new_tokens)
+    monkeypatch.setattr(server.model, "respond_batch", recording_respond_batch)
+    return seen
+
+
+def data_url(color):
+    buffer = io.BytesIO()
+    Image.new("RGB", (32, 32), color).save(buffer, format="PNG")
+    return "data:image/png;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def messages():
+    return [
+        {"role": "system", "content": "You are a robot."},
+        {"role": "user", "content": [
+            {"type": "image_url", "image_url": {"url": data_url("red")}},
+            {"type": "image_url", "image_url": {"url": data_url("blue")}},
+            {"type": "text", "text": "Plan the next actions."},
+        ]},
+    ]
+
+
+def test_chat_completions(server, conversations):
+    response = server.app.test_client().post("/v1/chat/completions", json={
+        "model": TINY_MODEL_PATH,
+        "messages": messages(),
+        "response_format": {"type": "json_schema", "json_schema": {"name": "embodied_planning", "schema": SCHEMA}},
+        "max_tokens": 8,
+    })
+    assert response.status_code == 200
+    completion = response.get_json()
+    assert completion["object"] == "chat.completion"
+    assert isinstance(completion["choices"][0]["message"]["content"], str)
+
+    # both images reach the model, and the schema is asked for in the prompt
+    conversation = conversations[-1]
+    user_items = conversation[-1]["content"]
+    assert sum(item["type"] == "image" for item in user_items) == 2
+    assert "executable_plan" in user_items[-1]["text"]
+
+
+def test_chat_completions_rejects_bad_image(server):
+    response = server.app.test_client().post("/v1/chat/completions", json={
+        "messages": [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": "http://example.com/a.png"}}]}],
+    })
+    assert response.status_code == 400
+
+
+def test_remote_model(server, conversations, monkeypatch):
+    from embodiedbench.planner import remote_model
+
+    # the OpenAI client of remote_url sends its requests to the Flask app in-process
+    http_client = httpx.Client(transport=httpx.WSGITransport(app=server.app))
+    monkeypatch.setattr(openai, "OpenAI", functools.partial(openai.OpenAI, api_key="test", http_client=http_client))
+    monkeypatch.setattr(remote_model, "remote_url", "http://testserver/v1")
+    monkeypatch.setattr(remote_model, "_clients", {})
+
+    model = remote_model.RemoteModel(TINY_MODEL_PATH, task_type="alfred")
+    out = model.respond(messages())
+    assert isinstance(out, str)
+    assert sum(item["type"] == "image" for item in conversations[-1][-1]["content"]) == 2